@@ -1,8 +1,7 @@
 import os
+import re
 import threading
-import psycopg2
-from psycopg2 import pool
-from psycopg2.extras import RealDictCursor
+from api import metrics
 
 db_pool = None
 db_alive = True
@@ -28,6 +27,55 @@ def load_env_if_needed():
             print(f"[db] Failed to load .env: {e}")
             pass
 
+# ============================================================
+# Query instrumentation
+# 以 connection_factory 包裝 cursor，每次 execute 記錄一個 db.query span。
+# 呼叫端指定的 cursor_factory（如 RealDictCursor）會被保留。
+# ============================================================
+_SQL_TABLE = re.compile(r'\b(?:FROM|INTO|UPDATE|TABLE)\s+(?:IF\s+(?:NOT\s+)?EXISTS\s+)?([A-Za-z_][A-Za-z0-9_]*)', re.IGNORECASE)
+_TIMED_CURSORS = {}
+_CONNECTION_CLASS = None
+
+
+def _query_labels(query):
+    if isinstance(query, bytes):
+        query = query.decode("utf-8", "replace")
+    query = str(query).lstrip()
+    op = query.split(None, 1)[0].upper() if query else "UNKNOWN"
+    match = _SQL_TABLE.search(query)
+    return {"op": op, "table": match.group(1).lower() if match else None}
+
+
+def _timed_cursor(base):
+    cls = _TIMED_CURSORS.get(base)
+    if cls is None:
+        class TimedCursor(base):
+            def execute(self, query, vars=None):
+                with metrics.span("db.query", **_query_labels(query)):
+                    return super().execute(query, vars)
+
+            def executemany(self, query, vars_list):
+                with metrics.span("db.query", **_query_labels(query)):
+                    return super().executemany(query, vars_list)
+
+        cls = _TIMED_CURSORS[base] = TimedCursor
+    return cls
+
+
+def _instrumented_connection_class():
+    global _CONNECTION_CLASS
+    if _CONNECTION_CLASS is None:
+        from psycopg2.extensions import connection, cursor as base_cursor
+
+        class InstrumentedConnection(connection):
+            def cursor(self, *args, **kwargs):
+                kwargs["cursor_factory"] = _timed_cursor(kwargs.get("cursor_factory") or self.cursor_factory or base_cursor)
+                return super().cursor(*args, **kwargs)
+
+        _CONNECTION_CLASS = InstrumentedConnection
+    return _CONNECTION_CLASS
+
+
 def get_db_connection():
     global db_pool, db_alive, db_fail_count
     
@@ -49,10 +97,13 @@ def get_db_connection():
                 if not db_url:
                     return None
                     
+                # [Optimization] psycopg2 於第一次取連線時才載入
+                from psycopg2 import pool
                 db_pool = pool.ThreadedConnectionPool(
                     1, 20,
                     db_url,
-                    connect_timeout=10
+                    connect_timeout=10,
+                    connection_factory=_instrumented_connection_class()
                 )
                 print("Database connection pool created (Lazy).")
                 db_fail_count = 0
@@ -63,17 +114,19 @@ def get_db_connection():
                     print("Disabling DB attempts (Circuit Breaker).")
                     db_alive = False
                 try:
-                    return psycopg2.connect(db_url, connect_timeout=10)
+                    import psycopg2
+                    return psycopg2.connect(db_url, connect_timeout=10, connection_factory=_instrumented_connection_class())
                 except Exception as e:
                     print(f"[db] Direct connect fallback error: {e}")
                     return None
     
     try:
-        conn = db_pool.getconn()
-        return conn
+        with metrics.span("db.checkout"):
+            conn = db_pool.getconn()
     except Exception as e:
         print(f"Pool delivery error: {e}")
         return None
+    return conn
 
 def return_db_connection(conn):
     if not conn: return
@@ -87,53 +140,322 @@ def return_db_connection(conn):
         try: conn.close()
         except: pass
 
+def run_in_savepoint(cur, name, fn, *args, **kwargs):
+    """
+    在呼叫端的交易中以 SAVEPOINT 執行附帶工作（例如物化表刷新）。
+    失敗時只回滾這一段並記錄，主要寫入照常 commit；成功回傳 True。
+    連線中斷時 ROLLBACK TO 本身會失敗，例外照常拋給呼叫端。
+    """
+    cur.execute(f"SAVEPOINT {name}")
+    try:
+        fn(*args, **kwargs)
+    except Exception as e:
+        cur.execute(f"ROLLBACK TO SAVEPOINT {name}")
+        print(f"[db] {name} skipped: {e}")
+        return False
+    cur.execute(f"RELEASE SAVEPOINT {name}")
+    return True
+
+# ============================================================
+# Schema Migrations
+# 依版本號順序套用，已套用的版本記錄於 schema_migrations 表。
+# 新的 schema 變更只需在列表尾端追加 (version, description, [SQL...])。
+# Migration 只由 init_db（部署時執行 scripts/migrate_db.py，package.json 的 build 會先跑）套用，
+# 不在請求路徑上執行：部分步驟（如 stock_cache 的 generated column）會在 ACCESS EXCLUSIVE 鎖下重寫整張表。
+# 依賴新表 / 新欄位的程式以 has_schema(version) 判斷，未套用時退回舊做法而非失敗。
+# ============================================================
+MIGRATIONS = [
+    (1, "base tables", [
+        # Stock Cache Table
+        """
+        CREATE TABLE IF NOT EXISTS stock_cache (
+            symbol TEXT PRIMARY KEY,
+            data JSONB,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        """,
+        # Users Table
+        """
+        CREATE TABLE IF NOT EXISTS users (
+            id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+            nickname TEXT UNIQUE NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        """,
+        # Portfolio Table
+        """
+        CREATE TABLE IF NOT EXISTS portfolio_items (
+            id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+            user_id UUID REFERENCES users(id),
+            symbol TEXT NOT NULL,
+            entry_price NUMERIC NOT NULL,
+            entry_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        """,
+        # Stock Names Table (Master List)
+        """
+        CREATE TABLE IF NOT EXISTS stock_names (
+            symbol TEXT PRIMARY KEY,
+            name TEXT NOT NULL,
+            type TEXT,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        """,
+    ]),
+    (2, "stock_cache typed columns for trending queries", [
+        # Generated columns: 只在 JSON 值為數字時轉型，避免髒資料讓寫入失敗
+        """
+        ALTER TABLE stock_cache
+            ADD COLUMN IF NOT EXISTS market TEXT GENERATED ALWAYS AS (
+                CASE WHEN symbol ~ '^[0-9]+$' THEN 'TW' ELSE 'US' END
+            ) STORED,
+            ADD COLUMN IF NOT EXISTS price NUMERIC GENERATED ALWAYS AS (
+                CASE WHEN jsonb_typeof(data->'price') = 'number' THEN (data->>'price')::numeric END
+            ) STORED,
+            ADD COLUMN IF NOT EXISTS volume NUMERIC GENERATED ALWAYS AS (
+                CASE WHEN jsonb_typeof(data->'volume') = 'number' THEN (data->>'volume')::numeric END
+            ) STORED,
+            ADD COLUMN IF NOT EXISTS f_score NUMERIC GENERATED ALWAYS AS (
+                CASE WHEN jsonb_typeof(data->'fScore') = 'number' THEN (data->>'fScore')::numeric END
+            ) STORED,
+            ADD COLUMN IF NOT EXISTS technical_rating NUMERIC GENERATED ALWAYS AS (
+                CASE WHEN jsonb_typeof(data->'technicalRating') = 'number' THEN (data->>'technicalRating')::numeric END
+            ) STORED;
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_stock_cache_market_volume ON stock_cache (market, volume DESC NULLS LAST);",
+        "CREATE INDEX IF NOT EXISTS idx_stock_cache_market_quality ON stock_cache (market, f_score DESC NULLS LAST, technical_rating DESC NULLS LAST);",
+    ]),
+    (3, "materialized leaderboard", [
+        """
+        CREATE TABLE IF NOT EXISTS leaderboard_entries (
+            portfolio_id UUID PRIMARY KEY REFERENCES portfolio_items(id) ON DELETE CASCADE,
+            user_id UUID NOT NULL,
+            nickname TEXT,
+            symbol TEXT NOT NULL,
+            entry_price NUMERIC,
+            entry_date TIMESTAMP,
+            current_price NUMERIC,
+            return_pct NUMERIC NOT NULL DEFAULT 0,
+            refreshed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS leaderboard_users (
+            user_id UUID PRIMARY KEY,
+            nickname TEXT,
+            positions INTEGER NOT NULL DEFAULT 0,
+            avg_return NUMERIC NOT NULL DEFAULT 0,
+            best_return NUMERIC,
+            worst_return NUMERIC,
+            refreshed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_leaderboard_entries_return ON leaderboard_entries (return_pct DESC, portfolio_id);",
+        "CREATE INDEX IF NOT EXISTS idx_leaderboard_entries_user ON leaderboard_entries (user_id);",
+        "CREATE INDEX IF NOT EXISTS idx_leaderboard_users_return ON leaderboard_users (avg_return DESC, user_id);",
+        "CREATE INDEX IF NOT EXISTS idx_portfolio_items_symbol ON portfolio_items (symbol);",
+        # Backfill
+        """
+        INSERT INTO leaderboard_entries (
+            portfolio_id, user_id, nickname, symbol, entry_price, entry_date, current_price, return_pct
+        )
+        SELECT p.id, p.user_id, u.nickname, p.symbol, p.entry_price, p.entry_date, COALESCE(s.price, 0),
+               CASE WHEN p.entry_price > 0 AND s.price > 0
+                    THEN ROUND((s.price - p.entry_price) / p.entry_price * 100, 2) ELSE 0 END
+        FROM portfolio_items p
+        JOIN users u ON p.user_id = u.id
+        LEFT JOIN stock_cache s ON p.symbol = s.symbol
+        ON CONFLICT (portfolio_id) DO NOTHING;
+        """,
+        """
+        INSERT INTO leaderboard_users (user_id, nickname, positions, avg_return, best_return, worst_return)
+        SELECT user_id, MAX(nickname), COUNT(*), ROUND(AVG(return_pct), 2), MAX(return_pct), MIN(return_pct)
+        FROM leaderboard_entries
+        GROUP BY user_id
+        ON CONFLICT (user_id) DO NOTHING;
+        """,
+    ]),
+    (4, "stock_names sync state", [
+        # 每個名稱來源的內容雜湊與解析結果；來源未變動時直接重用 entries
+        """
+        CREATE TABLE IF NOT EXISTS name_sync_state (
+            source TEXT PRIMARY KEY,
+            content_hash TEXT NOT NULL,
+            entries JSONB NOT NULL,
+            synced_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_stock_names_updated_at ON stock_names (updated_at);",
+    ]),
+    (5, "daily price history and shared market regimes", [
+        # 日線歷史（個股與指數共用）；DOUBLE PRECISION 讓 NumPy 載入時不需經過 Decimal 轉換
+        """
+        CREATE TABLE IF NOT EXISTS daily_prices (
+            symbol TEXT NOT NULL,
+            date DATE NOT NULL,
+            open DOUBLE PRECISION,
+            high DOUBLE PRECISION,
+            low DOUBLE PRECISION,
+            close DOUBLE PRECISION NOT NULL,
+            volume DOUBLE PRECISION,
+            PRIMARY KEY (symbol, date)
+        );
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_daily_prices_date ON daily_prices (date);",
+        # 各市場最新的市場狀態，所有 worker 共用同一次計算結果
+        """
+        CREATE TABLE IF NOT EXISTS market_regimes (
+            market TEXT PRIMARY KEY,
+            index_symbol TEXT NOT NULL,
+            regime TEXT NOT NULL,
+            details JSONB,
+            computed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        """,
+    ]),
+    (6, "leaderboard recent-first index", [
+        # 排行榜預設依紀錄時間（最新在前）分頁
+        "CREATE INDEX IF NOT EXISTS idx_leaderboard_entries_date ON leaderboard_entries (entry_date DESC, portfolio_id);",
+    ]),
+    (7, "market regime retry state", [
+        # 計算失敗也記錄嘗試時間與連續失敗次數，所有 worker 依此退避
+        """
+        ALTER TABLE market_regimes
+            ADD COLUMN IF NOT EXISTS attempted_at TIMESTAMP,
+            ADD COLUMN IF NOT EXISTS failures INTEGER NOT NULL DEFAULT 0;
+        """,
+    ]),
+    (8, "stock_cache freshness checks", [
+        # 重新抓取後內容未變動時只記錄檢查時間，不改寫 stock_cache 的整份文件
+        """
+        CREATE TABLE IF NOT EXISTS stock_cache_checks (
+            symbol TEXT PRIMARY KEY,
+            checked_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+        );
+        """,
+    ]),
+    (9, "prediction records", [
+        # PerformanceTracker 的預測與結算結果，所有 worker 與排程共用（取代各容器的 /tmp 檔案）
+        """
+        CREATE TABLE IF NOT EXISTS prediction_records (
+            symbol TEXT NOT NULL,
+            strategy_id TEXT NOT NULL DEFAULT '',
+            predicted_on DATE NOT NULL,
+            record JSONB NOT NULL,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (symbol, strategy_id, predicted_on)
+        );
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_prediction_records_date ON prediction_records (predicted_on);",
+    ]),
+]
+
+# pg_advisory_lock 的 key，確保多個部署程序同時執行時只有一個在跑 migration
+_MIGRATION_LOCK_KEY = 20260216
+
+# 請求路徑只讀取已套用的版本（不執行 migration），每個程序最多每 _SCHEMA_CHECK_INTERVAL 秒查一次
+_SCHEMA_CHECK_INTERVAL = 300
+_schema_version = (0, 0.0)   # (version, checked_at)
+
+
+def schema_version():
+    """
+    DB 已套用的最新 migration 版本；schema_migrations 不存在時為 0。
+    無法連線時沿用上次的結果（未曾查詢成功則為 0）。
+    """
+    global _schema_version
+    import time
+    version, checked_at = _schema_version
+    now = time.time()
+    if checked_at and now - checked_at < _SCHEMA_CHECK_INTERVAL:
+        return version
+    conn = get_db_connection()
+    if not conn:
+        return version
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT to_regclass('schema_migrations') IS NOT NULL")
+        if cur.fetchone()[0]:
+            cur.execute("SELECT COALESCE(MAX(version), 0) FROM schema_migrations")
+            version = cur.fetchone()[0]
+        else:
+            version = 0
+        conn.commit()
+        cur.close()
+        _schema_version = (version, now)
+        if version < MIGRATIONS[-1][0]:
+            print(f"[db] Schema at version {version}, latest is {MIGRATIONS[-1][0]}; run scripts/migrate_db.py")
+    except Exception as e:
+        print(f"[db] Schema version check failed: {e}")
+        try: conn.rollback()
+        except Exception: pass
+    finally:
+        return_db_connection(conn)
+    return version
+
+
+def has_schema(version):
+    """指定版本的 migration 已套用時回傳 True；未套用時呼叫端應退回不依賴新表 / 新欄位的做法"""
+    return schema_version() >= version
+
+def run_migrations(conn):
+    """套用尚未執行的 migration，回傳本次套用的版本列表"""
+    applied_now = []
+    cur = conn.cursor()
+    try:
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version INTEGER PRIMARY KEY,
+                description TEXT,
+                applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            );
+        """)
+        conn.commit()
+
+        # Fast path: 已是最新版本時只需一次查詢
+        cur.execute("SELECT COALESCE(MAX(version), 0) FROM schema_migrations")
+        if cur.fetchone()[0] >= MIGRATIONS[-1][0]:
+            return applied_now
+
+        cur.execute("SELECT pg_advisory_lock(%s)", (_MIGRATION_LOCK_KEY,))
+        try:
+            cur.execute("SELECT version FROM schema_migrations")
+            applied = {r[0] for r in cur.fetchall()}
+            for version, description, statements in MIGRATIONS:
+                if version in applied:
+                    continue
+                for statement in statements:
+                    cur.execute(statement)
+                cur.execute(
+                    "INSERT INTO schema_migrations (version, description) VALUES (%s, %s)",
+                    (version, description)
+                )
+                conn.commit()
+                applied_now.append(version)
+                print(f"[db] Applied migration {version}: {description}")
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cur.execute("SELECT pg_advisory_unlock(%s)", (_MIGRATION_LOCK_KEY,))
+            conn.commit()
+    finally:
+        cur.close()
+    return applied_now
+
 def init_db():
+    """套用所有尚未執行的 migration；回傳本次套用的版本列表，DB 無法連線或失敗時回傳 None"""
     try:
         conn = get_db_connection()
         if not conn:
             print("Skipping DB Init: Database unreachable.")
-            return
+            return None
         try:
-            cur = conn.cursor()
-            # Stock Cache Table
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS stock_cache (
-                    symbol TEXT PRIMARY KEY,
-                    data JSONB,
-                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                );
-            """)
-            # Users Table
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS users (
-                    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
-                    nickname TEXT UNIQUE NOT NULL,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                );
-            """)
-            # Portfolio Table
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS portfolio_items (
-                    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
-                    user_id UUID REFERENCES users(id),
-                    symbol TEXT NOT NULL,
-                    entry_price NUMERIC NOT NULL,
-                    entry_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                );
-            """)
-            # Stock Names Table (Master List)
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS stock_names (
-                    symbol TEXT PRIMARY KEY,
-                    name TEXT NOT NULL,
-                    type TEXT,
-                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                );
-            """)
-            conn.commit()
-            cur.close()
+            applied = run_migrations(conn)
             print("Database initialized successfully.")
+            return applied
         finally:
             return_db_connection(conn)
     except Exception as e:
         print(f"init_db failed: {e}")
+        return None
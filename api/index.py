@@ -1,19 +1,26 @@
 from http.server import BaseHTTPRequestHandler
 from urllib.parse import urlparse, parse_qs
 import json
+import os
 import re
+import hmac
 import threading
-from pathlib import Path
 
 # Modular Imports
-from api.db import get_db_connection, return_db_connection, init_db
+from api.db import get_db_connection, return_db_connection, init_db, has_schema, run_in_savepoint
 from api.constants import TW_STOCK_NAMES
-from api.services.stock_service import StockService
-from functools import lru_cache
+from api.services.leaderboard_service import LeaderboardService, LeaderboardError
+from api.services.portfolio_service import PortfolioService
+from api.services.state_store import STRATEGY_CONFIG
+from api import metrics, profiling
 
 # Non-blocking DB Initialization (Lazy-loaded inside db.py get_db_connection)
 # Legacy: threading.Thread(target=init_db, daemon=True).start()
 
+# [Optimization] StockService（連帶 scrapers / tvscreener / yfinance）只在需要的路由內載入，
+# /health、/leaderboard、/metrics 等請求不必付出重量級相依的匯入成本。
+# scripts/benchmark_startup.py 會檢查 import api.index 的耗時與是否誤載入重量級模組。
+
 # Initialize Stock Names (Empty start, lazy load if needed)
 # Legacy code removed: No longer fetching full list on startup.
 # Usage updates handled by scripts/sync_names.py and DB.
@@ -24,30 +31,94 @@ TW_STOCK_NAMES.update({})
 # SWR mechanism in StockService handles background refreshes on first request.
 # threading.Thread(target=pre_warm_cache, daemon=True).start()
 
-@lru_cache(maxsize=1)
 def load_strategy_config():
-    try:
-        config_path = Path(__file__).parent / "strategy_config.json"
-        if config_path.exists():
-            with open(config_path, "r", encoding="utf-8") as f:
-                return json.load(f)
-    except Exception as e:
-        print(f"[API] Error loading strategy config: {e}")
-    return {}
+    # StateStore 依 mtime 失效快取：進化寫入新參數後不必重啟即可生效
+    return STRATEGY_CONFIG.read()
+
+# /metrics 的 route label 只使用已知的 action，避免任意輸入造成 label 爆量
+_POST_ACTIONS = (
+    'register_user', 'list_users', 'update_nickname', 'add_portfolio', 'delete_portfolio',
+    'update_portfolio_all', 'get_quote', 'get_portfolio', 'get_portfolio_valuation', 'trigger_evolution'
+)
+
+
+def _get_route(parsed, q):
+    """GET 請求的路由判斷（依序比對，與 do_GET 分派一致）"""
+    action = q.get('action', [None])[0]
+    if 'leaderboard' in q or '/leaderboard' in parsed.path:
+        return 'leaderboard'
+    if action == 'get_quote':
+        return 'get_quote'
+    if parsed.path.endswith('/search') or action == 'autocomplete':
+        return 'search'
+    if parsed.path.endswith('/screen') or action == 'screen':
+        return 'screen'
+    if 'trending' in q or '/market/trending' in parsed.path:
+        return 'trending'
+    if 'symbol' in q:
+        return 'symbol'
+    if parsed.path.endswith('/health'):
+        return 'health'
+    if parsed.path.endswith('/evolution'):
+        return 'evolution'
+    if parsed.path.endswith('/metrics'):
+        return 'metrics'
+    if parsed.path.endswith('/cron/settle'):
+        return 'settle'
+    return 'not_found'
+
+
+def _refresh_leaderboard(cur, refresh, *args, **kwargs):
+    """
+    持倉 / 使用者變動後在同一交易中刷新排行榜物化表。
+    物化表尚未建立（migration 3 未套用）或刷新失敗時略過，不影響使用者的操作本身。
+    """
+    if has_schema(3):
+        run_in_savepoint(cur, "leaderboard_refresh", refresh, cur, *args, **kwargs)
+
+
+# /api/cron/settle 補抓日線的時間上限（秒），需小於 vercel.json 的 maxDuration
+_CRON_FETCH_BUDGET = float(os.environ.get("CRON_FETCH_BUDGET", "30"))
+
+
+def _cron_authorized(headers):
+    """Vercel Cron 以 Authorization: Bearer $CRON_SECRET 呼叫；未設定 CRON_SECRET 時一律拒絕"""
+    secret = os.environ.get("CRON_SECRET")
+    if not secret or headers is None:
+        return False
+    return hmac.compare_digest(headers.get("Authorization", ""), f"Bearer {secret}")
+
 
 class handler(BaseHTTPRequestHandler):
+    def _write_json(self, data, **kwargs):
+        with metrics.span("serialize"):
+            body = json.dumps(data, **kwargs).encode('utf-8')
+        self.wfile.write(body)
+
     def _set_headers(self):
         self.send_response(200)
         self.send_header('Content-type', 'application/json')
         self.send_header('Access-Control-Allow-Origin', '*')
         self.send_header('Access-Control-Allow-Methods', 'GET, POST, OPTIONS')
-        self.send_header('Access-Control-Allow-Headers', 'Content-Type')
+        self.send_header('Access-Control-Allow-Headers', f'Content-Type, {profiling.DEBUG_HEADER}')
         self.end_headers()
 
+    def _write_error(self, status, message):
+        self.send_response(status)
+        self.send_header('Content-type', 'application/json')
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.end_headers()
+        self._write_json({"error": message})
+
     def do_OPTIONS(self):
         self._set_headers()
 
     def do_POST(self):
+        with profiling.profile_request("POST", self.path, self.headers), \
+                metrics.span("http.request", method="POST", route="unknown") as labels:
+            self._handle_post(labels)
+
+    def _handle_post(self, labels):
         self._set_headers()
         try:
             content_length = int(self.headers['Content-Length'])
@@ -55,16 +126,18 @@ class handler(BaseHTTPRequestHandler):
             data = json.loads(post_data.decode('utf-8'))
             
             action = data.get('action')
+            if action in _POST_ACTIONS:
+                labels["route"] = action
             conn = get_db_connection()
             if conn is None:
-                self.wfile.write(json.dumps({"error": "Database connection failed"}).encode('utf-8'))
+                self._write_json({"error": "Database connection failed"})
                 return
             cur = conn.cursor()
 
             if action == 'register_user':
                 nickname, user_id = data.get('nickname'), data.get('id')
                 if not user_id:
-                    self.wfile.write(json.dumps({"error": "Missing ID"}).encode('utf-8'))
+                    self._write_json({"error": "Missing ID"})
                     return
                 # UPSERT logic: Insert id and nickname. If id exists, update nickname.
                 # If nickname exists for ANOTHER id, this will handle via DB unique constraint if applicable.
@@ -76,23 +149,25 @@ class handler(BaseHTTPRequestHandler):
                         RETURNING id, nickname
                     """, (user_id, nickname))
                     res = cur.fetchone()
+                    _refresh_leaderboard(cur, LeaderboardService.refresh_with_cursor, user_ids=[user_id])
                     conn.commit()
-                    self.wfile.write(json.dumps({"status": "success", "user": {"id": str(res[0]), "nickname": res[1]}}).encode('utf-8'))
+                    self._write_json({"status": "success", "user": {"id": str(res[0]), "nickname": res[1]}})
                 except Exception as e:
                     conn.rollback()
-                    self.wfile.write(json.dumps({"error": str(e)}).encode('utf-8'))
+                    self._write_json({"error": str(e)})
 
             elif action == 'list_users':
                 cur.execute("SELECT id, nickname FROM users ORDER BY created_at DESC LIMIT 50")
                 rows = cur.fetchall()
                 users = [{"id": str(r[0]), "nickname": r[1]} for r in rows]
-                self.wfile.write(json.dumps({"status": "success", "users": users}).encode('utf-8'))
+                self._write_json({"status": "success", "users": users})
 
             elif action == 'update_nickname':
                 user_id, nickname = data.get('user_id'), data.get('nickname')
                 cur.execute("UPDATE users SET nickname = %s WHERE id = %s", (nickname, user_id))
+                _refresh_leaderboard(cur, LeaderboardService.refresh_with_cursor, user_ids=[user_id])
                 conn.commit()
-                self.wfile.write(json.dumps({"status": "success"}).encode('utf-8'))
+                self._write_json({"status": "success"})
 
             elif action == 'add_portfolio':
                 user_id, symbol, price = data.get('user_id'), data.get('symbol'), data.get('price')
@@ -103,6 +178,7 @@ class handler(BaseHTTPRequestHandler):
                 
                 # If price is not provided, fetch current price automatically
                 if price is None or price <= 0:
+                    from api.services.stock_service import StockService
                     price = StockService.get_current_price(symbol) or 0
                 
                 if entry_date:
@@ -111,14 +187,19 @@ class handler(BaseHTTPRequestHandler):
                     cur.execute("INSERT INTO portfolio_items (user_id, symbol, entry_price, entry_date) VALUES (%s, %s, %s, NOW()) RETURNING id", (user_id, symbol, price))
                 
                 res_id = cur.fetchone()[0]
+                _refresh_leaderboard(cur, LeaderboardService.refresh_with_cursor, portfolio_ids=[res_id])
                 conn.commit()
-                self.wfile.write(json.dumps({"status": "success", "id": res_id, "price": price}).encode('utf-8'))
+                PortfolioService.invalidate(user_id)
+                self._write_json({"status": "success", "id": res_id, "price": price})
 
             elif action == 'delete_portfolio':
                 u_id, p_id = data.get('user_id'), data.get('portfolio_id')
                 cur.execute("DELETE FROM portfolio_items WHERE id = %s AND user_id = %s", (p_id, u_id))
+                # leaderboard_entries 由 ON DELETE CASCADE 移除，只需重算使用者彙總
+                _refresh_leaderboard(cur, LeaderboardService.refresh_users_with_cursor, [u_id])
                 conn.commit()
-                self.wfile.write(json.dumps({"status": "success"}).encode('utf-8'))
+                PortfolioService.invalidate(u_id)
+                self._write_json({"status": "success"})
 
             elif action == 'update_portfolio_all':
                 u_id, p_id = data.get('user_id'), data.get('portfolio_id')
@@ -129,17 +210,19 @@ class handler(BaseHTTPRequestHandler):
                     cur.execute("UPDATE portfolio_items SET entry_price = %s WHERE id = %s AND user_id = %s", (p, p_id, u_id))
                 elif d is not None:
                     cur.execute("UPDATE portfolio_items SET entry_date = %s WHERE id = %s AND user_id = %s", (d, p_id, u_id))
+                _refresh_leaderboard(cur, LeaderboardService.refresh_with_cursor, portfolio_ids=[p_id])
                 conn.commit()
-                self.wfile.write(json.dumps({"status": "success"}).encode('utf-8'))
+                PortfolioService.invalidate(u_id)
+                self._write_json({"status": "success"})
             
             elif action == 'get_quote':
                 symbol = data.get('symbol')
                 from api.scrapers import fetch_realtime_quote
                 quote = fetch_realtime_quote(symbol)
                 if quote:
-                    self.wfile.write(json.dumps({"status": "success", "quote": quote}).encode('utf-8'))
+                    self._write_json({"status": "success", "quote": quote})
                 else:
-                    self.wfile.write(json.dumps({"error": "Failed to fetch quote"}).encode('utf-8'))
+                    self._write_json({"error": "Failed to fetch quote"})
 
             elif action == 'get_portfolio':
                 user_id = data.get('user_id')
@@ -158,48 +241,99 @@ class handler(BaseHTTPRequestHandler):
                     WHERE p.user_id = %s 
                     ORDER BY p.entry_date DESC
                 """, (user_id,))
-                self.wfile.write(json.dumps(dict_cur.fetchall(), default=str).encode('utf-8'))
+                self._write_json(dict_cur.fetchall(), default=str)
                 dict_cur.close()
 
+            elif action == 'get_portfolio_valuation':
+                valuation = PortfolioService.get_valuation(data.get('user_id'))
+                if valuation is not None:
+                    self._write_json({"status": "success", "valuation": valuation})
+                else:
+                    self._write_json({"error": "Failed to value portfolio"})
+
             elif action == 'trigger_evolution':
                 # ✅ 新增：手動觸發每日反思（build-ai-agent-system Step 4: Evaluate and iterate）
                 from api.services.reflection_engine import ReflectionEngine
                 actual_performance = data.get('actual_performance', {'avg_return': 0})
                 predicted_stocks = data.get('predicted_stocks', [])
                 reflections = ReflectionEngine.run_daily_reflection(predicted_stocks, actual_performance)
-                self.wfile.write(json.dumps({
+                self._write_json({
                     'status': 'success',
                     'reflections': reflections,
                     'message': f'Evolution triggered: {len(reflections)} strategies updated'
-                }).encode('utf-8'))
+                })
 
             # ✅ 修復：cur.close() 移至 finally，確保不被 early return 跳過
             cur.close()
             return_db_connection(conn)
         except Exception as e:
-            self.wfile.write(json.dumps({"error": str(e)}).encode('utf-8'))
+            self._write_json({"error": str(e)})
 
 
 
     def do_GET(self):
+        parsed = urlparse(self.path)
+        q = parse_qs(parsed.query)
+        route = _get_route(parsed, q)
+        with profiling.profile_request("GET", self.path, self.headers), \
+                metrics.span("http.request", method="GET", route=route):
+            self._handle_get(parsed, q, route)
+
+    def _handle_get(self, parsed, q, route):
         try:
-            parsed = urlparse(self.path)
-            q = parse_qs(parsed.query)
-            if 'leaderboard' in q or '/leaderboard' in parsed.path: 
-                data = StockService.get_leaderboard()
+            if route == 'leaderboard':
+                try:
+                    data = LeaderboardService.get_leaderboard(
+                        page=q.get('page', ['1'])[0],
+                        page_size=q.get('page_size', ['50'])[0],
+                        view=q.get('view', ['positions'])[0],
+                        sort=q.get('sort', ['date'])[0]
+                    )
+                except LeaderboardError as e:
+                    self._write_error(400, str(e))
+                    return
                 self._set_headers()
-                self.wfile.write(json.dumps(data, default=str).encode('utf-8'))
-            elif q.get('action', [None])[0] == 'get_quote':
+                self._write_json(data, default=str)
+            elif route == 'get_quote':
                 symbol = q.get('symbol', [None])[0]
                 from api.scrapers import fetch_realtime_quote
                 quote = fetch_realtime_quote(symbol) if symbol else None
                 self._set_headers()
                 if quote:
-                    self.wfile.write(json.dumps({"status": "success", "quote": quote}).encode('utf-8'))
+                    self._write_json({"status": "success", "quote": quote})
                 else:
-                    self.wfile.write(json.dumps({"error": "Failed to fetch quote"}).encode('utf-8'))
-            elif 'trending' in q or '/market/trending' in parsed.path: 
+                    self._write_json({"error": "Failed to fetch quote"})
+            elif route == 'search':
+                from api.services.name_resolver import NameResolver
+                query = q.get('q', [''])[0]
+                try:
+                    limit = max(1, min(50, int(q.get('limit', ['10'])[0])))
+                except ValueError:
+                    limit = 10
+                self._set_headers()
+                self._write_json({"status": "success", "results": NameResolver.search(query, limit)})
+            elif route == 'screen':
+                from api.services.screener import Screener, ScreenError
+                self._set_headers()
+                try:
+                    result = Screener.screen(
+                        filter=q.get('filter', [None])[0],
+                        sort=q.get('sort', [None])[0],
+                        market=q.get('market', [None])[0],
+                        limit=q.get('limit', ['50'])[0],
+                        offset=q.get('offset', ['0'])[0],
+                        fields=q.get('fields', [None])[0]
+                    )
+                except ScreenError as e:
+                    self._write_json({"error": str(e)})
+                    return
+                if result is None:
+                    self._write_json({"error": "Screener data unavailable"})
+                else:
+                    self._write_json({"status": "success", **result})
+            elif route == 'trending':
                 market = q.get('market', ['TW'])[0]
+                from api.services.stock_service import StockService
                 data = StockService.get_market_trending(market)
                 self.send_response(200)
                 self.send_header('Content-type', 'application/json')
@@ -208,8 +342,8 @@ class handler(BaseHTTPRequestHandler):
                 self.send_header('Pragma', 'no-cache')
                 self.send_header('Expires', '0')
                 self.end_headers()
-                self.wfile.write(json.dumps(data).encode('utf-8'))
-            elif 'symbol' in q: 
+                self._write_json(data)
+            elif route == 'symbol':
                 symbol = q['symbol'][0]
                 period = q.get('period', ['1y'])[0]
                 interval = q.get('interval', ['1d'])[0]
@@ -220,19 +354,20 @@ class handler(BaseHTTPRequestHandler):
                 
                 self._set_headers()
                 if data:
-                    self.wfile.write(json.dumps(data).encode('utf-8'))
+                    self._write_json(data)
                 else:
-                    self.wfile.write(json.dumps({"error": "Unable to fetch data", "symbol": symbol}).encode('utf-8'))
-            elif parsed.path.endswith('/health'):
+                    self._write_json({"error": "Unable to fetch data", "symbol": symbol})
+            elif route == 'health':
                 self._set_headers()
                 from api.services.evolution_manager import EvolutionManager
                 EvolutionManager.log_anomaly("HEALTH_CHECK", "API health endpoint accessed")
-                self.wfile.write(json.dumps({"status": "ok", "evolution": "active"}).encode('utf-8'))
-            elif parsed.path.endswith('/evolution'):
+                self._write_json({"status": "ok", "evolution": "active"})
+            elif route == 'evolution':
                 self._set_headers()
                 from api.services.reflection_engine import ReflectionEngine
                 from api.services.evolution_manager import EvolutionManager
                 from api.services.performance_tracker import PerformanceTracker
+                from api.services.stock_service import StockService
                 
                 state = ReflectionEngine.load_state()
                 
@@ -240,12 +375,32 @@ class handler(BaseHTTPRequestHandler):
                 state['anomaly_summary'] = EvolutionManager.get_anomaly_summary()
                 state['performance_tracking'] = PerformanceTracker.get_summary()
                 state['market_regime'] = StockService.get_market_regime()
+                state['market_regimes'] = StockService.get_market_regimes(compute=False)
                 state['strategy_config'] = load_strategy_config()
                 
-                self.wfile.write(json.dumps(state).encode('utf-8'))
+                self._write_json(state)
+            elif route == 'metrics':
+                if not metrics.authorized(self.headers):
+                    self._write_error(404, "Not Found")
+                    return
+                self.send_response(200)
+                self.send_header('Content-type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Cache-Control', 'no-cache')
+                self.end_headers()
+                self.wfile.write(metrics.render_prometheus().encode('utf-8'))
+            elif route == 'settle':
+                if not _cron_authorized(self.headers):
+                    self._write_error(404, "Not Found")
+                    return
+                # 排程結算：在時間預算內補抓待結算個股的日線，再結算到期預測（完整補抓見 scripts/settle_predictions.py）
+                from api.services.performance_tracker import PerformanceTracker
+                settled = PerformanceTracker.settle_from_history(fetch=True, fetch_budget=_CRON_FETCH_BUDGET)
+                persisted = PerformanceTracker.flush()
+                self._set_headers()
+                self._write_json({"status": "ok", "settled": settled, "persisted": persisted})
             else:
                 self._set_headers()
-                self.wfile.write(json.dumps({"error": "Not Found"}).encode('utf-8'))
+                self._write_json({"error": "Not Found"})
         except Exception as e:
             import sys
             import traceback
@@ -256,7 +411,7 @@ class handler(BaseHTTPRequestHandler):
             self.send_response(500)
             self.send_header('Content-type', 'application/json')
             self.end_headers()
-            self.wfile.write(json.dumps({"error": "Internal Server Error", "details": str(e)}).encode('utf-8'))
+            self._write_json({"error": "Internal Server Error", "details": str(e)})
 
 if __name__ == '__main__':
     from http.server import HTTPServer
@@ -0,0 +1,143 @@
+"""
+Lightweight request instrumentation
+
+以 span 量測各階段耗時（DB checkout、查詢、上游呼叫、序列化、整體 handler），
+彙總成 histogram，透過 /metrics 以 Prometheus text format 輸出。
+
+設定（環境變數）：
+- METRICS_ENABLED：設為 "0" 時停用量測（span 變成 no-op）
+- METRICS_LOG：設為 "json" 時，每個 span 結束時輸出一行結構化 log
+- METRICS_TOKEN：/metrics 需帶 `Authorization: Bearer <METRICS_TOKEN>`；未設定時 /metrics 關閉
+
+用法：
+    from api import metrics
+    with metrics.span("db.query", op="SELECT", table="stock_cache"):
+        cur.execute(...)
+
+    with metrics.span("http.request", method="GET") as labels:
+        labels["route"] = "trending"      # 結束前皆可補上 label
+"""
+
+import os
+import hmac
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+# 秒；涵蓋單筆查詢（毫秒級）到 serverless 上限（10 秒）
+_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_ENABLED = os.environ.get("METRICS_ENABLED", "1") != "0"
+_LOG_JSON = os.environ.get("METRICS_LOG", "").lower() == "json"
+_TOKEN = os.environ.get("METRICS_TOKEN", "")
+
+# (span, sorted label items) -> [bucket counts..., +Inf count, sum]
+_HISTOGRAMS = {}
+_ERRORS = {}
+_LOCK = threading.Lock()
+_STARTED = time.time()
+
+
+def observe(name, seconds, labels=None, error=False):
+    """記錄一次觀測值"""
+    key = (name, tuple(sorted((labels or {}).items())))
+    with _LOCK:
+        hist = _HISTOGRAMS.get(key)
+        if hist is None:
+            hist = _HISTOGRAMS[key] = [0] * (len(_BUCKETS) + 2)
+        for i, bound in enumerate(_BUCKETS):
+            if seconds <= bound:
+                hist[i] += 1
+        hist[len(_BUCKETS)] += 1
+        hist[-1] += seconds
+        if error:
+            _ERRORS[key] = _ERRORS.get(key, 0) + 1
+
+
+@contextmanager
+def span(name, **labels):
+    """量測 with 區塊耗時；yield 的 labels dict 可在區塊內補充"""
+    if not _ENABLED:
+        yield labels
+        return
+    t0 = time.perf_counter()
+    error = False
+    try:
+        yield labels
+    except BaseException:
+        error = True
+        raise
+    finally:
+        elapsed = time.perf_counter() - t0
+        labels = {k: str(v) for k, v in labels.items() if v is not None}
+        observe(name, elapsed, labels, error)
+        if _LOG_JSON:
+            print(json.dumps({"span": name, "ms": round(elapsed * 1000, 3), "error": error, **labels}))
+
+
+def timed(name, **labels):
+    """Decorator 版本的 span"""
+    def decorator(fn):
+        import functools
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name, **labels):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def authorized(headers):
+    """/metrics 的存取檢查：需設定 METRICS_TOKEN 且 Authorization header 相符"""
+    if not _TOKEN or headers is None:
+        return False
+    return hmac.compare_digest(headers.get("Authorization", ""), f"Bearer {_TOKEN}")
+
+
+def reset():
+    with _LOCK:
+        _HISTOGRAMS.clear()
+        _ERRORS.clear()
+
+
+def _fmt_labels(items, extra=None):
+    pairs = list(items) + (extra or [])
+    if not pairs:
+        return ""
+    escaped = [(k, str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")) for k, v in pairs]
+    return "{" + ",".join(f'{k}="{v}"' for k, v in escaped) + "}"
+
+
+def render_prometheus() -> str:
+    """輸出 Prometheus text exposition format (0.0.4)"""
+    with _LOCK:
+        hists = {k: list(v) for k, v in _HISTOGRAMS.items()}
+        errors = dict(_ERRORS)
+
+    lines = [
+        "# HELP app_span_duration_seconds Duration of instrumented spans.",
+        "# TYPE app_span_duration_seconds histogram",
+    ]
+    for (name, items), hist in sorted(hists.items()):
+        base = [("span", name)] + list(items)
+        for i, bound in enumerate(_BUCKETS):
+            lines.append(f"app_span_duration_seconds_bucket{_fmt_labels(base, [('le', repr(bound))])} {hist[i]}")
+        lines.append(f"app_span_duration_seconds_bucket{_fmt_labels(base, [('le', '+Inf')])} {hist[len(_BUCKETS)]}")
+        lines.append(f"app_span_duration_seconds_sum{_fmt_labels(base)} {hist[-1]:.6f}")
+        lines.append(f"app_span_duration_seconds_count{_fmt_labels(base)} {hist[len(_BUCKETS)]}")
+
+    lines += [
+        "# HELP app_span_errors_total Spans that exited with an exception.",
+        "# TYPE app_span_errors_total counter",
+    ]
+    for (name, items), count in sorted(errors.items()):
+        lines.append(f"app_span_errors_total{_fmt_labels([('span', name)] + list(items))} {count}")
+
+    lines += [
+        "# HELP app_process_uptime_seconds Seconds since this worker loaded the metrics module.",
+        "# TYPE app_process_uptime_seconds gauge",
+        f"app_process_uptime_seconds {time.time() - _STARTED:.3f}",
+    ]
+    return "\n".join(lines) + "\n"
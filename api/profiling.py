@@ -0,0 +1,200 @@
+"""
+Request profiling hook
+
+兩種觸發方式：
+1. 慢請求：請求超過 PROFILE_THRESHOLD_MS 仍未結束時，啟動 stack sampler
+   （以 sys._current_frames 定期取樣處理該請求的執行緒），結束後輸出
+   folded stacks（可直接餵給 flamegraph.pl / speedscope）。門檻前每個請求只在
+   登錄表中記下開始時間，由單一共用的 watchdog 執行緒檢查是否到期。
+2. 除錯 header：帶 `X-Debug-Profile: <PROFILE_TOKEN>` 的請求以 cProfile 完整剖析，
+   輸出 .prof（可用 snakeviz / pstats 檢視）。未設定 PROFILE_TOKEN 時此功能關閉。
+
+輸出檔名包含時間、method、路徑、symbol 與耗時，存放於 PROFILE_DIR，
+只保留最新 PROFILE_KEEP 個檔案。
+
+設定（環境變數）：
+- PROFILE_THRESHOLD_MS：慢請求門檻（預設 5000；0 表示停用）
+- PROFILE_SAMPLE_MS：取樣間隔（預設 10）
+- PROFILE_TOKEN：除錯 header 需相符的 token
+- PROFILE_DIR：輸出目錄（預設 /tmp/profiles，serverless 只有 /tmp 可寫）
+- PROFILE_KEEP：保留檔案數（預設 50）
+"""
+
+import os
+import re
+import sys
+import hmac
+import time
+import itertools
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from urllib.parse import urlparse, parse_qs
+
+_THRESHOLD_MS = float(os.environ.get("PROFILE_THRESHOLD_MS", "5000"))
+_SAMPLE_MS = float(os.environ.get("PROFILE_SAMPLE_MS", "10"))
+_TOKEN = os.environ.get("PROFILE_TOKEN", "")
+_DIR = Path(os.environ.get("PROFILE_DIR", "/tmp/profiles"))
+_KEEP = int(os.environ.get("PROFILE_KEEP", "50"))
+
+DEBUG_HEADER = "X-Debug-Profile"
+
+# cProfile 同一時間只能有一個啟用中的 profiler（3.12+ 為全域 sys.monitoring）
+_CPROFILE_LOCK = threading.Lock()
+_WRITE_LOCK = threading.Lock()
+_SLUG = re.compile(r'[^A-Za-z0-9._-]+')
+
+# 進行中的請求：key -> [thread_id, 到期時間 (perf_counter), sampler 或 None]
+_INFLIGHT = {}
+_INFLIGHT_COND = threading.Condition()
+_INFLIGHT_KEYS = itertools.count()
+_WATCHDOG = None
+
+
+class _StackSampler:
+    """定期取樣指定執行緒的 call stack，彙總為 folded stacks"""
+
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.counts = {}
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=1)
+
+    def _run(self):
+        while not self._stop.is_set():
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                break
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({Path(code.co_filename).name}:{frame.f_lineno})")
+                frame = frame.f_back
+            key = ";".join(reversed(stack))
+            self.counts[key] = self.counts.get(key, 0) + 1
+            self.samples += 1
+            self._stop.wait(self.interval)
+
+    def folded(self):
+        return "".join(f"{stack} {count}\n" for stack, count in sorted(self.counts.items(), key=lambda kv: -kv[1]))
+
+
+def _watchdog():
+    """唯一的 watchdog 執行緒：睡到最早的到期時間，為逾時的請求啟動 sampler"""
+    with _INFLIGHT_COND:
+        while True:
+            now = time.perf_counter()
+            waiting = []
+            for entry in _INFLIGHT.values():
+                if entry[2] is not None:
+                    continue
+                if entry[1] <= now:
+                    entry[2] = _StackSampler(entry[0], _SAMPLE_MS / 1000)
+                    entry[2].start()
+                else:
+                    waiting.append(entry[1])
+            _INFLIGHT_COND.wait(min(waiting) - now if waiting else None)
+
+
+def _register(thread_id):
+    global _WATCHDOG
+    key = next(_INFLIGHT_KEYS)
+    with _INFLIGHT_COND:
+        if _WATCHDOG is None:
+            _WATCHDOG = threading.Thread(target=_watchdog, name="profile-watchdog", daemon=True)
+            _WATCHDOG.start()
+        _INFLIGHT[key] = [thread_id, time.perf_counter() + _THRESHOLD_MS / 1000, None]
+        # 每次登錄都喚醒 watchdog 重算等待時間：其他請求都已在取樣時 watchdog 是無限期等待
+        _INFLIGHT_COND.notify()
+    return key
+
+
+def _unregister(key):
+    """移除登錄並回傳已啟動的 sampler（未逾時則為 None）"""
+    with _INFLIGHT_COND:
+        entry = _INFLIGHT.pop(key, None)
+    return entry[2] if entry else None
+
+
+def _output_path(method, path, elapsed_ms, ext):
+    parsed = urlparse(path)
+    symbol = parse_qs(parsed.query).get("symbol", [""])[0]
+    parts = [
+        datetime.now().strftime("%Y%m%dT%H%M%S%f"),
+        method,
+        _SLUG.sub("_", parsed.path.strip("/")) or "root",
+        _SLUG.sub("_", symbol)[:20],
+        f"{int(elapsed_ms)}ms",
+    ]
+    return _DIR / ("_".join(p for p in parts if p) + ext)
+
+
+def _write(target, writer):
+    """寫入輸出檔並輪替，只保留最新 _KEEP 個檔案"""
+    try:
+        with _WRITE_LOCK:
+            _DIR.mkdir(parents=True, exist_ok=True)
+            writer(target)
+            files = sorted(_DIR.iterdir(), key=lambda f: f.stat().st_mtime, reverse=True)
+            for old in files[_KEEP:]:
+                old.unlink(missing_ok=True)
+        print(f"[Profiler] Wrote {target}")
+    except Exception as e:
+        print(f"[Profiler] Failed to write profile: {e}")
+
+
+def _debug_requested(headers):
+    if not _TOKEN or headers is None:
+        return False
+    return hmac.compare_digest(headers.get(DEBUG_HEADER, ""), _TOKEN)
+
+
+@contextmanager
+def profile_request(method, path, headers=None):
+    """包住一次請求的處理；依門檻或除錯 header 決定是否剖析"""
+    if _debug_requested(headers) and _CPROFILE_LOCK.acquire(blocking=False):
+        import cProfile
+        profiler = cProfile.Profile()
+        t0 = time.perf_counter()
+        try:
+            profiler.enable()
+            try:
+                yield
+            finally:
+                profiler.disable()
+        finally:
+            _CPROFILE_LOCK.release()
+            elapsed_ms = (time.perf_counter() - t0) * 1000
+            _write(_output_path(method, path, elapsed_ms, ".prof"), lambda p: profiler.dump_stats(str(p)))
+        return
+
+    if _THRESHOLD_MS <= 0:
+        yield
+        return
+
+    t0 = time.perf_counter()
+    key = _register(threading.get_ident())
+    try:
+        yield
+    finally:
+        sampler = _unregister(key)
+        if sampler is not None:
+            sampler.stop()
+        if sampler is not None and sampler.samples:
+            elapsed_ms = (time.perf_counter() - t0) * 1000
+            _write(
+                _output_path(method, path, elapsed_ms, ".folded"),
+                lambda p: p.write_text(sampler.folded(), encoding="utf-8")
+            )
@@ -0,0 +1,121 @@
+"""
+Upstream record/replay layer
+
+讓 tvscreener / yfinance 等外部資料來源可以離線重播，方便在沒有網路的機器上
+做效能量測與壓力測試。
+
+模式（環境變數 UPSTREAM_MODE）：
+- live（預設）：直接呼叫外部來源
+- record：呼叫外部來源，並將結果寫入 fixture 目錄
+- replay：只讀 fixture，不連網；找不到 fixture 時視為來源無資料
+
+其他設定：
+- UPSTREAM_FIXTURE_DIR：fixture 目錄（預設 <repo>/fixtures/upstream）
+- UPSTREAM_LATENCY_MS：replay 時注入的延遲，"200" 為固定值，"100:400" 為區間
+  （區間內的值由呼叫 key 決定，同一個呼叫每次延遲相同，確保可重現）
+"""
+
+import os
+import time
+import pickle
+import hashlib
+import inspect
+import functools
+import threading
+from pathlib import Path
+from api import metrics
+
+_DEFAULT_DIR = Path(__file__).parent.parent / "fixtures" / "upstream"
+
+_CONFIG = {
+    "mode": os.environ.get("UPSTREAM_MODE", "live").lower(),
+    "fixture_dir": Path(os.environ.get("UPSTREAM_FIXTURE_DIR", str(_DEFAULT_DIR))),
+    "latency_ms": os.environ.get("UPSTREAM_LATENCY_MS", ""),
+}
+_WRITE_LOCK = threading.Lock()
+
+
+def configure(mode=None, fixture_dir=None, latency_ms=None):
+    """以程式切換模式（benchmark / load test 使用）"""
+    if mode is not None:
+        _CONFIG["mode"] = mode.lower()
+    if fixture_dir is not None:
+        _CONFIG["fixture_dir"] = Path(fixture_dir)
+    if latency_ms is not None:
+        _CONFIG["latency_ms"] = str(latency_ms)
+
+
+def get_mode():
+    return _CONFIG["mode"]
+
+
+def _fixture_path(source, key):
+    digest = hashlib.sha1(key.encode("utf-8")).hexdigest()[:20]
+    return _CONFIG["fixture_dir"] / source / f"{digest}.pkl"
+
+
+def _latency_seconds(key):
+    spec = _CONFIG["latency_ms"].strip()
+    if not spec:
+        return 0.0
+    try:
+        if ":" in spec:
+            low, high = (float(x) for x in spec.split(":", 1))
+            frac = int(hashlib.sha1(key.encode("utf-8")).hexdigest()[:8], 16) / 0xFFFFFFFF
+            return (low + (high - low) * frac) / 1000
+        return float(spec) / 1000
+    except ValueError:
+        return 0.0
+
+
+def replayable(source, key_args=None):
+    """
+    Decorator：將函式標記為外部來源呼叫。
+    source: fixture 子目錄名稱（如 "yfinance.info"）
+    key_args: 決定 fixture 的參數名稱；預設為全部參數（套用預設值後比對，
+              因此位置參數與關鍵字參數的呼叫會對應到同一筆 fixture）
+    """
+    def decorator(fn):
+        sig = inspect.signature(fn)
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with metrics.span("upstream", source=source, mode=_CONFIG["mode"]):
+                return _call(*args, **kwargs)
+
+        def _call(*args, **kwargs):
+            mode = _CONFIG["mode"]
+            if mode == "live":
+                return fn(*args, **kwargs)
+
+            bound = sig.bind(*args, **kwargs)
+            bound.apply_defaults()
+            params = {k: v for k, v in bound.arguments.items() if key_args is None or k in key_args}
+            call_key = f"{fn.__module__}.{fn.__qualname__}:{sorted(params.items())!r}"
+            path = _fixture_path(source, call_key)
+
+            if mode == "replay":
+                delay = _latency_seconds(call_key)
+                if delay > 0:
+                    time.sleep(delay)
+                try:
+                    with open(path, "rb") as f:
+                        return pickle.load(f)["result"]
+                except FileNotFoundError:
+                    print(f"[Replay] Missing fixture for {source}: {call_key}")
+                    return None
+
+            result = fn(*args, **kwargs)
+            if mode == "record":
+                try:
+                    with _WRITE_LOCK:
+                        path.parent.mkdir(parents=True, exist_ok=True)
+                        tmp = path.with_suffix(".tmp")
+                        with open(tmp, "wb") as f:
+                            pickle.dump({"key": call_key, "result": result}, f, protocol=pickle.HIGHEST_PROTOCOL)
+                        os.replace(tmp, path)
+                except Exception as e:
+                    print(f"[Replay] Failed to record {source}: {e}")
+            return result
+        return wrapper
+    return decorator
@@ -1,17 +1,16 @@
 import math
 import os
 import re
-import yfinance as yf
-import requests
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
 from api.constants import TW_STOCK_NAMES, SECTOR_TRANSLATIONS, EXCHANGE_TRANSLATIONS
 from api.db import get_db_connection, return_db_connection
+from api.replay import replayable
 
-# [Optimization] Heavy imports are now at top-level to support unit test mocking.
-# If cold-start is an issue, consider alternative mocking strategies in tests.
+# [Optimization] yfinance / requests 於使用處才載入，避免 import api.index 時拖慢冷啟動
 
 def get_session():
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
     session = requests.Session()
     retry = Retry(connect=3, backoff_factor=0.5)
     adapter = HTTPAdapter(max_retries=retry)
@@ -26,29 +25,60 @@ def get_session():
 
 def get_stock_name(symbol, default=None):
     """
-    Get stock name from memory constant or DB.
+    Get stock name from memory constant or the in-memory stock_names index.
     """
     # 1. Try memory first
     if symbol in TW_STOCK_NAMES:
         return TW_STOCK_NAMES[symbol]
     
-    # 2. Try DB
+    # 2. Try NameResolver (stock_names loaded once, periodically delta-reloaded)
+    try:
+        from api.services.name_resolver import NameResolver
+        name = NameResolver.get_name(symbol)
+        if name:
+            return name
+    except Exception as e:
+        print(f"[scrapers] get_stock_name resolver error for {symbol}: {e}")
+    
+    return default or symbol
+
+
+
+def get_stock_names(symbols):
+    """
+    Batch name lookup: resolve every symbol in one pass before row conversion.
+    Uses the in-memory index; falls back to one `symbol = ANY(...)` query when
+    the index could not be loaded.
+    """
+    symbols = [s for s in dict.fromkeys(symbols) if s]
+    names = {s: TW_STOCK_NAMES[s] for s in symbols if s in TW_STOCK_NAMES}
+    missing = [s for s in symbols if s not in names]
+    if not missing:
+        return names
+
+    try:
+        from api.services.name_resolver import NameResolver
+        names.update(NameResolver.get_names(missing))
+        if NameResolver.is_loaded():
+            return names
+    except Exception as e:
+        print(f"[scrapers] get_stock_names resolver error: {e}")
+
+    missing = [s for s in missing if s not in names]
     conn = get_db_connection()
     if conn:
         try:
             cur = conn.cursor()
-            cur.execute("SELECT name FROM stock_names WHERE symbol = %s", (symbol,))
-            row = cur.fetchone()
-            if row and row[0]:
-                return row[0]
+            cur.execute("SELECT symbol, name FROM stock_names WHERE symbol = ANY(%s)", (missing,))
+            for symbol, name in cur.fetchall():
+                if name:
+                    names[symbol] = name
+            cur.close()
         except Exception as e:
-            print(f"[scrapers] get_stock_name DB error for {symbol}: {e}")
+            print(f"[scrapers] get_stock_names DB error: {e}")
         finally:
             return_db_connection(conn)
-    
-    return default or symbol
-
-
+    return names
 
 def trunc2(value):
     """Truncate to 2 decimals without rounding (finance style)."""
@@ -106,8 +136,10 @@ def format_market_cap(val, is_tw=True):
     except:
         return str(val)
 
+@replayable("yfinance.info", key_args=("symbol",))
 def fetch_from_yfinance(symbol):
     try:
+        import yfinance as yf
         # 強制台股代號 (4位數字) 加上 .TW 後綴，確保抓取精確度
         yf_symbol = symbol
         if re.match(r'^\d{4,6}$', symbol):
@@ -191,6 +223,7 @@ def fetch_from_yfinance(symbol):
             "changePercent": trunc2(change_p),
             "volume": info.get('regularMarketVolume', info.get('volume', 0)),
             "marketCap": formatted_mcap,
+            "marketCapValue": raw_mcap or 0,
             "grossMargin": trunc2(gross_margin),
             "netMargin": trunc2(net_margin),
             "operatingMargin": trunc2(operating_margin),
@@ -214,8 +247,66 @@ def fetch_from_yfinance(symbol):
         return None
 
 
+def history_to_records(hist, interval="1d", max_points=365):
+    """
+    將 yfinance history DataFrame 轉為前端圖表用的 list of dicts。
+    欄位不完整時回傳 None。
+    """
+    hist = hist.reset_index()
+    # Handle different index names (Date vs Datetime)
+    time_col = None
+    for col in ["Date", "Datetime"]:
+        if col in hist.columns:
+            time_col = col
+            break
+
+    if not time_col:
+        return None
+
+    # Convert to list of dicts
+    output = []
+    needed_cols = ["Open", "High", "Low", "Close", "Volume"]
+
+    if not all(col in hist.columns for col in needed_cols):
+        return None
+
+    rows = hist.tail(max_points).to_dict(orient="records")
+    is_intraday = interval in ["1m", "2m", "5m", "15m", "30m", "60m", "90m", "1h"]
+
+    for r in rows:
+        try:
+            ts = r[time_col]
+            if is_intraday:
+                if hasattr(ts, "strftime"):
+                    date_str = ts.strftime("%H:%M")
+                else:
+                    s = str(ts)
+                    if ' ' in s:
+                        date_str = s.split(' ')[1][:5]
+                    else:
+                        date_str = s
+            else:
+                date_str = ts.strftime("%Y-%m-%d") if hasattr(ts, "strftime") else str(ts).split(' ')[0]
+
+            record = {
+                "Date": date_str,
+                "Open": float(r["Open"] or 0),
+                "High": float(r["High"] or 0),
+                "Low": float(r["Low"] or 0),
+                "Close": float(r["Close"] or 0),
+                "Volume": float(r["Volume"] or 0)
+            }
+
+            if record["Close"] > 0:
+                output.append(record)
+        except Exception:
+            continue
+    return output
+
+@replayable("yfinance.history")
 def fetch_history_from_yfinance(symbol, period="1y", interval="1d", max_points=365):
     """Fetch OHLCV history for charting from yfinance."""
+    import yfinance as yf
     normalized = symbol.strip().upper()
     candidates = []
 
@@ -239,56 +330,10 @@ def fetch_history_from_yfinance(symbol, period="1y", interval="1d", max_points=3
                 if hist is None or hist.empty:
                     break  # 此 candidate 無資料，跳到下一個 candidate
 
-                hist = hist.reset_index()
-                # Handle different index names (Date vs Datetime)
-                time_col = None
-                for col in ["Date", "Datetime"]:
-                    if col in hist.columns:
-                        time_col = col
-                        break
-
-                if not time_col:
+                output = history_to_records(hist, interval, max_points)
+                if output is None:
                     break
 
-                # Convert to list of dicts
-                output = []
-                needed_cols = ["Open", "High", "Low", "Close", "Volume"]
-
-                if not all(col in hist.columns for col in needed_cols):
-                    break
-
-                rows = hist.tail(max_points).to_dict(orient="records")
-                is_intraday = interval in ["1m", "2m", "5m", "15m", "30m", "60m", "90m", "1h"]
-
-                for r in rows:
-                    try:
-                        ts = r[time_col]
-                        if is_intraday:
-                            if hasattr(ts, "strftime"):
-                                date_str = ts.strftime("%H:%M")
-                            else:
-                                s = str(ts)
-                                if ' ' in s:
-                                    date_str = s.split(' ')[1][:5]
-                                else:
-                                    date_str = s
-                        else:
-                            date_str = ts.strftime("%Y-%m-%d") if hasattr(ts, "strftime") else str(ts).split(' ')[0]
-
-                        record = {
-                            "Date": date_str,
-                            "Open": float(r["Open"] or 0),
-                            "High": float(r["High"] or 0),
-                            "Low": float(r["Low"] or 0),
-                            "Close": float(r["Close"] or 0),
-                            "Volume": float(r["Volume"] or 0)
-                        }
-
-                        if record["Close"] > 0:
-                            output.append(record)
-                    except Exception:
-                        continue
-
                 if output:
                     return output
                 break  # 有 hist 但 output 為空，跳到下一個 candidate
@@ -329,8 +374,11 @@ def calculate_rsi(history, period=14):
     rs = avg_gain / avg_loss
     return 100.0 - (100.0 / (1.0 + rs))
 
-def process_tvs_row(row, symbol):
-    """將 tvscreener 的 row 轉換為標準化的資料格式"""
+def process_tvs_row(row, symbol, names=None):
+    """
+    將 tvscreener 的 row 轉換為標準化的資料格式。
+    names: 預先以 get_stock_names 批次查好的 symbol -> 名稱；未提供時逐筆查詢
+    """
     from tvscreener import StockField
     price = get_field(row, ['Price'], 0)
     eps = get_field(row, ['Basic EPS (TTM)', 'EPS Diluted (TTM)'], 0)
@@ -359,13 +407,14 @@ def process_tvs_row(row, symbol):
 
     data = {
         "symbol": symbol,
-        "name": get_stock_name(symbol, display_name),
+        "name": (names.get(symbol) or display_name) if names is not None else get_stock_name(symbol, display_name),
         "price": price,
         "change": get_field(row, ['Change'], 0),
         "changePercent": trunc2(get_field(row, ['Change %'], 0)),
         "volume": get_field(row, ['Volume'], 0),
         "avgVolume": get_field(row, ['Average Volume (10 day)', 'Average Volume (30 day)', StockField.AVERAGE_VOLUME_30_DAY.label], 0),
         "marketCap": formatted_mcap,
+        "marketCapValue": raw_mcap or 0,
         "technicalRating": tech_rating,
         "analystRating": get_field(row, ['Analyst Rating', StockField.RECOMMENDATION_MARK.label], 3),
         "targetPrice": get_field(row, ['Target Price (Average)', 'Price Target Mean', StockField.PRICE_TARGET_AVERAGE.label], 0),
@@ -411,6 +460,7 @@ def process_tvs_row(row, symbol):
         
     return data
 
+@replayable("yfinance.quote")
 def fetch_realtime_quote(symbol):
     """
     極速抓取即時報價 (Last Price, Change, Pct)
@@ -418,6 +468,7 @@ def fetch_realtime_quote(symbol):
     """
     import time
     try:
+        import yfinance as yf
         # Handle TW suffixes if needed (similar logic to fetch_from_yfinance)
         yf_symbol = symbol
         if re.match(r'^\d{4,6}$', symbol):
@@ -1,6 +1,18 @@
-from .reflection_engine import ReflectionEngine
-from .market_regime import MarketRegimeDetector
-from .stock_service import StockService
-from .evolution_manager import EvolutionManager
+import importlib
+
+# [Optimization] 延遲載入：匯入任一子模組（如 api.services.leaderboard_service）時
+# 不會連帶載入 stock_service 與其重量級相依；`from api.services import X` 用法不變。
+_EXPORTS = {
+    "ReflectionEngine": ".reflection_engine",
+    "MarketRegimeDetector": ".market_regime",
+    "StockService": ".stock_service",
+    "EvolutionManager": ".evolution_manager",
+}
 
 __all__ = ["ReflectionEngine", "MarketRegimeDetector", "StockService", "EvolutionManager"]
+
+
+def __getattr__(name):
+    if name in _EXPORTS:
+        return getattr(importlib.import_module(_EXPORTS[name], __name__), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
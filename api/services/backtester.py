@@ -0,0 +1,291 @@
+"""
+Backtester — growth_value 策略的向量化歷史回測
+
+職責：
+1. 將 daily_prices（HistoryStore）的收盤價對齊成 日期 × 個股 矩陣，搭配 stock_cache
+   目前的基本面（Screener 欄式表），建立可重複使用的 BacktestData
+2. 技術指標（SMA、RSI）與前瞻報酬以矩陣一次算完並快取；評估一組策略參數只需要
+   幾次矩陣遮罩與排序，所有調倉日同時計算，單次評估為毫秒級，
+   足以在每次反思時評估數百組候選參數
+3. 回傳報酬、勝率、最大回撤等指標，供 ReflectionEngine 比較候選參數
+
+策略規則（對應 strategy_config.json 的 growth_value）：
+- 每 holding_days 個交易日調倉一次，持有至下次調倉
+- 入選條件：RSI(14) < rsi_threshold、F-Score >= f_score_min、收盤價 > SMA(min_ma_window)
+- 依 evolution_state.json 的 weights 對基本面 z-score 加權排序，取前 top_n 檔等權持有
+
+限制：基本面只有目前的快照（沒有歷史基本面），回測對基本面條件存在前視偏差；
+RSI 以簡單平均（Cutler）計算，與 calculate_rsi 的 Wilder 平滑略有差異。
+daily_prices 平時只收錄使用者看過的個股，未補齊時回測樣本會偏向熱門股（選樣偏差）：
+load_data 會記錄覆蓋率（有足夠日線的個股 / Screener 全市場），backfill=True 時先補齊全市場日線。
+"""
+
+from datetime import date, timedelta
+
+# evolution_state.json weights 名稱 -> Screener 欄位
+WEIGHT_FIELDS = {
+    "fScore": "fScore",
+    "eps_growth": "epsGrowth",
+    "operating_margin": "operatingMargin",
+    "gross_margin": "grossMargin",
+    "revenue_growth": "revGrowth",
+    "roe": "roe",
+}
+FUNDAMENTAL_FIELDS = tuple(dict.fromkeys(WEIGHT_FIELDS.values()))
+
+DEFAULT_PARAMS = {
+    "rsi_threshold": 60,
+    "f_score_min": 5,
+    "min_ma_window": 20,
+    "holding_days": 5,
+    "top_n": 10,
+    "weights": {},
+}
+RSI_PERIOD = 14
+MIN_HISTORY = 60      # 個股至少需要的日線筆數
+MIN_COVERAGE = 0.8    # 覆蓋率低於此值時警告選樣偏差
+
+
+class BacktestData:
+    """
+    對齊後的回測資料（不可變）。指標矩陣於第一次使用時計算並快取，
+    同一份資料評估多組參數時只計算一次。
+    """
+
+    def __init__(self, symbols, dates, close, fundamentals, universe=None):
+        import numpy as np
+        self.symbols = list(symbols)
+        self.universe = universe or len(self.symbols)    # 回測母體（Screener 全市場）的個股數
+        self.dates = np.asarray(dates, dtype="datetime64[D]")
+        self.close = np.asarray(close, dtype=float)          # T × N，缺值為 NaN
+        self.fundamentals = {k: np.asarray(v, dtype=float) for k, v in fundamentals.items()}
+        self._sma = {}
+        self._forward = {}
+        self._zscore = {}
+        self._rsi = None
+
+    @property
+    def shape(self):
+        return self.close.shape
+
+    @property
+    def coverage(self):
+        """有足夠日線、實際納入回測的個股比例"""
+        return len(self.symbols) / self.universe if self.universe else 0.0
+
+    def sma(self, window):
+        if window not in self._sma:
+            import numpy as np
+            valid = ~np.isnan(self.close)
+            cs = np.cumsum(np.where(valid, self.close, 0.0), axis=0)
+            cnt = np.cumsum(valid, axis=0)
+            out = np.full(self.close.shape, np.nan)
+            if window <= len(cs):
+                total = cs[window - 1:].copy()
+                count = cnt[window - 1:].copy()
+                total[1:] -= cs[:-window]
+                count[1:] -= cnt[:-window]
+                # 視窗內必須每天都有資料
+                out[window - 1:] = np.where(count == window, total / window, np.nan)
+            self._sma[window] = out
+        return self._sma[window]
+
+    def rsi(self):
+        if self._rsi is None:
+            import numpy as np
+            diff = np.diff(self.close, axis=0)
+            gains = np.where(diff > 0, diff, 0.0)
+            losses = np.where(diff < 0, -diff, 0.0)
+            out = np.full(self.close.shape, np.nan)
+            p = RSI_PERIOD
+            if len(diff) >= p:
+                def rolling_sum(x):
+                    cs = np.cumsum(np.nan_to_num(x), axis=0)
+                    s = cs[p - 1:].copy()
+                    s[1:] -= cs[:-p]
+                    return s
+                avg_gain, avg_loss = rolling_sum(gains) / p, rolling_sum(losses) / p
+                with np.errstate(divide="ignore", invalid="ignore"):
+                    rsi = np.where(avg_loss == 0, 100.0, 100.0 - 100.0 / (1.0 + avg_gain / avg_loss))
+                # 視窗內有缺值則不計算
+                bad = np.isnan(diff).astype(float)
+                rsi[rolling_sum(bad) > 0] = np.nan
+                out[p:] = rsi
+            self._rsi = out
+        return self._rsi
+
+    def forward_returns(self, horizon):
+        """forward[t] = close[t + horizon] / close[t] - 1"""
+        if horizon not in self._forward:
+            import numpy as np
+            out = np.full(self.close.shape, np.nan)
+            if horizon < len(self.close):
+                with np.errstate(divide="ignore", invalid="ignore"):
+                    out[:-horizon] = self.close[horizon:] / self.close[:-horizon] - 1
+            self._forward[horizon] = out
+        return self._forward[horizon]
+
+    def zscore(self, field):
+        """基本面欄位的橫斷面 z-score；缺值為 0（不加分也不扣分）"""
+        if field not in self._zscore:
+            import numpy as np
+            values = self.fundamentals.get(field)
+            if values is None or np.isnan(values).all():
+                z = np.zeros(len(self.symbols))
+            else:
+                std = np.nanstd(values)
+                z = (values - np.nanmean(values)) / std if std > 0 else np.zeros(len(values))
+                z = np.where(np.isnan(z), 0.0, z)
+            self._zscore[field] = z
+        return self._zscore[field]
+
+
+def _max_drawdown(equity):
+    import numpy as np
+    if not len(equity):
+        return 0.0
+    peak = np.maximum.accumulate(np.concatenate(([1.0], equity)))[1:]
+    return float(np.min(equity / peak - 1))
+
+
+class Backtester:
+    """策略參數的向量化評估"""
+
+    @staticmethod
+    def build_data(series: dict, fundamentals: dict = None, symbols=None) -> BacktestData:
+        """
+        series：HistoryStore.load_series 的結果（symbol -> {"dates", "close"}）
+        fundamentals：field -> {symbol: value}
+        缺漏的交易日以前一日收盤價補齊（僅限該股第一筆資料之後）。
+        """
+        import numpy as np
+        universe = len(symbols or series)
+        symbols = [s for s in (symbols or series) if s in series and len(series[s]["close"]) >= MIN_HISTORY]
+        if not symbols:
+            return None
+        dates = np.unique(np.concatenate([series[s]["dates"] for s in symbols]))
+        close = np.full((len(dates), len(symbols)), np.nan)
+        for j, s in enumerate(symbols):
+            close[np.searchsorted(dates, series[s]["dates"]), j] = series[s]["close"]
+
+        # forward fill：每格取該欄最近一筆有效資料的索引
+        valid = ~np.isnan(close)
+        idx = np.where(valid, np.arange(len(dates))[:, None], 0)
+        np.maximum.accumulate(idx, axis=0, out=idx)
+        close = np.where(valid.cumsum(axis=0) > 0, close[idx, np.arange(len(symbols))], np.nan)
+
+        fundamentals = fundamentals or {}
+        columns = {
+            field: np.array([values.get(s, np.nan) for s in symbols], dtype=float)
+            for field, values in fundamentals.items()
+        }
+        return BacktestData(symbols, dates, close, columns, universe=universe)
+
+    @staticmethod
+    def load_data(market="TW", days=400, backfill=False):
+        """
+        以 Screener 全市場表（基本面）與 daily_prices（收盤價）建立回測資料；無資料時回傳 None。
+        backfill=True 時先向 yfinance 補齊全市場（缺漏或過舊）的日線，耗時與個股數成正比。
+        """
+        import numpy as np
+        from api.services.screener import Screener
+        from api.services.history_store import HistoryStore
+
+        table = Screener.ensure_loaded()
+        if table is None:
+            return None
+        idx = np.flatnonzero(table.text["market"] == market)
+        symbols = table.text["symbol"][idx].tolist()
+        if backfill:
+            ingested = HistoryStore.refresh(symbols, period="2y" if days > 365 else "1y", max_age_days=1)
+            print(f"[Backtester] Backfilled {ingested} daily rows for {len(symbols)} {market} symbols")
+        series = HistoryStore.load_series(symbols, since=date.today() - timedelta(days=days))
+        fundamentals = {
+            field: dict(zip(symbols, table.numeric[field][idx].tolist())) for field in FUNDAMENTAL_FIELDS
+        }
+        data = Backtester.build_data(series, fundamentals, symbols)
+        if data is not None:
+            print(f"[Backtester] Loaded {market}: {data.shape[1]}/{data.universe} symbols "
+                  f"({data.coverage:.0%} of the screener universe) x {data.shape[0]} days")
+            if data.coverage < MIN_COVERAGE:
+                print(f"[Backtester] Warning: coverage below {MIN_COVERAGE:.0%}; results are biased toward "
+                      f"symbols with stored history (run with backfill to fetch the rest)")
+        return data
+
+    @staticmethod
+    def current_params(strategy_id="growth_value", config=None, state=None):
+        """strategy_config.json 的門檻 + evolution_state.json 的 weights（可傳入已載入的 config / state）"""
+        from api.services.reflection_engine import ReflectionEngine
+        config = ReflectionEngine.load_config() if config is None else config
+        state = ReflectionEngine.load_state() if state is None else state
+        params = dict(DEFAULT_PARAMS)
+        params.update({
+            k: v for k, v in config.get("strategies", {}).get(strategy_id, {}).items() if k in DEFAULT_PARAMS
+        })
+        weights = state.get("strategies", {}).get(strategy_id, {}).get("weights")
+        if weights:
+            params["weights"] = weights
+        return params
+
+    @staticmethod
+    def evaluate(data: BacktestData, params: dict, start=0, stop=None) -> dict:
+        """
+        以一組參數回測 [start, stop) 日期區間內的調倉日（預設為全部）。
+        持有期的報酬也必須落在區間內，訓練 / 驗證區間因此不會互相重疊；指標只用過去資料，仍以完整資料計算。
+        回傳 periods / trades / avg_return / hit_rate / total_return / max_drawdown / sharpe / exposure。
+        """
+        import numpy as np
+        p = dict(DEFAULT_PARAMS, **(params or {}))
+        horizon = max(1, int(p["holding_days"]))
+        window = max(2, int(p["min_ma_window"]))
+        top_n = int(p["top_n"] or 0)
+
+        T, N = data.shape
+        stop = T if stop is None else min(stop, T)
+        rows = np.arange(max(window - 1, RSI_PERIOD, start), stop - horizon, horizon)
+        empty = {"periods": 0, "trades": 0, "avg_return": 0.0, "hit_rate": 0.0, "total_return": 0.0,
+                 "max_drawdown": 0.0, "sharpe": 0.0, "exposure": 0.0}
+        if not len(rows) or not N:
+            return empty
+
+        close = data.close[rows]
+        forward = data.forward_returns(horizon)[rows]
+        with np.errstate(invalid="ignore"):
+            mask = (data.rsi()[rows] < p["rsi_threshold"]) & (close > data.sma(window)[rows]) & ~np.isnan(forward)
+            f_score = data.fundamentals.get("fScore")
+            if f_score is not None:
+                mask &= (f_score >= p["f_score_min"])[None, :]
+
+        if top_n and top_n < N:
+            score = np.zeros(N)
+            for name, w in (p.get("weights") or {}).items():
+                field = WEIGHT_FIELDS.get(name, name)
+                if field in data.fundamentals and w:
+                    score = score + w * data.zscore(field)
+            ranked = np.where(mask, score[None, :], -np.inf)
+            top = np.argpartition(-ranked, top_n - 1, axis=1)[:, :top_n]
+            picked = np.zeros_like(mask)
+            np.put_along_axis(picked, top, True, axis=1)
+            mask &= picked
+
+        count = mask.sum(axis=1)
+        gains = np.where(mask, forward, 0.0)
+        period_returns = np.where(count > 0, gains.sum(axis=1) / np.maximum(count, 1), 0.0)
+        trades = int(count.sum())
+        equity = np.cumprod(1 + period_returns)
+        std = period_returns.std()
+        return {
+            "periods": int(len(rows)),
+            "trades": trades,
+            "avg_return": float(gains.sum() / trades) if trades else 0.0,
+            "hit_rate": float((mask & (forward > 0)).sum() / trades) if trades else 0.0,
+            "total_return": float(equity[-1] - 1),
+            "max_drawdown": _max_drawdown(equity),
+            "sharpe": float(period_returns.mean() / std * np.sqrt(252 / horizon)) if std > 0 else 0.0,
+            "exposure": float((count > 0).mean()),
+        }
+
+    @staticmethod
+    def evaluate_many(data: BacktestData, candidates, start=0, stop=None) -> list:
+        """依序評估多組參數（共用同一份已快取的指標矩陣）"""
+        return [Backtester.evaluate(data, params, start, stop) for params in candidates]
@@ -0,0 +1,83 @@
+"""
+BatchEnrich — StockService._enrich_data 的欄式批次版本
+
+職責：
+1. 在 Screener 全市場欄式表上以 NumPy 一次計算所有個股的 healthLabel、growthProjection、
+   雷達分數、upside 與 prediction 區間，不必逐筆建立 dict 呼叫 _enrich_data
+2. 雷達分數與 _enrich_data 相同：市場百分位表可用時為百分位（np.searchsorted），
+   任一維度無法取得時整列沿用截斷後的固定公式
+
+欄式表的缺值（NaN）對應文件中缺少該 key，套用與 _enrich_data 相同的預設值；
+stock_cache 的文件經 sanitize_json 後不含 NaN，因此兩者結果一致（見 tests/backend/test_batch_enrich.py）。
+_enrich_data 在 price == 0 且有目標價時會拋出 ZeroDivisionError，此處該列 upside 為 NaN。
+公式變更時兩處需同步修改。
+"""
+
+from api.services.radar_percentiles import AXES, raw_scores, usable_mask
+
+# 雷達各維度（AXES 順序）對應的欄位名稱
+RADAR_COLUMNS = ("momentumScore", "trendScore", "sizeScore", "safetyScore", "valueScore")
+TEXT_COLUMNS = ("healthLabel", "growthProjection", "predictionConfidence")
+NUMERIC_COLUMNS = ("upside", *RADAR_COLUMNS, "predictionUpper", "predictionLower")
+
+
+def enrich_columns(numeric, markets, percentiles=None):
+    """
+    numeric：欄位 -> float 陣列（NaN 為缺值），需含 _enrich_data 用到的欄位與 marketCap；
+    markets：每列的市場代碼；percentiles：{market: {axis: sorted list}}（RadarPercentiles 的表），None 時只用公式。
+    回傳 (text 欄位 dict, numeric 欄位 dict)。
+    """
+    import numpy as np
+
+    def filled(name, default):
+        col = numeric[name]
+        return np.where(np.isnan(col), default, col)
+
+    text, out = {}, {}
+    roe, z_score, debt = filled("roe", 0), filled("zScore", 0), filled("debtToEquity", 100)
+    text["healthLabel"] = np.select(
+        [(roe > 15) & (z_score > 2.5), (roe > 8) & (z_score > 1.2), (roe < 0) | (z_score < 0.5) | (debt > 150)],
+        ["優", "良", "差"], default="普"
+    ).astype(object)
+
+    rev_g, f_score = filled("revGrowth", 0), filled("fScore", 0)
+    text["growthProjection"] = np.select(
+        [(rev_g > 20) & (f_score >= 6), rev_g > 5, rev_g < -10],
+        ["高速成長", "溫和成長", "衰退警戒"], default="持平"
+    ).astype(object)
+
+    raw, price = raw_scores(np, numeric)
+    mcap = numeric["marketCap"]
+    with np.errstate(all="ignore"):
+        # marketCap 只有在文件中為數值時才有值（一般為格式化字串，公式給 60）
+        size_score = np.where(np.isnan(mcap), 60.0, 40 + np.log10(np.maximum(1e9, mcap)) / 12 * 40)
+    formula = {**raw, "size": size_score}
+    radar = {axis: np.clip(formula[axis], 15, 100) for axis, _, _ in AXES}
+
+    if percentiles:
+        valid = usable_mask(np, raw, price)
+        usable = np.logical_and.reduce([valid[axis] for axis, _, _ in AXES])
+        for market, ranks in percentiles.items():
+            if any(axis not in ranks for axis, _, _ in AXES):
+                continue
+            rows = np.flatnonzero((markets == market) & usable)
+            if not len(rows):
+                continue
+            for axis, _, _ in AXES:
+                table = ranks[axis]
+                pos = np.searchsorted(np.asarray(table, dtype=float), raw[axis][rows], side="right")
+                # 與 percentile() 相同的 round（Python 內建）以確保結果一致
+                radar[axis][rows] = [round(p / len(table) * 100, 1) for p in pos.tolist()]
+
+    for (axis, _, _), name in zip(AXES, RADAR_COLUMNS):
+        out[name] = radar[axis]
+
+    target = numeric["targetPrice"]
+    valid = (price != 0) & (target > 0)
+    out["upside"] = np.where(valid, (target - price) / np.where(valid, price, 1.0) * 100, np.nan)
+
+    atr = np.where(np.isnan(numeric["atr"]), price * 0.02, numeric["atr"])
+    out["predictionUpper"] = price + atr * 2
+    out["predictionLower"] = price - atr * 2
+    text["predictionConfidence"] = np.where(f_score > 4, "中 (68%)", "低 (45%)").astype(object)
+    return text, out
@@ -0,0 +1,334 @@
+"""
+CacheWriter — stock_cache 的 Write-Behind 寫入緩衝
+
+職責：
+1. 合併同一 symbol 的多次 upsert（只保留最後一份文件）
+2. 以 execute_values 在單一交易中批次寫入
+3. 依時間間隔或緩衝大小觸發 flush，程序結束時同步 flush
+4. 與上次寫入（或讀出）的文件做欄位級 diff，只以 `||` 更新變動的 key。
+   diff 基準附帶當時的 updated_at，只有 DB 中的列仍是該版本時才套用部分更新，
+   否則（其他 worker 或腳本已改寫）退回整份 upsert。
+   完全無變動的文件不改寫 stock_cache，只在 stock_cache_checks 記錄檢查時間（讀取端以此判斷新鮮度；
+   migration 8 尚未套用時退回以空 patch 更新 updated_at）
+5. 批次寫入失敗時二分隔離出有問題的列，其餘照常寫入；問題列以指數退避重試，
+   連續失敗 CACHE_MAX_ATTEMPTS 次後捨棄並記錄。連線失敗時整批延後重試
+6. 排行榜刷新與日線匯入在各自的 SAVEPOINT 中執行，失敗只略過該步驟，不會讓快取列被判定為問題列；
+   對應的 migration（3 / 5）尚未套用時直接略過
+
+限制：緩衝只存在於程序記憶體。Serverless 容器被凍結或回收時不會執行 atexit，
+尚未 flush 的資料（最多約 CACHE_FLUSH_INTERVAL 秒內的寫入）會遺失；
+stock_cache 是可由來源重建的快取，下一次請求會重新抓取。
+
+設定（環境變數）：
+- CACHE_FLUSH_INTERVAL：背景 flush 間隔秒數（預設 2）
+- CACHE_FLUSH_SIZE：緩衝達到此數量時立即 flush（預設 50）
+- CACHE_DIFF_SYMBOLS：保留多少個 symbol 的上次寫入快照供 diff（預設 2000）
+- CACHE_MAX_ATTEMPTS：單列連續寫入失敗幾次後捨棄（預設 5）
+- CACHE_MAX_BACKOFF：重試等待上限秒數（預設 60）
+"""
+
+import os
+import json
+import time
+import atexit
+import threading
+from collections import OrderedDict
+from api.db import get_db_connection, return_db_connection, run_in_savepoint, has_schema
+
+_FLUSH_INTERVAL = float(os.environ.get('CACHE_FLUSH_INTERVAL', '2'))
+_FLUSH_SIZE = int(os.environ.get('CACHE_FLUSH_SIZE', '50'))
+_DIFF_SYMBOLS = int(os.environ.get('CACHE_DIFF_SYMBOLS', '2000'))
+_MAX_ATTEMPTS = int(os.environ.get('CACHE_MAX_ATTEMPTS', '5'))
+_MAX_BACKOFF = float(os.environ.get('CACHE_MAX_BACKOFF', '60'))
+
+# symbol -> 已序列化的 JSON 文件（入列時即快照，避免呼叫端後續修改 dict）
+_PENDING: dict = {}
+_PENDING_LOCK = threading.Lock()
+_FLUSH_LOCK = threading.Lock()
+_WAKE = threading.Event()
+_FLUSHER = None
+_FLUSHER_LOCK = threading.Lock()
+
+# symbol -> (連續失敗次數, 下次可重試的時間)；只在 _FLUSH_LOCK 內存取
+_FAILED: dict = {}
+# 連線層連續失敗次數與背景 flush 下次可執行的時間
+_FAILURES = 0
+_RETRY_AT = 0.0
+
+# symbol -> (updated_at, {key: canonical JSON})，代表 DB 中該版本的文件內容（LRU 上限 _DIFF_SYMBOLS）
+_LAST_WRITTEN: OrderedDict = OrderedDict()
+_LAST_LOCK = threading.Lock()
+
+
+def _fingerprint(doc: dict) -> dict:
+    """將文件拆成 key -> canonical JSON，用於欄位級比較"""
+    return {k: json.dumps(v, sort_keys=True) for k, v in doc.items()}
+
+
+class CacheWriter:
+    """
+    stock_cache 的 write-behind 緩衝層。
+    StockService._save_to_cache 只負責入列，實際寫入由背景執行緒批次完成。
+    """
+
+    @staticmethod
+    def enqueue(symbol: str, data: dict):
+        """入列一筆 upsert；同一 symbol 的舊資料會被覆蓋"""
+        payload = json.dumps(data)
+        with _PENDING_LOCK:
+            _PENDING[symbol] = payload
+            size = len(_PENDING)
+        CacheWriter._ensure_flusher()
+        if size >= _FLUSH_SIZE:
+            _WAKE.set()
+
+    @staticmethod
+    def get_pending(symbol: str):
+        """讀取尚未寫入 DB 的最新文件（read-your-writes），無則回傳 None"""
+        with _PENDING_LOCK:
+            payload = _PENDING.get(symbol)
+        return json.loads(payload) if payload is not None else None
+
+    @staticmethod
+    def remember(symbol: str, doc: dict, updated_at):
+        """記錄 DB 中已存在的文件與其 updated_at（例如剛讀出的快取），之後的寫入即可只送差異"""
+        if not isinstance(doc, dict) or updated_at is None:
+            return
+        CacheWriter._set_last(symbol, _fingerprint(doc), updated_at)
+
+    @staticmethod
+    def flush(respect_backoff=False) -> int:
+        """
+        同步寫入緩衝資料，回傳寫入筆數（含內容未變動、只記錄檢查時間的列）。
+        respect_backoff=True 時（背景執行緒）跳過仍在重試等待中的 symbol。
+        """
+        global _FAILURES, _RETRY_AT
+        with _FLUSH_LOCK:
+            now = time.time()
+            with _PENDING_LOCK:
+                batch = [(s, p) for s, p in _PENDING.items()
+                         if not respect_backoff or _FAILED.get(s, (0, 0))[1] <= now]
+                for symbol, _ in batch:
+                    del _PENDING[symbol]
+            if not batch:
+                return 0
+
+            rows = CacheWriter._prepare(batch)
+            if not rows:
+                return 0
+
+            conn = get_db_connection()
+            if not conn:
+                CacheWriter._requeue(batch)
+                _FAILURES += 1
+                _RETRY_AT = now + CacheWriter._backoff(_FAILURES)
+                return 0
+            try:
+                written, failed = CacheWriter._write_isolated(conn, rows)
+            except Exception as e:
+                # 連線層錯誤：整批放回緩衝，不計入個別列的失敗次數
+                print(f"[CacheWriter] Flush error ({len(batch)} rows): {e}")
+                with _LAST_LOCK:
+                    for symbol, _ in batch:
+                        _LAST_WRITTEN.pop(symbol, None)
+                CacheWriter._requeue(batch)
+                _FAILURES += 1
+                _RETRY_AT = now + CacheWriter._backoff(_FAILURES)
+                return 0
+            finally:
+                return_db_connection(conn)
+
+            _FAILURES, _RETRY_AT = 0, 0.0
+            for row in written:
+                _FAILED.pop(row["symbol"], None)
+                CacheWriter._set_last(row["symbol"], row["fp"], row.get("updated_at"))
+            for row, error in failed:
+                CacheWriter._reject(row, error)
+            return len(written)
+
+    @staticmethod
+    def _prepare(batch):
+        """
+        與上次寫入內容比對，產生整份 upsert（patch 為 None）或部分更新的列。
+        未變動的文件標記為 unchanged，寫入時只記錄檢查時間（history 的 24 小時新鮮度依賴此時間）。
+        """
+        rows = []
+        for symbol, payload in batch:
+            fp = _fingerprint(json.loads(payload))
+            with _LAST_LOCK:
+                last = _LAST_WRITTEN.get(symbol)
+            row = {"symbol": symbol, "payload": payload, "fp": fp, "patch": None, "removed": [], "changed": set(fp),
+                   "unchanged": False}
+            if last is not None:
+                base_at, last_fp = last
+                changed = {k: v for k, v in fp.items() if last_fp.get(k) != v}
+                row["base_at"] = base_at
+                row["patch"] = "{" + ",".join(f"{json.dumps(k)}:{v}" for k, v in changed.items()) + "}"
+                row["removed"] = [k for k in last_fp if k not in fp]
+                row["changed"] = set(changed)
+                row["unchanged"] = not changed and not row["removed"]
+            rows.append(row)
+        return rows
+
+    @staticmethod
+    def _write_isolated(conn, rows):
+        """
+        以單一交易寫入 rows；失敗時二分重試，找出無法寫入的列（例如 jsonb 拒收的值）。
+        回傳 (成功的 rows, [(失敗的 row, 例外)])；連線中斷時直接拋出。
+        """
+        try:
+            CacheWriter._write(conn, rows)
+            return rows, []
+        except Exception as e:
+            try: conn.rollback()
+            except Exception: pass
+            if getattr(conn, "closed", 0):
+                raise
+            if len(rows) == 1:
+                return [], [(rows[0], e)]
+        mid = len(rows) // 2
+        ok_left, bad_left = CacheWriter._write_isolated(conn, rows[:mid])
+        ok_right, bad_right = CacheWriter._write_isolated(conn, rows[mid:])
+        return ok_left + ok_right, bad_left + bad_right
+
+    @staticmethod
+    def _write(conn, rows):
+        from psycopg2.extras import execute_values
+        cur = conn.cursor()
+        by_symbol = {r["symbol"]: r for r in rows}
+        full_rows = [(r["symbol"], r["payload"]) for r in rows if r["patch"] is None]
+        # 未變動的列只記錄檢查時間；檢查表尚未建立時退回空 patch（仍會改寫列並更新 updated_at）
+        checked = [r for r in rows if r["unchanged"]] if has_schema(8) else []
+        checked_symbols = {r["symbol"] for r in checked}
+        patch_rows = [(r["symbol"], r["patch"], r["removed"], r["base_at"])
+                      for r in rows if r["patch"] is not None and r["symbol"] not in checked_symbols]
+        stored_at = {}
+        if checked:
+            run_in_savepoint(
+                cur, "cache_checks", execute_values, cur,
+                """
+                INSERT INTO stock_cache_checks (symbol, checked_at) VALUES %s
+                ON CONFLICT (symbol) DO UPDATE SET checked_at = EXCLUDED.checked_at
+                """,
+                [(r["symbol"],) for r in checked],
+                template="(%s, NOW())",
+                page_size=max(1, _FLUSH_SIZE)
+            )
+            # stock_cache 的列未改寫，diff 基準維持原本的 updated_at
+            stored_at.update((r["symbol"], r["base_at"]) for r in checked)
+        if patch_rows:
+            updated = execute_values(
+                cur,
+                """
+                UPDATE stock_cache AS c
+                SET data = (COALESCE(c.data, '{}'::jsonb) - v.removed::text[]) || v.patch::jsonb,
+                    updated_at = NOW()
+                FROM (VALUES %s) AS v(symbol, patch, removed, base_at)
+                WHERE c.symbol = v.symbol AND c.updated_at = v.base_at
+                RETURNING c.symbol, c.updated_at
+                """,
+                patch_rows,
+                page_size=max(1, _FLUSH_SIZE),
+                fetch=True
+            )
+            stored_at.update(updated)
+            # 列已不存在或已被其他寫入者改寫時，diff 基準失效，退回整份 upsert
+            full_rows += [(s, by_symbol[s]["payload"]) for s, _, _, _ in patch_rows if s not in stored_at]
+        if full_rows:
+            inserted = execute_values(
+                cur,
+                """
+                INSERT INTO stock_cache (symbol, data, updated_at) VALUES %s
+                ON CONFLICT (symbol) DO UPDATE SET data = EXCLUDED.data, updated_at = NOW()
+                RETURNING symbol, updated_at
+                """,
+                full_rows,
+                template="(%s, %s::jsonb, NOW())",
+                page_size=max(1, _FLUSH_SIZE),
+                fetch=True
+            )
+            stored_at.update(inserted)
+            for symbol, _ in full_rows:
+                by_symbol[symbol]["changed"] = set(by_symbol[symbol]["fp"])
+        # 價格有變動的 symbol 在同一交易中刷新排行榜物化表（SAVEPOINT：失敗不影響快取寫入）
+        full_symbols = {s for s, _ in full_rows}
+        repriced = [r["symbol"] for r in rows if r["symbol"] in full_symbols or "price" in r["changed"]]
+        if repriced and has_schema(3):
+            from api.services.leaderboard_service import LeaderboardService
+            run_in_savepoint(cur, "leaderboard_refresh", LeaderboardService.refresh_with_cursor, cur, symbols=repriced)
+        # 新抓到的日線歷史同步匯入共用的 daily_prices
+        histories = {}
+        for r in rows:
+            for key in r["changed"]:
+                if key.startswith("history_") and key.endswith("_1d"):
+                    histories.setdefault(r["symbol"], []).extend(json.loads(r["fp"][key]))
+        if histories and has_schema(5):
+            from api.services.history_store import HistoryStore
+            run_in_savepoint(cur, "history_ingest", HistoryStore.ingest_with_cursor, cur, histories)
+        conn.commit()
+        cur.close()
+        for symbol, updated_at in stored_at.items():
+            by_symbol[symbol]["updated_at"] = updated_at
+
+    @staticmethod
+    def _reject(row, error):
+        """單列寫入失敗：放回緩衝並延後重試，連續失敗 _MAX_ATTEMPTS 次後捨棄"""
+        symbol = row["symbol"]
+        with _LAST_LOCK:
+            _LAST_WRITTEN.pop(symbol, None)
+        attempts = _FAILED.get(symbol, (0, 0))[0] + 1
+        if attempts >= _MAX_ATTEMPTS:
+            _FAILED.pop(symbol, None)
+            print(f"[CacheWriter] Dropping {symbol} after {attempts} failed writes: {error}")
+            return
+        _FAILED[symbol] = (attempts, time.time() + CacheWriter._backoff(attempts))
+        print(f"[CacheWriter] Write failed for {symbol} (attempt {attempts}/{_MAX_ATTEMPTS}): {error}")
+        CacheWriter._requeue([(symbol, row["payload"])])
+
+    @staticmethod
+    def _backoff(failures):
+        return min(_MAX_BACKOFF, _FLUSH_INTERVAL * 2 ** failures)
+
+    @staticmethod
+    def _set_last(symbol: str, fp: dict, updated_at):
+        if updated_at is None:
+            return
+        with _LAST_LOCK:
+            _LAST_WRITTEN[symbol] = (updated_at, fp)
+            _LAST_WRITTEN.move_to_end(symbol)
+            while len(_LAST_WRITTEN) > _DIFF_SYMBOLS:
+                _LAST_WRITTEN.popitem(last=False)
+
+    @staticmethod
+    def _requeue(batch):
+        """寫入失敗時放回緩衝；若期間已有更新的資料則以新資料為準"""
+        with _PENDING_LOCK:
+            for symbol, payload in batch:
+                _PENDING.setdefault(symbol, payload)
+
+    @staticmethod
+    def _ensure_flusher():
+        global _FLUSHER
+        if _FLUSHER is not None and _FLUSHER.is_alive():
+            return
+        with _FLUSHER_LOCK:
+            if _FLUSHER is None or not _FLUSHER.is_alive():
+                _FLUSHER = threading.Thread(target=CacheWriter._run, name="cache-writer", daemon=True)
+                _FLUSHER.start()
+
+    @staticmethod
+    def _run():
+        while True:
+            _WAKE.wait(_FLUSH_INTERVAL)
+            _WAKE.clear()
+            if time.time() < _RETRY_AT:
+                continue
+            try:
+                CacheWriter.flush(respect_backoff=True)
+            except Exception as e:
+                print(f"[CacheWriter] Background flush error: {e}")
+
+
+# 程序結束（腳本執行完畢、本地 dev server 停止）時同步 flush，避免遺失緩衝資料。
+# Serverless 容器被凍結或回收時 atexit 不會執行，尚未 flush 的資料會遺失（見模組說明）。
+atexit.register(CacheWriter.flush)
@@ -0,0 +1,140 @@
+"""
+HistoryStore — 共用的日線歷史資料庫（daily_prices）
+
+職責：
+1. 匯入日線 OHLCV（個股詳情抓到的 history_1y_1d 由 CacheWriter 在寫入時一併匯入；
+   指數由 refresh() 依需要向 yfinance 補齊）
+2. 提供多個 symbol 的收盤價序列，供市場狀態、回測與預測結算以 NumPy 批次計算
+
+所有 worker 共用同一份歷史資料，不再各自重新抓取。
+"""
+
+from datetime import date, timedelta
+from api.db import get_db_connection, return_db_connection
+
+_UPSERT_SQL = """
+    INSERT INTO daily_prices (symbol, date, open, high, low, close, volume) VALUES %s
+    ON CONFLICT (symbol, date) DO UPDATE SET
+        open = EXCLUDED.open, high = EXCLUDED.high, low = EXCLUDED.low,
+        close = EXCLUDED.close, volume = EXCLUDED.volume
+"""
+
+
+def _to_rows(symbol, records):
+    rows = []
+    for r in records or []:
+        d, close = r.get("Date"), r.get("Close")
+        # 只接受日線格式（YYYY-MM-DD）且有收盤價的資料
+        if not close or not isinstance(d, str) or len(d) != 10:
+            continue
+        rows.append((symbol, d, r.get("Open"), r.get("High"), r.get("Low"), close, r.get("Volume")))
+    return rows
+
+
+class HistoryStore:
+    """daily_prices 的讀寫"""
+
+    @staticmethod
+    def ingest_with_cursor(cur, histories: dict) -> int:
+        """histories: symbol -> [{"Date", "Open", "High", "Low", "Close", "Volume"}]"""
+        # 同一批次內 (symbol, date) 必須唯一，否則 ON CONFLICT DO UPDATE 會失敗
+        rows = list({row[:2]: row for symbol, records in histories.items() for row in _to_rows(symbol, records)}.values())
+        if not rows:
+            return 0
+        from psycopg2.extras import execute_values
+        execute_values(cur, _UPSERT_SQL, rows, page_size=1000)
+        return len(rows)
+
+    @staticmethod
+    def ingest(histories: dict) -> int:
+        conn = get_db_connection()
+        if not conn: return 0
+        try:
+            cur = conn.cursor()
+            count = HistoryStore.ingest_with_cursor(cur, histories)
+            conn.commit()
+            cur.close()
+            return count
+        except Exception as e:
+            print(f"[HistoryStore] Ingest error: {e}")
+            try: conn.rollback()
+            except Exception: pass
+            return 0
+        finally:
+            return_db_connection(conn)
+
+    @staticmethod
+    def latest_dates(symbols) -> dict:
+        """symbol -> 最新一筆日線日期（無資料的 symbol 不在結果內）"""
+        symbols = list(symbols)
+        if not symbols: return {}
+        conn = get_db_connection()
+        if not conn: return {}
+        try:
+            cur = conn.cursor()
+            cur.execute(
+                "SELECT symbol, MAX(date) FROM daily_prices WHERE symbol = ANY(%s) GROUP BY symbol",
+                (symbols,)
+            )
+            out = {s: d for s, d in cur.fetchall()}
+            cur.close()
+            return out
+        except Exception as e:
+            print(f"[HistoryStore] latest_dates error: {e}")
+            return {}
+        finally:
+            return_db_connection(conn)
+
+    @staticmethod
+    def refresh(symbols, period="1y", max_age_days=1) -> int:
+        """
+        最新資料早於 max_age_days 天的 symbol 重新向 yfinance 抓取日線並匯入。
+        用於指數等不會經過個股詳情流程的標的。
+        """
+        from api.scrapers import fetch_history_from_yfinance
+        latest = HistoryStore.latest_dates(symbols)
+        cutoff = date.today() - timedelta(days=max_age_days)
+        histories = {}
+        for symbol in symbols:
+            if latest.get(symbol) and latest[symbol] >= cutoff:
+                continue
+            records = fetch_history_from_yfinance(symbol, period=period, interval="1d", max_points=400)
+            if records:
+                histories[symbol] = records
+        return HistoryStore.ingest(histories) if histories else 0
+
+    @staticmethod
+    def load_series(symbols, since=None) -> dict:
+        """
+        symbol -> {"dates": datetime64[D] 陣列, "close": float 陣列}（依日期遞增）。
+        since：只讀取該日期（含）之後的資料。
+        """
+        import numpy as np
+        symbols = list(symbols)
+        if not symbols: return {}
+        conn = get_db_connection()
+        if not conn: return {}
+        try:
+            cur = conn.cursor()
+            cur.execute(
+                """
+                SELECT symbol, array_agg(date ORDER BY date), array_agg(close ORDER BY date)
+                FROM daily_prices
+                WHERE symbol = ANY(%s) AND date >= %s
+                GROUP BY symbol
+                """,
+                (symbols, since or date(1900, 1, 1))
+            )
+            out = {}
+            for symbol, dates, closes in cur.fetchall():
+                out[symbol] = {
+                    "dates": np.array(dates, dtype="datetime64[D]"),
+                    "close": np.array(closes, dtype=float),
+                }
+            cur.close()
+            return out
+        except Exception as e:
+            print(f"[HistoryStore] load_series error: {e}")
+            return {}
+        finally:
+            return_db_connection(conn)
@@ -0,0 +1,200 @@
+"""
+LeaderboardService — 排行榜物化層
+
+職責：
+1. 將 portfolio_items × users × stock_cache 的報酬率預先計算到 leaderboard_entries
+2. 彙總每位使用者的持倉統計到 leaderboard_users
+3. 價格或持倉變動時只刷新受影響的列（incremental refresh）
+
+讀取端只需對物化表做一次帶索引的分頁查詢。
+"""
+
+from api.db import get_db_connection, return_db_connection
+
+# sort -> 逐筆持倉的排序（皆有對應索引）
+_POSITION_ORDER = {
+    "date": "entry_date DESC, portfolio_id",
+    "return": "return_pct DESC, portfolio_id",
+}
+
+_REFRESH_ENTRIES_SQL = """
+    INSERT INTO leaderboard_entries (
+        portfolio_id, user_id, nickname, symbol, entry_price, entry_date,
+        current_price, return_pct, refreshed_at
+    )
+    SELECT
+        p.id, p.user_id, u.nickname, p.symbol, p.entry_price, p.entry_date,
+        COALESCE(s.price, 0),
+        CASE WHEN p.entry_price > 0 AND s.price > 0
+             THEN ROUND((s.price - p.entry_price) / p.entry_price * 100, 2)
+             ELSE 0 END,
+        NOW()
+    FROM portfolio_items p
+    JOIN users u ON p.user_id = u.id
+    LEFT JOIN stock_cache s ON p.symbol = s.symbol
+    WHERE {where}
+    ON CONFLICT (portfolio_id) DO UPDATE SET
+        nickname = EXCLUDED.nickname,
+        symbol = EXCLUDED.symbol,
+        entry_price = EXCLUDED.entry_price,
+        entry_date = EXCLUDED.entry_date,
+        current_price = EXCLUDED.current_price,
+        return_pct = EXCLUDED.return_pct,
+        refreshed_at = EXCLUDED.refreshed_at
+    RETURNING user_id
+"""
+
+_REFRESH_USERS_SQL = """
+    INSERT INTO leaderboard_users (
+        user_id, nickname, positions, avg_return, best_return, worst_return, refreshed_at
+    )
+    SELECT user_id, MAX(nickname), COUNT(*), ROUND(AVG(return_pct), 2),
+           MAX(return_pct), MIN(return_pct), NOW()
+    FROM leaderboard_entries
+    WHERE user_id = ANY(%s::uuid[])
+    GROUP BY user_id
+    ON CONFLICT (user_id) DO UPDATE SET
+        nickname = EXCLUDED.nickname,
+        positions = EXCLUDED.positions,
+        avg_return = EXCLUDED.avg_return,
+        best_return = EXCLUDED.best_return,
+        worst_return = EXCLUDED.worst_return,
+        refreshed_at = EXCLUDED.refreshed_at
+"""
+
+_PRUNE_USERS_SQL = """
+    DELETE FROM leaderboard_users lu
+    WHERE lu.user_id = ANY(%s::uuid[])
+    AND NOT EXISTS (SELECT 1 FROM leaderboard_entries e WHERE e.user_id = lu.user_id)
+"""
+
+
+class LeaderboardError(ValueError):
+    """排行榜查詢參數不合法"""
+
+
+class LeaderboardService:
+    """排行榜物化表的刷新與讀取"""
+
+    MAX_PAGE_SIZE = 100
+
+    @staticmethod
+    def refresh_with_cursor(cur, symbols=None, portfolio_ids=None, user_ids=None):
+        """
+        在呼叫端的交易中刷新物化表（呼叫端負責 commit）。
+        三個條件皆為 None 時做全量刷新。
+        """
+        where, params = [], []
+        if symbols is not None:
+            where.append("p.symbol = ANY(%s)")
+            params.append(list(symbols))
+        if portfolio_ids is not None:
+            where.append("p.id = ANY(%s::uuid[])")
+            params.append([str(i) for i in portfolio_ids])
+        if user_ids is not None:
+            where.append("p.user_id = ANY(%s::uuid[])")
+            params.append([str(i) for i in user_ids])
+        if not where:
+            where.append("TRUE")
+
+        cur.execute(_REFRESH_ENTRIES_SQL.format(where=" OR ".join(where)), tuple(params))
+        affected = {str(r[0]) for r in cur.fetchall()}
+        if user_ids is not None:
+            # 刪除持倉後 entries 已由 ON DELETE CASCADE 移除，仍需重算該使用者
+            affected |= {str(u) for u in user_ids}
+        if affected:
+            LeaderboardService.refresh_users_with_cursor(cur, affected)
+
+    @staticmethod
+    def refresh_users_with_cursor(cur, user_ids):
+        """重算指定使用者的彙總列；已無持倉的使用者會被移除"""
+        user_ids = [str(u) for u in user_ids]
+        if not user_ids:
+            return
+        cur.execute(_REFRESH_USERS_SQL, (user_ids,))
+        cur.execute(_PRUNE_USERS_SQL, (user_ids,))
+
+    @staticmethod
+    def refresh(symbols=None, portfolio_ids=None, user_ids=None):
+        """取得獨立連線並刷新（供腳本或背景工作使用）"""
+        conn = get_db_connection()
+        if not conn: return
+        try:
+            cur = conn.cursor()
+            LeaderboardService.refresh_with_cursor(cur, symbols, portfolio_ids, user_ids)
+            conn.commit()
+            cur.close()
+        except Exception as e:
+            print(f"[Leaderboard] Refresh error: {e}")
+            conn.rollback()
+        finally:
+            return_db_connection(conn)
+
+    @staticmethod
+    def get_leaderboard(page=1, page_size=50, view="positions", sort="date"):
+        """
+        讀取排行榜（分頁）。
+        view="positions"：逐筆持倉，sort="date"（預設，最新紀錄在前）或 sort="return"（依報酬率，附 rank）；
+        view="users"：每位使用者彙總，依平均報酬率排序。
+        參數不合法時拋出 LeaderboardError。
+        """
+        try:
+            page = max(1, int(page or 1))
+            page_size = max(1, min(LeaderboardService.MAX_PAGE_SIZE, int(page_size or 50)))
+        except (TypeError, ValueError):
+            raise LeaderboardError("page and page_size must be integers")
+        if view not in ("positions", "users"):
+            raise LeaderboardError(f"Unknown view: {view}")
+        sort = sort or "date"
+        if sort not in _POSITION_ORDER:
+            raise LeaderboardError(f"Unknown sort: {sort} (expected one of {', '.join(_POSITION_ORDER)})")
+        offset = (page - 1) * page_size
+
+        conn = get_db_connection()
+        if not conn: return []
+        try:
+            from psycopg2.extras import RealDictCursor
+            cur = conn.cursor(cursor_factory=RealDictCursor)
+            if view == "users":
+                cur.execute("""
+                    SELECT user_id, nickname, positions, avg_return, best_return, worst_return
+                    FROM leaderboard_users
+                    ORDER BY avg_return DESC, user_id
+                    LIMIT %s OFFSET %s
+                """, (page_size, offset))
+                return [{
+                    "rank": offset + i + 1,
+                    "user_id": str(row['user_id']),
+                    "nickname": row['nickname'],
+                    "positions": row['positions'],
+                    "avg_return": float(row['avg_return'] or 0),
+                    "best_return": float(row['best_return'] or 0),
+                    "worst_return": float(row['worst_return'] or 0)
+                } for i, row in enumerate(cur.fetchall())]
+
+            cur.execute(f"""
+                SELECT portfolio_id, user_id, nickname, symbol, entry_price, entry_date,
+                       current_price, return_pct
+                FROM leaderboard_entries
+                ORDER BY {_POSITION_ORDER[sort]}
+                LIMIT %s OFFSET %s
+            """, (page_size, offset))
+            entries = [{
+                "id": row['portfolio_id'],
+                "user_id": str(row['user_id']),
+                "nickname": row['nickname'],
+                "symbol": row['symbol'],
+                "entry_price": float(row['entry_price'] or 0),
+                "current_price": float(row['current_price'] or 0),
+                "return": float(row['return_pct'] or 0),
+                "date": row['entry_date']
+            } for row in cur.fetchall()]
+            if sort == "return":
+                for i, entry in enumerate(entries):
+                    entry["rank"] = offset + i + 1
+            return entries
+        except Exception as e:
+            print(f"[Leaderboard] Read error: {e}")
+            return []
+        finally:
+            return_db_connection(conn)
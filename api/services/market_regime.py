@@ -1,73 +1,440 @@
-from datetime import datetime, timedelta
+"""
+MarketRegimeDetector — 多指數、多訊號市場狀態（bull / bear / sideways）
+
+職責：
+1. 由共用的日線歷史（HistoryStore / daily_prices）與 stock_cache 全市場資料，
+   以 NumPy 一次計算所有指數的訊號：趨勢斜率（對數價格線性迴歸）、已實現波動度、
+   市場寬度（站上 SMA50 / SMA200 的比例）與距高點回撤，合成為各狀態的機率
+2. 結果寫入 market_regimes 表並以「日」為單位快取（計算日不是今日即重新計算），
+   所有 worker 共用同一次計算；同時間只有取得 advisory lock 的 worker 會重新計算。
+   計算（含向 yfinance 補齊指數日線）只在背景執行緒或排程（scripts/warmup_cache.py）中進行，
+   請求路徑只讀取最近一次儲存的結果；失敗時記錄嘗試時間並依失敗次數指數退避
+3. 依交易市場回傳對應指數的狀態（台股 -> 加權指數，美股 -> S&P 500）
+
+門檻、回看天數與訊號權重讀取 strategy_config.json 的 market_regime 區段（經由 StateStore）。
+"""
+
+import json
+import time
+import threading
+from datetime import date, datetime, timedelta
+from api.db import get_db_connection, return_db_connection
+from api.services.state_store import STRATEGY_CONFIG
+
+# 市場代號 -> 指數
+MARKET_INDICES = {
+    "TW": "^TWII",     # 台灣加權指數
+    "TPEX": "^TWOII",  # 櫃買指數
+    "SPX": "^GSPC",    # S&P 500
+    "NDX": "^NDX",     # Nasdaq 100
+}
+# 交易市場（trending 的 market 參數）-> 代表指數的市場代號
+_TRADING_MARKETS = {"TW": "TW", "US": "SPX"}
+# 指數市場代號 -> 計算寬度時使用的 stock_cache.market
+_BREADTH_MARKETS = {"TW": "TW", "TPEX": "TW", "SPX": "US", "NDX": "US"}
+
+_LOCAL_TTL = 300       # 行程內快取（5 分鐘），之後改讀 DB 共用結果
+_HISTORY_DAYS = 400    # 回撤以約一年的高點計算
+_LOCK_KEY = 20260217   # pg_try_advisory_xact_lock(_LOCK_KEY, 0)：全部指數一起計算
+_RETRY_BASE = 300      # 計算失敗後的重試間隔（秒），依連續失敗次數倍增
+_RETRY_MAX = 6 * 3600  # 重試間隔上限
+_STATES = ("bull", "sideways", "bear")
+
+_DEFAULT_CONFIG = {
+    "bull_threshold": 0.05,
+    "bear_threshold": -0.05,
+    "lookback_days": 30,
+    # 合成分數權重（各訊號先正規化到 [-1, 1]）
+    "signal_weights": {"trend": 0.35, "momentum": 0.25, "breadth": 0.25, "drawdown": 0.15},
+    "trend_scale": 0.30,       # 年化趨勢 30% 視為滿分
+    "drawdown_scale": 0.20,    # 回撤 20% 視為最差
+    "volatility_ref": 0.20,    # 年化波動度參考值，高於此值加重 bear 機率
+    "sharpness": 4.0,          # softmax 溫度倒數，越大機率越集中
+}
+
+
+def _regime_config():
+    config = dict(_DEFAULT_CONFIG)
+    try:
+        section = STRATEGY_CONFIG.read().get("market_regime", {})
+        weights = dict(config["signal_weights"], **section.get("signal_weights", {}))
+        config.update(section)
+        config["signal_weights"] = weights
+    except Exception as e:
+        print(f"[MarketRegime] Failed to read config, using defaults: {e}")
+    return config
+
+
+def _default_result(market):
+    return {
+        "market": market,
+        "index": MARKET_INDICES.get(market),
+        "regime": "sideways",
+        "computed_at": None,
+    }
 
-# [Optimization] yfinance and numpy are lazy-loaded in detect_regime()
 
 class MarketRegimeDetector:
-    def __init__(self, index_symbol="^TWII"):
+    def __init__(self):
+        # market -> (checked_at epoch, result)
+        self._cache = {}
+        self._lock = threading.Lock()
+        self._refreshing = False
+        self._next_refresh = 0.0
+
+    @staticmethod
+    def resolve_market(market):
+        """接受交易市場（TW / US）或指數市場代號（TW / TPEX / SPX / NDX）"""
+        market = (market or "TW").upper()
+        return _TRADING_MARKETS.get(market, market if market in MARKET_INDICES else "TW")
+
+    def detect_regime(self, market="TW"):
+        """回傳該市場目前的狀態字串（bull / bear / sideways）"""
+        return self.get_regime(market)["regime"]
+
+    def get_regime(self, market="TW", compute=True):
+        """
+        依序讀取：行程內快取 -> DB 共用結果（最近一次儲存者）-> 預設值。請求路徑上不做計算：
+        compute=True 且 DB 結果不是今日計算、也已過失敗退避時間時，於背景執行緒重新計算，
+        期間先回傳最近一次儲存的結果。
+        """
+        market = MarketRegimeDetector.resolve_market(market)
+        cached = self._cache.get(market)
+        if cached and time.time() - cached[0] < _LOCAL_TTL:
+            return cached[1]
+
+        with self._lock:
+            cached = self._cache.get(market)
+            if cached and time.time() - cached[0] < _LOCAL_TTL:
+                return cached[1]
+            shared = MarketRegimeDetector._read_shared()
+            now = time.time()
+            for m, r in shared.items():
+                self._cache[m] = (now, r["result"])
+            current = shared.get(market)
+            result = current["result"] if current else _default_result(market)
+            self._cache[market] = (now, result)
+
+        if compute and (len(shared) < len(MARKET_INDICES) or any(r["due"] for r in shared.values())):
+            self.refresh_async()
+        return result
+
+    def get_all(self, compute=True):
+        return {m: self.get_regime(m, compute=compute) for m in MARKET_INDICES}
+
+    def refresh(self):
+        """同步重新計算所有指數並寫回 DB（排程 / 腳本使用）；回傳 market -> result"""
+        shared = MarketRegimeDetector._read_shared()
+        results = MarketRegimeDetector._compute_shared({m: r["result"] for m, r in shared.items()})
+        now = time.time()
+        with self._lock:
+            for m, r in results.items():
+                self._cache[m] = (now, r)
+        return results
+
+    def refresh_async(self):
+        """背景重新計算；同一行程同時只有一個，且兩次嘗試間隔至少 _RETRY_BASE 秒"""
+        with self._lock:
+            if self._refreshing or time.time() < self._next_refresh:
+                return
+            self._refreshing = True
+            self._next_refresh = time.time() + _RETRY_BASE
+
+        def _run():
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"[MarketRegime] Background refresh error: {e}")
+            finally:
+                self._refreshing = False
+        threading.Thread(target=_run, name="market-regime-refresh", daemon=True).start()
+
+    def export_state(self):
+        """行程內快取的結果（warm-start 快照使用）"""
+        return {m: r for m, (_, r) in self._cache.items()}
+
+    def load_state(self, state, checked_at=None):
+        """載入 warm-start 快照中的結果；checked_at 之後 _LOCAL_TTL 內直接使用"""
+        for market, result in (state or {}).items():
+            if market in MARKET_INDICES and isinstance(result, dict) and market not in self._cache:
+                self._cache[market] = (checked_at or time.time(), result)
+
+    # ------------------------------------------------------------
+    # Shared (DB) layer
+    # ------------------------------------------------------------
+    @staticmethod
+    def _read_shared():
         """
-        Initialize with a market index symbol.
-        Default is Taiwan Weighted Index (^TWII).
+        market -> {"result", "fresh", "due"}。fresh 表示為今日計算的結果；
+        due 表示需要重新計算（非今日結果，且距上次嘗試已超過失敗次數對應的退避時間）。
         """
-        self.index_symbol = index_symbol
-        self.current_regime = "sideways"
-        self.last_update = None
+        conn = get_db_connection()
+        if not conn: return {}
+        try:
+            cur = conn.cursor()
+            cur.execute("""
+                SELECT market, details, COALESCE(computed_at::date = CURRENT_DATE, FALSE),
+                       attempted_at IS NULL
+                       OR attempted_at < NOW() - make_interval(secs => LEAST(%s * POWER(2, failures), %s))
+                FROM market_regimes
+            """, (_RETRY_BASE, _RETRY_MAX))
+            rows = cur.fetchall()
+            cur.close()
+            return {
+                m: {"result": details, "fresh": bool(fresh), "due": not fresh and bool(retry)}
+                for m, details, fresh, retry in rows if details
+            }
+        except Exception as e:
+            print(f"[MarketRegime] Read error: {e}")
+            try: conn.rollback()
+            except Exception: pass
+            return {}
+        finally:
+            return_db_connection(conn)
+
+    @staticmethod
+    def _compute_shared(fallback=None):
+        """
+        取得鎖後計算所有指數並寫回 DB；未取得鎖時沿用 fallback（舊結果）。
+        計算失敗的指數保留舊結果，只記錄嘗試時間與失敗次數，依次數退避後再重試。
+        """
+        fallback = fallback or {}
+        conn = get_db_connection()
+        if not conn:
+            # 無 DB：直接計算，只存在行程內快取
+            results = MarketRegimeDetector.compute_all()
+            return {m: r if r.get("computed_at") else fallback.get(m, r) for m, r in results.items()}
+
+        try:
+            cur = conn.cursor()
+            # 交易層級的鎖：commit / rollback 時自動釋放，連線歸還 pool 前不會殘留
+            cur.execute("SELECT pg_try_advisory_xact_lock(%s, 0)", (_LOCK_KEY,))
+            if not cur.fetchone()[0]:
+                # 其他 worker 正在計算：先沿用舊結果
+                conn.rollback()
+                cur.close()
+                return fallback
+            results = MarketRegimeDetector.compute_all()
+            from psycopg2.extras import execute_values
+            computed = [(m, r["index"], r["regime"], json.dumps(r)) for m, r in results.items() if r.get("computed_at")]
+            failed = [(m, r["index"], r["regime"], json.dumps(r)) for m, r in results.items() if not r.get("computed_at")]
+            if computed:
+                execute_values(
+                    cur,
+                    """
+                    INSERT INTO market_regimes (market, index_symbol, regime, details, computed_at, attempted_at, failures)
+                    VALUES %s
+                    ON CONFLICT (market) DO UPDATE SET
+                        index_symbol = EXCLUDED.index_symbol, regime = EXCLUDED.regime,
+                        details = EXCLUDED.details, computed_at = EXCLUDED.computed_at,
+                        attempted_at = EXCLUDED.attempted_at, failures = 0
+                    """,
+                    computed,
+                    template="(%s, %s, %s, %s::jsonb, NOW(), NOW(), 0)"
+                )
+            if failed:
+                # 舊結果（若有）保留；沒有舊結果時存入預設值，讓其他 worker 也遵守退避
+                execute_values(
+                    cur,
+                    """
+                    INSERT INTO market_regimes (market, index_symbol, regime, details, computed_at, attempted_at, failures)
+                    VALUES %s
+                    ON CONFLICT (market) DO UPDATE SET
+                        attempted_at = EXCLUDED.attempted_at, failures = market_regimes.failures + 1
+                    """,
+                    failed,
+                    template="(%s, %s, %s, %s::jsonb, NULL, NOW(), 1)"
+                )
+                print(f"[MarketRegime] Compute failed for {', '.join(m for m, *_ in failed)}; will retry with backoff")
+            conn.commit()
+            cur.close()
+            # 計算失敗的市場保留舊結果
+            return {m: r if r.get("computed_at") else fallback.get(m, r) for m, r in results.items()}
+        except Exception as e:
+            print(f"[MarketRegime] Shared compute error: {e}")
+            try: conn.rollback()
+            except Exception: pass
+            return fallback
+        finally:
+            return_db_connection(conn)
 
-    def detect_regime(self, lookback_days=30):
+    # ------------------------------------------------------------
+    # Computation
+    # ------------------------------------------------------------
+    @staticmethod
+    def load_index_series():
         """
-        Detect if the market is in Bull, Bear, or Sideways regime.
-        Based on simple return over the lookback period.
+        所有指數的日線收盤價：由 HistoryStore 一次讀取（必要時先補齊）；
+        無 DB 或資料不足時逐一直接向 yfinance 抓取。
         """
-        # If we checked recently (e.g. within 1 hour), return cached
-        if self.last_update and (datetime.now() - self.last_update).seconds < 3600:
-            return self.current_regime
+        import numpy as np
+        from api.services.history_store import HistoryStore
+        symbols = list(MARKET_INDICES.values())
+        since = date.today() - timedelta(days=_HISTORY_DAYS)
+
+        HistoryStore.refresh(symbols)
+        series = HistoryStore.load_series(symbols, since=since)
+        missing = [s for s in symbols if s not in series or len(series[s]["close"]) < 2]
+        if missing:
+            from api.scrapers import fetch_history_from_yfinance
+            for symbol in missing:
+                records = [r for r in fetch_history_from_yfinance(symbol, period="1y", interval="1d") or []
+                           if r.get("Close")]
+                series[symbol] = {
+                    "dates": np.array([r["Date"] for r in records], dtype="datetime64[D]"),
+                    "close": np.array([r["Close"] for r in records], dtype=float),
+                }
+        return series
 
+    @staticmethod
+    def load_breadth():
+        """
+        stock_cache 全市場寬度：各 market 站上 SMA50 / SMA200 的比例。
+        一次查詢取回所有價格與均線，以 NumPy 分組計算。
+        """
+        import numpy as np
+        conn = get_db_connection()
+        if not conn: return {}
         try:
-            import yfinance as yf
-            # Fetch history
-            ticker = yf.Ticker(self.index_symbol)
-            # Fetch slightly more than lookback to ensure we have endpoints
-            end_date = datetime.now()
-            start_date = end_date - timedelta(days=lookback_days + 10)
-            
-            history = ticker.history(start=start_date, end=end_date)
-            
-            if len(history) < 2:
-                return "sideways" # Not enough data
-
-            # Get price lookback_days ago (or closest)
-            # We want the change from (Now - Lookback) to Now
-            
-            # Simple approach: Linear Regression Slope or just Return?
-            # Let's use Return for simplicity as defined in plan: "根據最近 30 日大盤漲跌幅計算"
-            
-            current_price = history['Close'].iloc[-1]
-            past_price = history['Close'].iloc[0] # This is start_date approx
-            
-            # Refine: Find the row closest to exactly lookback_days ago
-            target_date = end_date - timedelta(days=lookback_days)
-            # Find index closest to target_date
-            # Since index is DatetimeIndex, we can use get_loc with method='nearest' if available
-            # Or just take the first element if we fetched correctly.
-            # Let's use the percentage change of the window.
-            
-            # Return = (Last - First) / First
-            market_return = (current_price - past_price) / past_price
-
-            # Define thresholds (Move to config later if needed, but for now defaults)
-            BULL_THRESHOLD = 0.05  # > 5% gain
-            BEAR_THRESHOLD = -0.05 # > 5% loss
-            
-            if market_return > BULL_THRESHOLD:
-                self.current_regime = "bull"
-            elif market_return < BEAR_THRESHOLD:
-                self.current_regime = "bear"
-            else:
-                self.current_regime = "sideways"
-                
-            self.last_update = datetime.now()
-            print(f"[MarketRegime] Index: {self.index_symbol}, Return: {market_return:.2%}, Regime: {self.current_regime}")
-            return self.current_regime
+            cur = conn.cursor()
+            cur.execute("""
+                SELECT market, price,
+                       CASE WHEN jsonb_typeof(data->'sma50') = 'number' THEN (data->>'sma50')::float END,
+                       CASE WHEN jsonb_typeof(data->'sma200') = 'number' THEN (data->>'sma200')::float END
+                FROM stock_cache
+                WHERE price IS NOT NULL AND updated_at > NOW() - INTERVAL '3 days'
+            """)
+            rows = cur.fetchall()
+            cur.close()
+        except Exception as e:
+            print(f"[MarketRegime] Breadth query error: {e}")
+            try: conn.rollback()
+            except Exception: pass
+            return {}
+        finally:
+            return_db_connection(conn)
+        if not rows:
+            return {}
 
+        markets = np.array([r[0] for r in rows])
+        values = np.array([[r[1], r[2], r[3]] for r in rows], dtype=float)
+        price, sma50, sma200 = values[:, 0], values[:, 1], values[:, 2]
+        # 均線缺值時爬蟲會以現價補上，與現價相等者視為無資料
+        has50 = np.isfinite(sma50) & (sma50 > 0) & (sma50 != price)
+        has200 = np.isfinite(sma200) & (sma200 > 0) & (sma200 != price)
+        out = {}
+        for market in np.unique(markets):
+            m = markets == market
+            n50, n200 = int((m & has50).sum()), int((m & has200).sum())
+            out[str(market)] = {
+                "above_sma50": float((price > sma50)[m & has50].mean()) if n50 else None,
+                "above_sma200": float((price > sma200)[m & has200].mean()) if n200 else None,
+                "count": int(m.sum()),
+            }
+        return out
+
+    @staticmethod
+    def compute_all():
+        """一次計算所有指數的市場狀態"""
+        config = _regime_config()
+        try:
+            series = MarketRegimeDetector.load_index_series()
+            breadth = MarketRegimeDetector.load_breadth()
         except Exception as e:
-            print(f"[MarketRegime] Error detecting regime: {e}")
-            return "sideways" # Default fallback
+            print(f"[MarketRegime] Error loading inputs: {e}")
+            return {m: _default_result(m) for m in MARKET_INDICES}
+
+        results = {}
+        for market, index_symbol in MARKET_INDICES.items():
+            s = series.get(index_symbol) or {"dates": [], "close": []}
+            result = MarketRegimeDetector.classify(
+                s["dates"], s["close"], config, breadth.get(_BREADTH_MARKETS[market])
+            )
+            result.update(market=market, index=index_symbol)
+            if result.get("computed_at"):
+                p = result["probabilities"]
+                print(f"[MarketRegime] Index: {index_symbol}, Regime: {result['regime']} "
+                      f"(bull {p['bull']:.0%} / sideways {p['sideways']:.0%} / bear {p['bear']:.0%})")
+            results[market] = result
+        return results
+
+    @staticmethod
+    def compute(market):
+        market = MarketRegimeDetector.resolve_market(market)
+        return MarketRegimeDetector.compute_all().get(market) or _default_result(market)
+
+    @staticmethod
+    def classify(dates, closes, config, breadth=None):
+        """
+        純計算：由收盤價序列（與市場寬度）產生訊號、合成分數與各狀態機率。
+        dates 為遞增的 datetime64[D] 陣列，closes 為對應收盤價。
+        """
+        import numpy as np
+        closes = np.asarray(closes, dtype=float)
+        dates = np.asarray(dates, dtype="datetime64[D]")
+        lookback_days = int(config["lookback_days"])
+        if len(closes) < 2:
+            return {"regime": "sideways", "computed_at": None}
+
+        # 回看視窗起點（lookback_days 前，或最接近的交易日）
+        start = dates[-1] - np.timedelta64(lookback_days, "D")
+        i0 = min(int(np.searchsorted(dates, start)), len(closes) - 2)
+        window = closes[i0:]
+        log_px = np.log(window)
+        days = (dates[i0:] - dates[i0]).astype(float)
+
+        # 1. 趨勢：對數價格對日數的線性迴歸斜率，換算年化
+        slope = np.polyfit(days, log_px, 1)[0] if len(window) >= 3 else (log_px[-1] - log_px[0]) / max(days[-1], 1.0)
+        trend = float(np.expm1(slope * 365))
+        # 2. 動能：回看期間報酬
+        market_return = float(window[-1] / window[0] - 1)
+        # 3. 已實現波動度（年化）
+        rets = np.diff(log_px)
+        volatility = float(rets.std(ddof=1) * np.sqrt(252)) if len(rets) > 1 else 0.0
+        # 4. 距一年高點回撤
+        drawdown = float(closes[-1] / np.maximum.accumulate(closes)[-1] - 1)
+        # 5. 市場寬度
+        b50 = (breadth or {}).get("above_sma50")
+        b200 = (breadth or {}).get("above_sma200")
+        shares = [b for b in (b50, b200) if b is not None]
+
+        # 各訊號正規化到 [-1, 1]
+        bull_t, bear_t = config["bull_threshold"], config["bear_threshold"]
+        momentum_scale = bull_t if market_return >= 0 else abs(bear_t)
+        scores = {
+            "trend": np.clip(trend / config["trend_scale"], -1, 1),
+            "momentum": np.clip(market_return / momentum_scale, -1, 1) if momentum_scale else 0.0,
+            "breadth": np.clip((np.mean(shares) - 0.5) * 2, -1, 1) if shares else None,
+            "drawdown": np.clip(1 + 2 * drawdown / config["drawdown_scale"], -1, 1),
+        }
+        weights = {k: w for k, w in config["signal_weights"].items() if scores.get(k) is not None}
+        total_w = sum(weights.values()) or 1.0
+        composite = float(sum(scores[k] * w for k, w in weights.items()) / total_w)
+
+        # 合成分數 -> 三種狀態的 softmax 機率；高波動加重 bear
+        k = config["sharpness"]
+        vol_excess = max(0.0, volatility / config["volatility_ref"] - 1) if config["volatility_ref"] else 0.0
+        logits = np.array([
+            k * composite,
+            k * (0.35 - abs(composite)),
+            -k * composite + 0.5 * min(vol_excess, 2.0),
+        ])
+        probs = np.exp(logits - logits.max())
+        probs /= probs.sum()
+
+        return {
+            "regime": _STATES[int(np.argmax(probs))],
+            "probabilities": {s: round(float(p), 4) for s, p in zip(_STATES, probs)},
+            "composite": round(composite, 4),
+            "return": round(market_return, 4),
+            "signals": {
+                "trend_annualized": round(trend, 4),
+                "volatility": round(volatility, 4),
+                "drawdown": round(drawdown, 4),
+                "breadth_sma50": None if b50 is None else round(b50, 4),
+                "breadth_sma200": None if b200 is None else round(b200, 4),
+            },
+            "lookback_days": lookback_days,
+            "as_of": str(dates[-1]),
+            "computed_at": datetime.now().isoformat(),
+        }
@@ -0,0 +1,225 @@
+"""
+NameResolver — stock_names 的記憶體索引
+
+職責：
+1. 一次載入 stock_names，建立精確查詢（hash）、前綴查詢（排序陣列 + bisect）
+   與中文子字串查詢（unigram/bigram 倒排索引）
+2. 定期以 updated_at 做增量重載；較長週期做全量重載以反映刪除
+3. 提供代號/名稱解析與搜尋自動完成
+
+索引物件建立後不再修改，重載時整個替換，讀取端無需加鎖。
+"""
+
+import re
+import time
+import threading
+from bisect import bisect_left
+from api.db import get_db_connection, return_db_connection
+
+_DELTA_INTERVAL = 600          # 增量重載間隔（10 分鐘）
+_FULL_INTERVAL = 6 * 3600      # 全量重載間隔（6 小時，反映已刪除的代號）
+_RETRY_INTERVAL = 60           # DB 無法連線時的重試間隔
+
+_CJK = re.compile(r'[\u4e00-\u9fff]')
+
+
+class _NameIndex:
+    """不可變的名稱索引"""
+
+    def __init__(self, names: dict):
+        self.names = names
+        self.by_name = {}
+        for symbol, name in names.items():
+            # 同名時保留較短（通常為主要）代號
+            prev = self.by_name.get(name)
+            if prev is None or len(symbol) < len(prev):
+                self.by_name[name] = symbol
+        self.symbols = sorted(names)
+        self.name_keys = sorted((name.lower(), symbol) for symbol, name in names.items())
+        self.grams = {}
+        for i, symbol in enumerate(self.symbols):
+            for gram in _NameIndex._grams(names[symbol]):
+                self.grams.setdefault(gram, []).append(i)
+
+    @staticmethod
+    def _grams(text: str):
+        chars = [c for c in text if _CJK.match(c)]
+        grams = set(chars)
+        grams.update(a + b for a, b in zip(chars, chars[1:]))
+        return grams
+
+    def symbol_prefix(self, prefix, limit):
+        out = []
+        i = bisect_left(self.symbols, prefix)
+        while i < len(self.symbols) and len(out) < limit and self.symbols[i].startswith(prefix):
+            out.append(self.symbols[i])
+            i += 1
+        return out
+
+    def name_prefix(self, prefix, limit):
+        out = []
+        i = bisect_left(self.name_keys, (prefix,))
+        while i < len(self.name_keys) and len(out) < limit and self.name_keys[i][0].startswith(prefix):
+            out.append(self.name_keys[i][1])
+            i += 1
+        return out
+
+    def substring(self, query, limit):
+        chars = [c for c in query if _CJK.match(c)]
+        if not chars:
+            return []
+        grams = [a + b for a, b in zip(chars, chars[1:])] or chars
+        postings = [self.grams.get(g) for g in grams]
+        if not all(postings):
+            return []
+        candidates = set(min(postings, key=len))
+        for p in postings:
+            candidates.intersection_update(p)
+        matches = sorted(self.symbols[i] for i in candidates if query in self.names[self.symbols[i]])
+        return matches[:limit]
+
+
+_INDEX = _NameIndex({})
+_LOADED = False
+_LAST_DELTA = 0.0
+_LAST_FULL = 0.0
+_LAST_ATTEMPT = 0.0
+_MAX_UPDATED = None
+_RELOAD_LOCK = threading.Lock()
+
+
+class NameResolver:
+    """stock_names 的解析、查詢與自動完成"""
+
+    @staticmethod
+    def ensure_loaded():
+        """首次呼叫同步載入；之後依間隔在背景做增量或全量重載"""
+        now = time.time()
+        if not _LOADED:
+            # 冷啟動先用 warm-start 快照；排程從快照時間起算，過舊時很快會在背景重載
+            from api.services.warm_start import section
+            names, created_at = section("names")
+            if names:
+                NameResolver.load_names(names, loaded_at=created_at)
+                return
+            if now - _LAST_ATTEMPT >= _RETRY_INTERVAL:
+                NameResolver.reload(full=True)
+            return
+        if now - _LAST_FULL >= _FULL_INTERVAL or now - _LAST_DELTA >= _DELTA_INTERVAL:
+            if not _RELOAD_LOCK.locked():
+                full = now - _LAST_FULL >= _FULL_INTERVAL
+                threading.Thread(target=NameResolver.reload, kwargs={"full": full}, daemon=True).start()
+
+    @staticmethod
+    def reload(full=False):
+        global _INDEX, _LOADED, _LAST_DELTA, _LAST_FULL, _LAST_ATTEMPT, _MAX_UPDATED
+        if not _RELOAD_LOCK.acquire(blocking=not _LOADED):
+            return
+        try:
+            _LAST_ATTEMPT = time.time()
+            conn = get_db_connection()
+            if not conn:
+                return
+            try:
+                cur = conn.cursor()
+                if full or _MAX_UPDATED is None:
+                    cur.execute("SELECT symbol, name, updated_at FROM stock_names")
+                    names = {}
+                else:
+                    cur.execute(
+                        "SELECT symbol, name, updated_at FROM stock_names WHERE updated_at > %s",
+                        (_MAX_UPDATED,)
+                    )
+                    names = dict(_INDEX.names)
+                rows = cur.fetchall()
+                cur.close()
+            except Exception as e:
+                print(f"[NameResolver] Reload error: {e}")
+                return
+            finally:
+                return_db_connection(conn)
+
+            for symbol, name, updated_at in rows:
+                if symbol and name:
+                    names[symbol] = name
+                if updated_at and (_MAX_UPDATED is None or updated_at > _MAX_UPDATED):
+                    _MAX_UPDATED = updated_at
+            if rows or full:
+                _INDEX = _NameIndex(names)
+            now = time.time()
+            _LAST_DELTA = now
+            if full:
+                _LAST_FULL = now
+            _LOADED = True
+            print(f"[NameResolver] {'Full' if full else 'Delta'} reload: {len(rows)} rows, {len(_INDEX.names)} names")
+        finally:
+            _RELOAD_LOCK.release()
+
+    @staticmethod
+    def load_names(names: dict, loaded_at=None):
+        """
+        直接以 dict 建立索引（例如由 warm-start snapshot 載入）。
+        loaded_at 為資料產生時間，重載排程由此起算，過舊的快照會很快在背景更新。
+        """
+        global _INDEX, _LOADED, _LAST_DELTA, _LAST_FULL
+        _INDEX = _NameIndex(dict(names))
+        _LOADED = True
+        _LAST_DELTA = _LAST_FULL = loaded_at or time.time()
+
+    @staticmethod
+    def is_loaded() -> bool:
+        return _LOADED
+
+    @staticmethod
+    def snapshot() -> dict:
+        return dict(_INDEX.names)
+
+    @staticmethod
+    def get_name(symbol, default=None):
+        NameResolver.ensure_loaded()
+        return _INDEX.names.get(symbol, default)
+
+    @staticmethod
+    def get_names(symbols) -> dict:
+        """批次查詢，只回傳有對應名稱的 symbol"""
+        NameResolver.ensure_loaded()
+        names = _INDEX.names
+        return {s: names[s] for s in symbols if s in names}
+
+    @staticmethod
+    def resolve(query):
+        """代號或完整名稱 -> 標準代號；找不到回傳 None"""
+        if not query:
+            return None
+        NameResolver.ensure_loaded()
+        q = query.strip()
+        if q in _INDEX.names:
+            return q
+        if q.upper() in _INDEX.names:
+            return q.upper()
+        return _INDEX.by_name.get(q)
+
+    @staticmethod
+    def search(query, limit=10):
+        """自動完成：精確 > 代號前綴 > 名稱前綴 > 中文子字串"""
+        q = (query or "").strip()
+        if not q:
+            return []
+        NameResolver.ensure_loaded()
+        index = _INDEX
+        seen, out = set(), []
+
+        def add(symbols):
+            for s in symbols:
+                if s not in seen and len(out) < limit:
+                    seen.add(s)
+                    out.append({"symbol": s, "name": index.names.get(s, s)})
+
+        exact = NameResolver.resolve(q)
+        if exact:
+            add([exact])
+        add(index.symbol_prefix(q.upper(), limit))
+        add(index.name_prefix(q.lower(), limit))
+        if len(out) < limit:
+            add(index.substring(q, limit))
+        return out
@@ -3,21 +3,20 @@ PerformanceTracker — AI 自我進化閉環的「觀察層」
 
 職責：
 1. 記錄策略預測快照（預測時的評分）
-2. N 天後記錄實際報酬率
+2. 以 daily_prices 的收盤價結算 1 / 5 / 14 個交易日的實際報酬率
 3. 計算策略準確率，供 ReflectionEngine 使用
 4. 達到觸發條件時自動呼叫 ReflectionEngine
 
 設計原則：
-- 使用 DB 持久化（stock_cache 表的 metadata 欄位），不依賴記憶體
+- 使用 DB 持久化（prediction_records 表），所有 worker 與排程共用同一份記錄
 - 無外部依賴，可在 Vercel serverless 環境運行
 """
 
 import json
 import time
 import threading
-from datetime import datetime, timedelta
-from pathlib import Path
-from api.db import get_db_connection, return_db_connection
+from datetime import date, datetime, timedelta
+from api.db import get_db_connection, return_db_connection, has_schema
 
 # 進化觸發條件
 EVOLUTION_TRIGGERS = {
@@ -26,74 +25,178 @@ EVOLUTION_TRIGGERS = {
     "lookback_days": 14,               # 回顧 14 天的預測記錄
 }
 
-# 持久化路徑（Serverless 友好：使用 /tmp）
-_TRACKER_FILE = Path("/tmp/performance_tracker.json")
-
-# [Optimization] In-memory buffer to reduce disk I/O
+# 記憶體中的預測清單（prediction_records 的副本）；超過 _RELOAD_INTERVAL 後重讀 DB，納入其他 worker 的寫入
 _MEMORY_BUFFER = None
-_BUFFER_DIRTY = False
+_LOADED_AT = 0
+# (symbol, strategy_id, 日期) -> DB 中該筆記錄的 canonical JSON；flush 只寫入與此不同的記錄
+_WRITTEN = {}
 _BUFFER_LOCK = threading.Lock()
-_LAST_FLUSH_TIME = 0
-_FLUSH_INTERVAL = 60  # flush to disk at most every 60 seconds
+_RELOAD_INTERVAL = 60
+_RETENTION_DAYS = 30     # 預測記錄保留天數
+_COMPACT_INTERVAL = 3600  # 保留期清理最多每小時一次（隨寫入執行）
+_LAST_COMPACT_TIME = 0
+
+# 結算週期（交易日）；PRIMARY_HORIZON 的結果作為 actual_return_pct 與預設準確率
+HORIZONS = (1, 5, 14)
+PRIMARY_HORIZON = 5
+_SETTLE_INTERVAL = 600   # 請求驅動的背景結算最多每 10 分鐘一次（個股詳情為每個 symbol 各自計算）
+_LAST_SETTLE_TIME = 0
+_SYMBOL_SETTLE_TIME = {}  # symbol -> 上次由個股詳情觸發結算的時間
+_SETTLE_GRACE_DAYS = 10   # 週期到期後超過此日曆天仍無收盤價，標記為無法結算
+_SETTLE_FETCH_LIMIT = 100  # 每次批次結算最多向 yfinance 補抓的個股數
+_SETTLE_FETCH_CHUNK = 5    # 有時間預算時，每批補抓的個股數（每批之間檢查預算）
+
+
+def _key(pred):
+    return (pred["symbol"], pred.get("strategy_id") or "", pred["timestamp"][:10])
+
+
+def _canonical(pred):
+    return json.dumps(pred, sort_keys=True, ensure_ascii=False)
+
+
+def _due_horizons(pred, today):
+    """
+    已過足夠日曆天、但尚未有結果的週期（實際可否結算取決於是否已有該日收盤價）。
+    標記為 unsettleable 的預測，以及舊版只有 actual_return_pct、沒有 horizons 的已結算預測不再結算。
+    """
+    done = pred.get("horizons")
+    if pred.get("unsettleable") or (pred.get("resolved") and not done):
+        return []
+    done = done or {}
+    days = (today - date.fromisoformat(pred["timestamp"][:10])).days
+    return [h for h in HORIZONS if str(h) not in done and days >= h]
+
+
+def _past_deadline(pred, today, horizons):
+    """週期 h 個交易日約 h * 7 / 5 個日曆天，再加上寬限期後仍未結算即視為取不到資料"""
+    days = (today - date.fromisoformat(pred["timestamp"][:10])).days
+    return any(days > h * 7 // 5 + _SETTLE_GRACE_DAYS for h in horizons)
 
 
 class PerformanceTracker:
     """
     AI 進化閉環的觀察層。
     追蹤預測 → 實際表現，提供準確率數據給 ReflectionEngine。
-    [Optimized] Uses in-memory buffer; flushes to disk periodically.
+    記錄存於 prediction_records（migration 9），記憶體副本定期重讀；
+    DB 無法連線或 migration 尚未套用時只保留在記憶體中。
     """
 
     @staticmethod
     def _load() -> dict:
-        """從記憶體暫存載入；僅在首次或暫存為空時讀磁碟"""
-        global _MEMORY_BUFFER
-        if _MEMORY_BUFFER is not None:
+        """回傳記憶體副本；首次或超過 _RELOAD_INTERVAL 時重讀保留期內的記錄（尚未寫入的本地變更保留）"""
+        global _MEMORY_BUFFER, _LOADED_AT, _WRITTEN
+        if _MEMORY_BUFFER is not None and time.time() - _LOADED_AT < _RELOAD_INTERVAL:
             return _MEMORY_BUFFER
         with _BUFFER_LOCK:
-            if _MEMORY_BUFFER is not None:
+            if _MEMORY_BUFFER is not None and time.time() - _LOADED_AT < _RELOAD_INTERVAL:
                 return _MEMORY_BUFFER
-            try:
-                if _TRACKER_FILE.exists():
-                    _MEMORY_BUFFER = json.loads(_TRACKER_FILE.read_text(encoding='utf-8'))
-                else:
-                    _MEMORY_BUFFER = {"predictions": [], "actuals": []}
-            except Exception as e:
-                print(f"[PerformanceTracker] Load error: {e}")
-                _MEMORY_BUFFER = {"predictions": [], "actuals": []}
+            records = PerformanceTracker._read_records()
+            local = _MEMORY_BUFFER["predictions"] if _MEMORY_BUFFER else []
+            if records is not None:
+                written = {_key(p): _canonical(p) for p in records}
+                merged = {_key(p): p for p in records}
+                for pred in local:
+                    k = _key(pred)
+                    if _WRITTEN.get(k) != _canonical(pred):
+                        merged[k] = pred
+                local = sorted(merged.values(), key=lambda p: p["timestamp"])
+                _WRITTEN = written
+            _MEMORY_BUFFER = {"predictions": local, "actuals": []}
+            _LOADED_AT = time.time()
         return _MEMORY_BUFFER
 
+    @staticmethod
+    def _read_records():
+        """讀取保留期內的記錄；DB 不可用或表尚未建立時回傳 None"""
+        if not has_schema(9):
+            return None
+        conn = get_db_connection()
+        if not conn:
+            return None
+        try:
+            cur = conn.cursor()
+            cur.execute(
+                "SELECT record FROM prediction_records WHERE predicted_on >= %s",
+                (date.today() - timedelta(days=_RETENTION_DAYS),)
+            )
+            records = [r[0] if isinstance(r[0], dict) else json.loads(r[0]) for r in cur.fetchall()]
+            cur.close()
+            return records
+        except Exception as e:
+            print(f"[PerformanceTracker] Load error: {e}")
+            return None
+        finally:
+            return_db_connection(conn)
+
     @staticmethod
     def _save(data: dict):
-        """標記為 dirty；僅在超過 flush interval 時才寫磁碟"""
-        global _MEMORY_BUFFER, _BUFFER_DIRTY, _LAST_FLUSH_TIME
-        _MEMORY_BUFFER = data
-        _BUFFER_DIRTY = True
-        now = time.time()
-        if now - _LAST_FLUSH_TIME >= _FLUSH_INTERVAL:
-            PerformanceTracker._flush()
+        """寫入變動的記錄（寫入前視需要定期壓縮）"""
+        if time.time() - _LAST_COMPACT_TIME >= _COMPACT_INTERVAL:
+            PerformanceTracker.compact(data)
+        PerformanceTracker.flush(data)
 
     @staticmethod
-    def _flush():
-        """Force flush to disk."""
-        global _BUFFER_DIRTY, _LAST_FLUSH_TIME
+    def flush(data: dict = None) -> bool:
+        """
+        將與 DB 內容不同的記錄 upsert 至 prediction_records，並刪除超過保留期的列。
+        寫入失敗的記錄保留在記憶體，下次 flush 重試；回傳是否已全部寫入。
+        """
+        data = data if data is not None else _MEMORY_BUFFER
+        if data is None:
+            return True
         with _BUFFER_LOCK:
-            if _MEMORY_BUFFER is not None and _BUFFER_DIRTY:
-                try:
-                    _TRACKER_FILE.write_text(
-                        json.dumps(_MEMORY_BUFFER, ensure_ascii=False, indent=2),
-                        encoding='utf-8'
-                    )
-                    _BUFFER_DIRTY = False
-                    _LAST_FLUSH_TIME = time.time()
-                except Exception as e:
-                    print(f"[PerformanceTracker] Flush error: {e}")
+            changed = {}
+            for pred in data["predictions"]:
+                k, doc = _key(pred), _canonical(pred)
+                if _WRITTEN.get(k) != doc:
+                    changed[k] = doc
+        if not changed:
+            return True
+        if not has_schema(9):
+            return False
+        conn = get_db_connection()
+        if not conn:
+            return False
+        try:
+            from psycopg2.extras import execute_values
+            cur = conn.cursor()
+            execute_values(
+                cur,
+                """
+                INSERT INTO prediction_records (symbol, strategy_id, predicted_on, record) VALUES %s
+                ON CONFLICT (symbol, strategy_id, predicted_on)
+                DO UPDATE SET record = EXCLUDED.record, updated_at = CURRENT_TIMESTAMP
+                """,
+                [(*k, doc) for k, doc in changed.items()],
+                template="(%s, %s, %s, %s::jsonb)"
+            )
+            cur.execute(
+                "DELETE FROM prediction_records WHERE predicted_on < %s",
+                (date.today() - timedelta(days=_RETENTION_DAYS),)
+            )
+            conn.commit()
+            cur.close()
+            with _BUFFER_LOCK:
+                _WRITTEN.update(changed)
+            return True
+        except Exception as e:
+            conn.rollback()
+            print(f"[PerformanceTracker] Flush error: {e}")
+            return False
+        finally:
+            return_db_connection(conn)
+
+    @staticmethod
+    def pending_symbols() -> list:
+        """有到期、尚未結算預測的 symbol（排序）"""
+        today = date.today()
+        return sorted({p["symbol"] for p in PerformanceTracker._load()["predictions"] if _due_horizons(p, today)})
 
     @staticmethod
     def record_prediction(symbol: str, strategy_id: str, predicted_score: float, initial_price: float, details: dict = None):
         """
-        記錄預測快照。
-        在 get_market_trending 推薦股票時呼叫。
+        記錄單筆預測快照（同一 symbol / 策略每日只記一筆）。
 
         Args:
             symbol: 股票代號（如 "2330"）
@@ -102,120 +205,183 @@ class PerformanceTracker:
             initial_price: 預測時的股價（用於計算報酬率）
             details: 額外資訊（如 market regime, RSI 等）
         """
-        data = PerformanceTracker._load()
-        data["predictions"].append({
+        return PerformanceTracker.record_predictions([{
             "symbol": symbol,
             "strategy_id": strategy_id,
             "predicted_score": predicted_score,
             "initial_price": initial_price,
-            "details": details or {},
-            "timestamp": datetime.now().isoformat(),
-            "resolved": False,
-        })
-        # 只保留最近 30 天的記錄
-        cutoff = (datetime.now() - timedelta(days=30)).isoformat()
-        data["predictions"] = [p for p in data["predictions"] if p["timestamp"] > cutoff]
-        PerformanceTracker._save(data)
+            "details": details,
+        }])
 
     @staticmethod
-    def check_and_resolve_pending(symbol: str, current_price: float):
+    def record_predictions(predictions: list) -> int:
         """
-        檢查是否有待解決的預測，若持有時間足夠則自動結算。
-        由 stock_service 在取得新報價時呼叫。
+        批次記錄預測快照，於 get_market_trending 更新推薦清單時呼叫。
+        以 (symbol, strategy_id, 日期) 去重：同一天重複推薦只保留第一筆。
+        舊記錄由 compact() 定期清理，不在每次寫入時重建清單。
+        回傳實際新增筆數。
         """
         data = PerformanceTracker._load()
-        updated = False
-        min_hold_hours = 24  # 至少持有 24 小時才結算 (測試時可縮短)
-
-        for pred in data["predictions"]:
-            if pred["symbol"] == symbol and not pred.get("resolved"):
-                pred_time = datetime.fromisoformat(pred["timestamp"])
-                hours_passed = (datetime.now() - pred_time).total_seconds() / 3600
-
-                if hours_passed >= min_hold_hours:
-                    initial = pred.get("initial_price")
-                    if initial and initial > 0:
-                        reward_pct = ((current_price - initial) / initial) * 100
-                        pred["resolved"] = True
-                        pred["actual_return_pct"] = round(reward_pct, 2)
-                        pred["resolved_at"] = datetime.now().isoformat()
-                        pred["final_price"] = current_price
-                        updated = True
-        
-        if updated:
+        now = datetime.now()
+        today = now.date().isoformat()
+        added = 0
+        with _BUFFER_LOCK:
+            seen = {
+                (p["symbol"], p.get("strategy_id"), p["timestamp"][:10])
+                for p in data["predictions"] if p["timestamp"][:10] == today
+            }
+            for pred in predictions:
+                key = (pred["symbol"], pred.get("strategy_id"), today)
+                if key in seen or not pred.get("initial_price"):
+                    continue
+                seen.add(key)
+                data["predictions"].append({
+                    "symbol": pred["symbol"],
+                    "strategy_id": pred.get("strategy_id"),
+                    "predicted_score": pred.get("predicted_score"),
+                    "initial_price": pred["initial_price"],
+                    "details": pred.get("details") or {},
+                    "timestamp": now.isoformat(),
+                    "resolved": False,
+                })
+                added += 1
+        if added:
             PerformanceTracker._save(data)
-            PerformanceTracker._check_and_trigger_evolution(data)
+        return added
 
     @staticmethod
-    def resolve_all_pending():
+    def compact(data: dict = None, retention_days: int = _RETENTION_DAYS) -> int:
+        """刪除超過保留天數的預測記錄；回傳刪除筆數"""
+        global _LAST_COMPACT_TIME
+        data = data if data is not None else PerformanceTracker._load()
+        cutoff = (datetime.now() - timedelta(days=retention_days)).isoformat()
+        with _BUFFER_LOCK:
+            before = len(data["predictions"])
+            data["predictions"] = [p for p in data["predictions"] if p["timestamp"] > cutoff]
+            removed = before - len(data["predictions"])
+            _LAST_COMPACT_TIME = time.time()
+        # DB 端的舊列由 flush 一併刪除
+        if removed:
+            print(f"[PerformanceTracker] Compacted {removed} records older than {retention_days} days")
+        return removed
+
+    @staticmethod
+    def check_and_resolve_pending(symbol: str, current_price: float = None):
         """
-        批次結算所有到期的待解決預測。
-        從 DB cache 取得當前價格，不依賴使用者查詢。
-        由 get_market_trending 在每次 API 遞送結果後呼叫。
+        個股詳情更新時，結算該 symbol 已到期的預測。
+        結算一律使用 daily_prices 的收盤價（current_price 僅為相容保留，不再使用），
+        記憶體中沒有到期預測時不查詢 DB；同一 symbol 每 _SETTLE_INTERVAL 秒最多查詢一次
+        （到期但當日收盤價尚未寫入時，避免每次詳情請求都查 DB）。
         """
         data = PerformanceTracker._load()
-        min_hold_hours = 24
-        now = datetime.now()
-
-        # 1. 找出所有到期且未結算的預測
-        pending_symbols = set()
-        for pred in data["predictions"]:
-            if not pred.get("resolved"):
-                pred_time = datetime.fromisoformat(pred["timestamp"])
-                hours_passed = (now - pred_time).total_seconds() / 3600
-                if hours_passed >= min_hold_hours:
-                    pending_symbols.add(pred["symbol"])
+        today = date.today()
+        if not any(p["symbol"] == symbol and _due_horizons(p, today) for p in data["predictions"]):
+            return
+        now = time.time()
+        if now - _SYMBOL_SETTLE_TIME.get(symbol, 0) < _SETTLE_INTERVAL:
+            return
+        _SYMBOL_SETTLE_TIME[symbol] = now
+        PerformanceTracker.settle_from_history([symbol])
 
-        if not pending_symbols:
+    @staticmethod
+    def resolve_all_pending():
+        """
+        批次結算所有到期的待解決預測（節流：每 _SETTLE_INTERVAL 秒最多一次）。
+        由 get_market_trending 在每次 API 遞送結果後於背景呼叫，只使用 DB 既有日線；
+        補抓日線由排程（/api/cron/settle 或 scripts/settle_predictions.py）以 fetch=True 執行。
+        """
+        global _LAST_SETTLE_TIME
+        now = time.time()
+        if now - _LAST_SETTLE_TIME < _SETTLE_INTERVAL:
             return 0
+        _LAST_SETTLE_TIME = now
+        return PerformanceTracker.settle_from_history()
 
-        # 2. 批次從 DB cache 取得當前價格
-        from api.db import get_db_connection, return_db_connection
-        prices = {}
-        conn = get_db_connection()
-        if conn:
-            try:
-                cur = conn.cursor()
-                placeholders = ','.join(['%s'] * len(pending_symbols))
-                cur.execute(
-                    f"SELECT symbol, data->>'price' FROM stock_cache WHERE symbol IN ({placeholders})",
-                    tuple(pending_symbols)
-                )
-                for row in cur.fetchall():
-                    try:
-                        prices[row[0]] = float(row[1])
-                    except (TypeError, ValueError):
-                        pass
-                cur.close()
-            finally:
-                return_db_connection(conn)
-
-        if not prices:
+    @staticmethod
+    def settle_from_history(symbols=None, fetch=False, fetch_budget=None) -> int:
+        """
+        以 daily_prices 的收盤價結算預測的 1 / 5 / 14 個交易日報酬（HORIZONS）。
+        基準為預測當日（含）最近一筆收盤價，第 h 期為其後第 h 個交易日的收盤價；
+        同一 symbol 的所有預測以 np.searchsorted 一次對齊日期，結果與執行時間無關。
+        主要週期（PRIMARY_HORIZON）取得結果時標記 resolved，並寫入 actual_return_pct。
+        fetch=True 時先以 HistoryStore.refresh 補抓待結算個股的日線（最多 _SETTLE_FETCH_LIMIT 檔）；
+        fetch_budget（秒）限制補抓時間，每 _SETTLE_FETCH_CHUNK 檔檢查一次，未補抓的留待下次執行。
+        到期超過寬限期仍無收盤價的預測標記 unsettleable，之後不再查詢。
+        回傳本次新結算（resolved）的筆數。
+        """
+        data = PerformanceTracker._load()
+        today = date.today()
+        due = {}
+        for pred in data["predictions"]:
+            if symbols is not None and pred["symbol"] not in symbols:
+                continue
+            if _due_horizons(pred, today):
+                due.setdefault(pred["symbol"], []).append(pred)
+        if not due:
             return 0
 
-        # 3. 結算
-        resolved_count = 0
-        for pred in data["predictions"]:
-            if not pred.get("resolved") and pred["symbol"] in prices:
-                pred_time = datetime.fromisoformat(pred["timestamp"])
-                hours_passed = (now - pred_time).total_seconds() / 3600
-                if hours_passed >= min_hold_hours:
-                    initial = pred.get("initial_price")
-                    current = prices[pred["symbol"]]
-                    if initial and initial > 0 and current > 0:
-                        reward_pct = ((current - initial) / initial) * 100
+        import numpy as np
+        from api.services.history_store import HistoryStore
+        if fetch:
+            # 最早的預測優先補抓（最接近寬限期）
+            oldest = sorted(due, key=lambda sym: min(p["timestamp"] for p in due[sym]))[:_SETTLE_FETCH_LIMIT]
+            deadline = time.time() + fetch_budget if fetch_budget else None
+            chunk = _SETTLE_FETCH_CHUNK if deadline else len(oldest)
+            ingested = fetched = 0
+            for i in range(0, len(oldest), chunk):
+                if deadline and time.time() >= deadline:
+                    break
+                ingested += HistoryStore.refresh(oldest[i:i + chunk], period="3mo", max_age_days=1)
+                fetched = min(i + chunk, len(oldest))
+            print(f"[PerformanceTracker] Ingested {ingested} daily rows for {fetched}/{len(oldest)} symbols")
+        first = min(p["timestamp"][:10] for preds in due.values() for p in preds)
+        since = date.fromisoformat(first) - timedelta(days=10)
+        series = HistoryStore.load_series(list(due), since=since)
+
+        now_iso = datetime.now().isoformat()
+        settled = filled = expired = 0
+        for symbol, preds in due.items():
+            s = series.get(symbol)
+            if not s or not len(s["dates"]):
+                continue
+            dates, close = s["dates"], s["close"]
+            pred_dates = np.array([p["timestamp"][:10] for p in preds], dtype="datetime64[D]")
+            base = np.searchsorted(dates, pred_dates, side="right") - 1
+            for h in HORIZONS:
+                target = base + h
+                ok = (base >= 0) & (target < len(dates))
+                b, t = np.where(ok, base, 0), np.where(ok, target, 0)
+                returns = ((close[t] - close[b]) / close[b] * 100).tolist()
+                for pred, valid, ret, bi, ti in zip(preds, ok.tolist(), returns, b.tolist(), t.tolist()):
+                    horizons = pred.setdefault("horizons", {})
+                    if not valid or str(h) in horizons:
+                        continue
+                    horizons[str(h)] = round(ret, 2)
+                    filled += 1
+                    if h == PRIMARY_HORIZON and not pred.get("resolved"):
                         pred["resolved"] = True
-                        pred["actual_return_pct"] = round(reward_pct, 2)
-                        pred["resolved_at"] = now.isoformat()
-                        pred["final_price"] = current
-                        resolved_count += 1
-
-        if resolved_count > 0:
+                        pred["actual_return_pct"] = round(ret, 2)
+                        pred["base_price"] = float(close[bi])
+                        pred["final_price"] = float(close[ti])
+                        pred["days_held"] = h
+                        pred["resolved_at"] = now_iso
+                        settled += 1
+
+        for preds in due.values():
+            for pred in preds:
+                remaining = _due_horizons(pred, today)
+                if remaining and _past_deadline(pred, today, remaining):
+                    pred["unsettleable"] = True
+                    expired += 1
+        if expired:
+            print(f"[PerformanceTracker] {expired} predictions marked unsettleable (no closes after the grace period)")
+
+        if filled or expired:
             PerformanceTracker._save(data)
-            print(f"[PerformanceTracker] 批次結算完成：{resolved_count} 筆")
+        if settled:
+            print(f"[PerformanceTracker] 批次結算完成：{settled} 筆（{filled} 個週期結果）")
             PerformanceTracker._check_and_trigger_evolution(data)
-
-        return resolved_count
+        return settled
 
     @staticmethod
     def record_actual(symbol: str, actual_return_pct: float, days_held: int = 5):
@@ -245,10 +411,12 @@ class PerformanceTracker:
         PerformanceTracker._check_and_trigger_evolution(data)
 
     @staticmethod
-    def calculate_accuracy(strategy_id: str = None, lookback_days: int = None) -> dict:
+    def calculate_accuracy(strategy_id: str = None, lookback_days: int = None, horizon: int = None) -> dict:
         """
         計算策略準確率。
         「準確」定義：預測評分 > 5 且實際報酬率 > 0（或反之）。
+        horizon：指定 1 / 5 / 14 時使用該週期的報酬（回看天數自動加長以涵蓋持有期），
+        未指定時使用主要週期的 actual_return_pct。
 
         Returns:
             {
@@ -258,16 +426,24 @@ class PerformanceTracker:
                 "strategy_id": "..."
             }
         """
-        lookback_days = lookback_days or EVOLUTION_TRIGGERS["lookback_days"]
+        lookback_days = lookback_days or EVOLUTION_TRIGGERS["lookback_days"] + (2 * horizon if horizon else 0)
         data = PerformanceTracker._load()
         cutoff = (datetime.now() - timedelta(days=lookback_days)).isoformat()
 
-        resolved = [
-            p for p in data["predictions"]
-            if p.get("resolved")
-            and p["timestamp"] > cutoff
-            and (strategy_id is None or p.get("strategy_id") == strategy_id)
-        ]
+        if horizon:
+            resolved = [
+                dict(p, actual_return_pct=p["horizons"][str(horizon)]) for p in data["predictions"]
+                if str(horizon) in (p.get("horizons") or {})
+                and p["timestamp"] > cutoff
+                and (strategy_id is None or p.get("strategy_id") == strategy_id)
+            ]
+        else:
+            resolved = [
+                p for p in data["predictions"]
+                if p.get("resolved")
+                and p["timestamp"] > cutoff
+                and (strategy_id is None or p.get("strategy_id") == strategy_id)
+            ]
 
         if len(resolved) < EVOLUTION_TRIGGERS["min_sample_size"]:
             return {
@@ -345,11 +521,14 @@ class PerformanceTracker:
         data = PerformanceTracker._load()
         total = len(data["predictions"])
         resolved = [p for p in data["predictions"] if p.get("resolved")]
-        pending = total - len(resolved)
+        unsettleable = sum(1 for p in data["predictions"] if p.get("unsettleable") and not p.get("resolved"))
+        pending = total - len(resolved) - unsettleable
 
         return {
             "total_predictions": total,
             "resolved": len(resolved),
             "pending": pending,
+            "unsettleable": unsettleable,
             "accuracy_stats": PerformanceTracker.calculate_accuracy(),
+            "horizon_stats": {str(h): PerformanceTracker.calculate_accuracy(horizon=h) for h in HORIZONS},
         }
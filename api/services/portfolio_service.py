@@ -0,0 +1,184 @@
+"""
+PortfolioService — 投資組合估值引擎
+
+職責：
+1. 單次查詢載入使用者持倉與最新價格
+2. 以 NumPy 向量化計算每筆與整體損益、權重、回撤
+3. 在底層價格/持倉未變動前重用上次的估值結果（LRU，最多 _VALUATION_MAX 位使用者）
+
+快取在 _VALUATION_TTL 內直接回傳、不查 DB（報價本身由 stock_cache 定期刷新，容許同等程度的延遲）；
+持倉異動（add/delete/update_portfolio_all）會呼叫 invalidate() 立即失效。
+超過 TTL 後重查持倉與價格，signature 相同則沿用原結果，省下歷史查詢與向量化計算。
+
+回撤計算使用 stock_cache 內的日線歷史（history_1y_1d）：
+進場前的持倉以成本計價，進場後以收盤價計價，組成整體淨值曲線。
+"""
+
+import time
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from api.db import get_db_connection, return_db_connection
+from api.scrapers import sanitize_json
+
+_HISTORY_KEY = "history_1y_1d"
+
+_VALUATION_TTL = 60      # 秒；期間內直接回傳快取，不查 DB
+_VALUATION_MAX = 256     # LRU 上限（使用者數）
+
+# user_id -> (signature, valuation, checked_at)；signature 涵蓋持倉與最新價格，任一變動即重算
+_VALUATION_CACHE: OrderedDict = OrderedDict()
+_VALUATION_LOCK = threading.Lock()
+
+
+def _date_str(value):
+    if hasattr(value, "strftime"):
+        return value.strftime("%Y-%m-%d")
+    return str(value or "")[:10]
+
+
+class PortfolioService:
+    """使用者投資組合的估值計算與快取"""
+
+    @staticmethod
+    def invalidate(user_id):
+        """持倉異動後清除該使用者的估值快取"""
+        with _VALUATION_LOCK:
+            _VALUATION_CACHE.pop(str(user_id), None)
+
+    @staticmethod
+    def _remember(key, signature, valuation):
+        with _VALUATION_LOCK:
+            _VALUATION_CACHE[key] = (signature, valuation, time.time())
+            _VALUATION_CACHE.move_to_end(key)
+            while len(_VALUATION_CACHE) > _VALUATION_MAX:
+                _VALUATION_CACHE.popitem(last=False)
+
+    @staticmethod
+    def get_valuation(user_id):
+        key = str(user_id)
+        with _VALUATION_LOCK:
+            cached = _VALUATION_CACHE.get(key)
+            if cached:
+                _VALUATION_CACHE.move_to_end(key)
+        if cached and time.time() - cached[2] < _VALUATION_TTL:
+            return cached[1]
+
+        conn = get_db_connection()
+        if not conn: return None
+        try:
+            from psycopg2.extras import RealDictCursor
+            cur = conn.cursor(cursor_factory=RealDictCursor)
+            cur.execute("""
+                SELECT p.id, p.symbol, p.entry_price, p.entry_date, s.price AS current_price
+                FROM portfolio_items p
+                LEFT JOIN stock_cache s ON p.symbol = s.symbol
+                WHERE p.user_id = %s
+                ORDER BY p.entry_date DESC
+            """, (user_id,))
+            rows = cur.fetchall()
+
+            signature = tuple(
+                (str(r['id']), r['symbol'], str(r['entry_price']), _date_str(r['entry_date']), str(r['current_price']))
+                for r in rows
+            )
+            if cached and cached[0] == signature:
+                cur.close()
+                PortfolioService._remember(key, signature, cached[1])
+                return cached[1]
+
+            histories = {}
+            symbols = sorted({r['symbol'] for r in rows})
+            if symbols:
+                cur.execute(
+                    "SELECT symbol, data->%s AS history FROM stock_cache WHERE symbol = ANY(%s)",
+                    (_HISTORY_KEY, symbols)
+                )
+                histories = {r['symbol']: r['history'] or [] for r in cur.fetchall()}
+            cur.close()
+
+            valuation = PortfolioService.valuate(rows, histories)
+            valuation["user_id"] = key
+            PortfolioService._remember(key, signature, valuation)
+            return valuation
+        finally:
+            return_db_connection(conn)
+
+    @staticmethod
+    def valuate(rows, histories):
+        """
+        純計算：rows 為持倉（id, symbol, entry_price, entry_date, current_price），
+        histories 為 symbol -> [{"Date", "Close", ...}]。
+        """
+        import numpy as np
+
+        n = len(rows)
+        entry = np.array([float(r['entry_price'] or 0) for r in rows], dtype=float)
+        price = np.array([float(r['current_price'] or 0) for r in rows], dtype=float)
+        entry_dates = np.array([_date_str(r['entry_date']) for r in rows], dtype=str)
+
+        priced = price > 0
+        valid = priced & (entry > 0)
+        pnl = np.where(valid, price - entry, 0.0)
+        ret_pct = np.where(valid, pnl / np.where(entry > 0, entry, 1.0) * 100, 0.0)
+        # 尚無報價的持倉以成本計價，避免權重與淨值失真
+        value = np.where(priced, price, entry)
+        total_value, total_cost = float(value.sum()), float(entry.sum())
+        weights = value / total_value if total_value > 0 else np.zeros(n)
+
+        pos_dd = np.zeros(n)
+        max_dd = cur_dd = 0.0
+        dates = sorted({h['Date'] for r in rows for h in histories.get(r['symbol']) or [] if h.get('Date')})
+        if n and dates:
+            date_idx = {d: i for i, d in enumerate(dates)}
+            closes = np.full((len(dates), n), np.nan)
+            for j, r in enumerate(rows):
+                for h in histories.get(r['symbol']) or []:
+                    i = date_idx.get(h.get('Date'))
+                    if i is not None and h.get('Close'):
+                        closes[i, j] = float(h['Close'])
+
+            # Forward-fill：沿時間軸以最後一個有效收盤價補值
+            has = ~np.isnan(closes)
+            last = np.where(has, np.arange(len(dates))[:, None], 0)
+            np.maximum.accumulate(last, axis=0, out=last)
+            closes = closes[last, np.arange(n)]
+
+            held = (np.array(dates, dtype=str)[:, None] >= entry_dates[None, :]) & ~np.isnan(closes)
+            equity = np.where(held, closes, entry[None, :]).sum(axis=1)
+            peak = np.maximum.accumulate(equity)
+            dd = np.where(peak > 0, equity / np.where(peak > 0, peak, 1.0) - 1, 0.0)
+            max_dd, cur_dd = float(dd.min() * 100), float(dd[-1] * 100)
+
+            # 個別持倉：目前價格相對進場後最高收盤價的回撤
+            peak_since_entry = np.where(held, closes, -np.inf).max(axis=0)
+            peak_since_entry = np.maximum(peak_since_entry, np.where(priced, price, 0.0))
+            ok = priced & np.isfinite(peak_since_entry) & (peak_since_entry > 0)
+            pos_dd = np.where(ok, (price / np.where(ok, peak_since_entry, 1.0) - 1) * 100, 0.0)
+
+        positions = [{
+            "id": str(r['id']),
+            "symbol": r['symbol'],
+            "entry_price": float(entry[j]),
+            "entry_date": entry_dates[j],
+            "current_price": float(price[j]),
+            "pnl": round(float(pnl[j]), 2),
+            "return_pct": round(float(ret_pct[j]), 2),
+            "weight": round(float(weights[j]) * 100, 2),
+            "drawdown_pct": round(float(pos_dd[j]), 2)
+        } for j, r in enumerate(rows)]
+
+        total_pnl = float(pnl.sum())
+        cost_basis = float(entry[valid].sum())
+        return sanitize_json({
+            "positions": positions,
+            "totals": {
+                "cost": round(total_cost, 2),
+                "value": round(total_value, 2),
+                "pnl": round(total_pnl, 2),
+                "return_pct": round(total_pnl / cost_basis * 100, 2) if cost_basis > 0 else 0,
+                "max_drawdown_pct": round(max_dd, 2),
+                "current_drawdown_pct": round(cur_dd, 2)
+            },
+            "valued_at": datetime.now().isoformat()
+        })
@@ -0,0 +1,176 @@
+"""
+RadarPercentiles — radarData 的市場橫斷面百分位
+
+職責：
+1. 以全市場欄式表（Screener）計算每個市場、每個雷達維度的原始分數，排序後保存
+2. 請求時以二分搜尋（bisect）在 O(log n) 內查出個股在所屬市場的百分位，
+   取代固定公式與截斷，讓雷達圖在同市場間可直接比較
+3. 排序後的分數隨 warm-start 快照一起匯出（每次部署建置時產生），第一次查詢時由快照載入
+   （純 list，不需要 NumPy）；只在 Screener 重新載入全市場資料時重建。
+   查詢端（_enrich_data）只讀表，不會在請求路徑上觸發全表載入
+
+百分位（0–100）與固定公式（15–100）尺度不同，不可在同一張雷達圖混用：
+市場任一維度樣本數不足 MIN_SAMPLES 時該市場不建表；個股任一維度無法取得原始值時，
+整張雷達圖沿用 _enrich_data 的固定公式（None、NaN、inf 都視為無法取得）。
+"""
+
+import math
+import threading
+from bisect import bisect_right
+
+# (維度 key, 雷達圖標籤, 說明)，順序與 radarData 相同
+AXES = (
+    ("momentum", "動能", "結合技術強弱與營收成長"),
+    ("trend", "趨勢", "中短期均線排列狀態"),
+    ("size", "規模", "市場規模與資本厚度"),
+    ("safety", "安全", "財務結構與債信評估"),
+    ("value", "價值", "合理價折價與利潤空間"),
+)
+MIN_SAMPLES = 30
+
+_STATE = None        # market -> {axis: 遞增排序的 list}
+_SNAPSHOT_CHECKED = False
+_LOCK = threading.Lock()
+
+
+def market_of(symbol):
+    """與 stock_cache.market 生成欄位相同的判斷：純數字代號為台股"""
+    symbol = str(symbol or "")
+    return "TW" if symbol.isascii() and symbol.isdigit() else "US"
+
+
+def size_metric(data):
+    """規模維度的原始值（市值數值）；無法取得時回傳 None"""
+    value = data.get("marketCapValue")
+    return value if isinstance(value, (int, float)) and value > 0 else None
+
+
+def formula_scores(np, cols):
+    """
+    _enrich_data 固定公式的向量化版本（截斷前的原始分數）。
+    cols：已套用 _enrich_data 預設值的 float 陣列，另含 "has_sma50"（bool）。
+    回傳 momentum / trend / safety / value 陣列；value 在 price <= 0 時為 50。
+    """
+    price, sma50, debt = cols["price"], cols["sma50"], cols["debtToEquity"]
+    relief = 30 - debt / 4
+    positive = price > 0
+    return {
+        "momentum": 50 + (cols["technicalRating"] * 30) + (cols["revGrowth"] * 0.5),
+        "trend": 50 + ((price - np.where(cols["has_sma50"], sma50, price)) / np.where(sma50 > 1, sma50, 1.0) * 150),
+        "safety": (cols["fScore"] * 10) + np.where(relief > 0, relief, 0.0),
+        "value": np.where(positive, (cols["grahamNumber"] / np.where(positive, price, 1.0) * 60) + (cols["grossMargin"] * 0.4), 50.0),
+    }
+
+
+def raw_scores(np, numeric):
+    """
+    欄式表（NaN 為缺值）各維度的原始分數，缺值套用 _enrich_data 的預設值。
+    回傳 (raw, price)：raw 為 axis -> 陣列，size 為 marketCapValue（缺值為 NaN）；price 已套用預設值 1。
+    """
+    def filled(name, default):
+        col = numeric[name]
+        return np.where(np.isnan(col), default, col)
+
+    sma50 = numeric["sma50"]
+    cols = {
+        "price": filled("price", 1), "technicalRating": filled("technicalRating", 0),
+        "revGrowth": filled("revGrowth", 0), "fScore": filled("fScore", 3),
+        "debtToEquity": filled("debtToEquity", 100), "grahamNumber": filled("grahamNumber", 0),
+        "grossMargin": filled("grossMargin", 0), "sma50": np.where(np.isnan(sma50), 1.0, sma50),
+        "has_sma50": ~np.isnan(sma50),
+    }
+    with np.errstate(all="ignore"):
+        raw = formula_scores(np, cols)
+    raw["size"] = numeric["marketCapValue"]
+    return raw, cols["price"]
+
+
+def usable_mask(np, raw, price):
+    """axis -> bool 陣列：可查百分位的原始值（與 values() 的判斷相同；price <= 0 時價值維度為固定值，不納入）"""
+    valid = {axis: np.isfinite(values) for axis, values in raw.items()}
+    valid["value"] &= price > 0
+    with np.errstate(invalid="ignore"):
+        valid["size"] &= raw["size"] > 0
+    return valid
+
+
+def _usable(value):
+    """可查百分位的原始值：有限的數字（None / NaN / inf 在排序表中沒有意義）"""
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value)
+
+
+def percentile(ranks, value):
+    """value 在遞增排序 ranks 中的百分位（<= value 的比例，0–100）"""
+    return round(bisect_right(ranks, value) / len(ranks) * 100, 1)
+
+
+class RadarPercentiles:
+    """各市場雷達維度的排序分數表"""
+
+    @staticmethod
+    def build(table):
+        """由 Screener 欄式表建立 {market: {axis: sorted list}}"""
+        import numpy as np
+        raw, price = raw_scores(np, table.numeric)
+        valid = usable_mask(np, raw, price)
+
+        state = {}
+        markets = table.text["market"]
+        for market in np.unique(markets).tolist():
+            in_market = markets == market
+            ranks = {}
+            for axis, _, _ in AXES:
+                values = np.sort(raw[axis][in_market & valid[axis]])
+                if len(values) < MIN_SAMPLES:
+                    break
+                ranks[axis] = values.tolist()
+            else:
+                state[market] = ranks
+        return state
+
+    @staticmethod
+    def rebuild(table, state=None):
+        """以 table 重建並載入；state 為已由同一份表建立的結果時直接載入"""
+        state = RadarPercentiles.build(table) if state is None else state
+        RadarPercentiles.load(state)
+        print(f"[RadarPercentiles] Built {', '.join(f'{m}={len(r)} axes' for m, r in state.items()) or 'no markets'}")
+        return state
+
+    @staticmethod
+    def load(state):
+        global _STATE
+        with _LOCK:
+            _STATE = state or None
+
+    @staticmethod
+    def export():
+        return RadarPercentiles._state() or {}
+
+    @staticmethod
+    def _state():
+        """目前的排序分數表；尚未建立時先嘗試 warm-start 快照"""
+        global _SNAPSHOT_CHECKED
+        if _STATE is None and not _SNAPSHOT_CHECKED:
+            _SNAPSHOT_CHECKED = True
+            from api.services.warm_start import section
+            state, _ = section("percentiles")
+            if state and _STATE is None:
+                RadarPercentiles.load(state)
+        return _STATE
+
+    @staticmethod
+    def values(market, raw):
+        """
+        raw（axis -> 原始分數或 None）在 market 的各維度百分位；
+        沒有表、或任一維度缺表 / 缺原始值時回傳 None（整張圖沿用固定公式）。
+        """
+        ranks = RadarPercentiles.ranks(market)
+        if not ranks or any(not _usable(raw.get(axis)) or axis not in ranks for axis, _, _ in AXES):
+            return None
+        return [percentile(ranks[axis], raw[axis]) for axis, _, _ in AXES]
+
+    @staticmethod
+    def ranks(market):
+        """market 的 {axis: sorted list}；尚未建立時回傳 None"""
+        state = RadarPercentiles._state()
+        return state.get(market) if state else None
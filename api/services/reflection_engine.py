@@ -1,58 +1,68 @@
 import json
+import math
 import os
 from datetime import datetime
-from pathlib import Path
 from api.services.evolution_manager import EvolutionManager
+from api.services.state_store import STRATEGY_CONFIG, EVOLUTION_STATE
+
+# 參數搜尋預設值（可由 strategy_config.json 的 mutation_config.search 覆寫）
+SEARCH_DEFAULTS = {
+    "population": 96,            # 每次搜尋的候選參數組數（含目前參數）
+    "workers": 0,                # process pool 大小；0 = CPU 核心數，1 = 不使用 process pool
+    "market": "TW",
+    "history_days": 400,
+    "ma_windows": [10, 20, 50, 60],
+    "weight_sigma": 0.1,         # weights 擾動標準差（正規化前）
+    "min_trades": 20,            # 交易筆數不足的候選不列入比較
+    "drawdown_penalty": 0.5,     # fitness = total_return + penalty * max_drawdown（回撤為負值）
+    "min_improvement": 0.01,     # 最佳候選需勝過目前參數的 fitness 差距才會升級
+    "holdout": 0.3,              # 保留最後 30% 的日期做樣本外驗證，不參與選擇
+    "min_coverage": 0.5,         # 回測覆蓋率（見 BacktestData.coverage）低於此值時不升級
+}
+
+# process pool worker 端的回測資料（由 initializer 於每個 worker 載入一次）
+_WORKER_DATA = None
+
+
+def _init_search_worker(data):
+    global _WORKER_DATA
+    _WORKER_DATA = data
+
+
+def _json_fitness(score):
+    # 交易筆數不足的候選 fitness 為 -inf，寫入 JSON 前轉為 null
+    return None if score == float("-inf") else round(score, 6)
+
+
+def _evaluate_candidates(candidates, start=0, stop=None):
+    from api.services.backtester import Backtester
+    return Backtester.evaluate_many(_WORKER_DATA, candidates, start, stop)
 
 class ReflectionEngine:
     """
     Self-Evolving Alpha Lab 核心反射引擎
     負責比對表現並自動進化策略參數。
     """
-    STATE_FILE = Path(__file__).parent.parent / "evolution_state.json"
     MAX_HISTORY = 30  # Rolling window：最多保留 30 筆歷史
 
+    # 讀寫一律經由 StateStore（原子寫入、mtime 快取、版本歷史）
     @staticmethod
     def load_state():
-        if not ReflectionEngine.STATE_FILE.exists():
-            return {}
-        try:
-            with open(ReflectionEngine.STATE_FILE, "r", encoding="utf-8") as f:
-                return json.load(f)
-        except (json.JSONDecodeError, OSError) as e:
-            print(f"[ReflectionEngine] Failed to load state: {e}")
-            return {}
+        return EVOLUTION_STATE.read()
 
     @staticmethod
     def load_config():
         """Load strategy configuration (mutable parameters)."""
-        config_path = Path(__file__).parent.parent / "strategy_config.json"
-        if not config_path.exists():
-            return {}
-        try:
-            with open(config_path, "r", encoding="utf-8") as f:
-                return json.load(f)
-        except Exception as e:
-            print(f"[ReflectionEngine] Failed to load strategy config: {e}")
-            return {}
+        return STRATEGY_CONFIG.read()
 
     @staticmethod
     def save_config(config):
         """Save strategy configuration."""
-        config_path = Path(__file__).parent.parent / "strategy_config.json"
-        try:
-            with open(config_path, "w", encoding="utf-8") as f:
-                json.dump(config, f, indent=4, ensure_ascii=False)
-        except Exception as e:
-            print(f"[ReflectionEngine] Failed to save strategy config: {e}")
+        return STRATEGY_CONFIG.write(config)
 
     @staticmethod
     def save_state(state):
-        try:
-            with open(ReflectionEngine.STATE_FILE, "w", encoding="utf-8") as f:
-                json.dump(state, f, indent=2, ensure_ascii=False)
-        except OSError as e:
-            print(f"[ReflectionEngine] Failed to save state: {e}")
+        return EVOLUTION_STATE.write(state)
 
     @staticmethod
     def mutate_strategy(strategy_id, current_config, mutation_config):
@@ -89,6 +99,178 @@ class ReflectionEngine:
         return current_config
 
 
+    @staticmethod
+    def _fitness(result, search):
+        if result["trades"] < search["min_trades"]:
+            return float("-inf")
+        return result["total_return"] + search["drawdown_penalty"] * result["max_drawdown"]
+
+    @staticmethod
+    def generate_candidates(base, mutation_config, search, rng):
+        """以目前參數為中心產生候選參數組：門檻在 mutation_config 範圍內隨機取值，weights 加入擾動後正規化"""
+        rsi_step = mutation_config.get("rsi_step", 2)
+        rsi_values = list(range(mutation_config.get("min_rsi", 20), mutation_config.get("max_rsi", 80) + 1, rsi_step))
+        weights = base.get("weights") or {}
+        candidates, seen = [], set()
+        for i in range(search["population"] * 3):
+            if len(candidates) >= search["population"]:
+                break
+            if i == 0:
+                params = dict(base)
+            else:
+                new_weights = {
+                    k: max(0.0, w + rng.gauss(0, search["weight_sigma"])) for k, w in weights.items()
+                }
+                total = sum(new_weights.values())
+                params = dict(
+                    base,
+                    rsi_threshold=rng.choice(rsi_values),
+                    f_score_min=rng.randint(0, 9),
+                    min_ma_window=rng.choice(search["ma_windows"]),
+                    weights={k: round(w / total, 3) for k, w in new_weights.items()} if total > 0 else dict(weights),
+                )
+            key = json.dumps(params, sort_keys=True)
+            if key not in seen:
+                seen.add(key)
+                candidates.append(params)
+        return candidates
+
+    @staticmethod
+    def _evaluate_parallel(data, candidates, workers, start=0, stop=None):
+        """以 process pool 評估候選參數；無法建立 process 時改為單一程序。只應由 CLI（scripts/search_strategy.py）呼叫"""
+        from api.services.backtester import Backtester
+        workers = workers or os.cpu_count() or 1
+        if workers <= 1 or len(candidates) < 2 * workers:
+            return Backtester.evaluate_many(data, candidates, start, stop)
+        from concurrent.futures import ProcessPoolExecutor
+        chunk = -(-len(candidates) // workers)
+        chunks = [candidates[i:i + chunk] for i in range(0, len(candidates), chunk)]
+        try:
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_search_worker, initargs=(data,)) as pool:
+                bounds = [start] * len(chunks), [stop] * len(chunks)
+                return [r for results in pool.map(_evaluate_candidates, chunks, *bounds) for r in results]
+        except (OSError, NotImplementedError, RuntimeError) as e:
+            print(f"[ReflectionEngine] Process pool unavailable ({e}), evaluating serially")
+            return Backtester.evaluate_many(data, candidates, start, stop)
+
+    @staticmethod
+    def search_parameters(strategy_id="growth_value", state=None, config=None, save=True, seed=None, data=None):
+        """
+        參數搜尋（walk-forward）：產生一批候選參數，以前段日期（訓練區間）回測選出最佳者，
+        再以保留的後段日期（樣本外）比較最佳者與目前參數；兩段都勝出且覆蓋率足夠時才升級。
+        state / config 由呼叫端傳入時只修改內容、不寫檔（save=False），由呼叫端一併儲存。
+        回傳搜尋紀錄（promoted 表示是否升級）；無回測資料時回傳 None。
+        會 fork process pool，只由 scripts/search_strategy.py 執行，不可從 request handler 呼叫。
+        """
+        import time
+        import random
+        from api.services.backtester import Backtester
+
+        state = ReflectionEngine.load_state() if state is None else state
+        config = ReflectionEngine.load_config() if config is None else config
+        mutation_config = config.get("mutation_config", {})
+        search = dict(SEARCH_DEFAULTS, **mutation_config.get("search", {}))
+        strategy = state.get("strategies", {}).get(strategy_id)
+        if strategy is None or strategy_id not in config.get("strategies", {}):
+            return None
+
+        data = data or Backtester.load_data(search["market"], days=search["history_days"])
+        if data is None:
+            print("[ReflectionEngine] No backtest data, parameter search skipped")
+            return None
+
+        base = Backtester.current_params(strategy_id, config=config, state=state)
+        rng = random.Random(seed)
+        candidates = ReflectionEngine.generate_candidates(base, mutation_config, search, rng)
+
+        split = int(data.shape[0] * (1 - search["holdout"]))
+        t0 = time.perf_counter()
+        results = ReflectionEngine._evaluate_parallel(data, candidates, search["workers"], stop=split)
+        elapsed = time.perf_counter() - t0
+
+        scores = [ReflectionEngine._fitness(r, search) for r in results]
+        best = max(range(len(candidates)), key=lambda i: scores[i])
+        # 樣本外驗證：只評估目前參數與訓練區間最佳者
+        holdout = Backtester.evaluate_many(data, [candidates[0], candidates[best]], start=split)
+        holdout_scores = [ReflectionEngine._fitness(r, search) for r in holdout]
+
+        if best == 0 or scores[best] - scores[0] < search["min_improvement"]:
+            reason = "no in-sample improvement"
+        elif not math.isfinite(holdout_scores[1]) or holdout_scores[1] - holdout_scores[0] < search["min_improvement"]:
+            reason = "failed out-of-sample check"
+        elif data.coverage < search["min_coverage"]:
+            reason = f"coverage {data.coverage:.0%} below {search['min_coverage']:.0%}"
+        else:
+            reason = None
+        promoted = reason is None
+        record = {
+            "date": datetime.now().isoformat(),
+            "candidates": len(candidates),
+            "elapsed_s": round(elapsed, 2),
+            "coverage": round(data.coverage, 4),
+            "split_date": str(data.dates[split]) if split < data.shape[0] else None,
+            "baseline": {"params": candidates[0], "result": results[0], "fitness": _json_fitness(scores[0]),
+                         "holdout": holdout[0], "holdout_fitness": _json_fitness(holdout_scores[0])},
+            "best": {"params": candidates[best], "result": results[best], "fitness": _json_fitness(scores[best]),
+                     "holdout": holdout[1], "holdout_fitness": _json_fitness(holdout_scores[1])},
+            "promoted": promoted,
+            "reason": reason,
+        }
+        print(f"[ReflectionEngine] Searched {len(candidates)} candidates in {elapsed:.2f}s: "
+              f"best fitness {scores[best]:.4f} vs baseline {scores[0]:.4f} "
+              f"(holdout {holdout_scores[1]:.4f} vs {holdout_scores[0]:.4f})"
+              f"{' -> promoted' if promoted else f' -> kept ({reason})'}")
+
+        if promoted:
+            winner = candidates[best]
+            params = config["strategies"][strategy_id]
+            for key in ("rsi_threshold", "f_score_min", "min_ma_window"):
+                params[key] = winner[key]
+            if winner.get("weights"):
+                strategy["weights"] = winner["weights"]
+
+        history = strategy.setdefault("search_history", [])
+        history.append(record)
+        if len(history) > ReflectionEngine.MAX_HISTORY:
+            del history[:-ReflectionEngine.MAX_HISTORY]
+
+        if save:
+            if promoted:
+                ReflectionEngine._bump_version(state, minor=True)
+                record["version"] = state["version"]
+                ReflectionEngine.save_config(config)
+                ReflectionEngine.log_promotion(strategy_id, record)
+            ReflectionEngine.save_state(state)
+        return record
+
+    @staticmethod
+    def log_promotion(strategy_id, record):
+        """升級寫入設定檔後記錄至 evolution.log（只在實際儲存的路徑呼叫）"""
+        EvolutionManager.log_anomaly(
+            "EVOLUTION_PROMOTION",
+            f"策略 {strategy_id} 升級為回測最佳參數 (fitness {record['baseline']['fitness']} → "
+            f"{record['best']['fitness']}, 樣本外 {record['baseline']['holdout_fitness']} → "
+            f"{record['best']['holdout_fitness']})"
+        )
+
+    @staticmethod
+    def _bump_version(state, minor=False):
+        """策略版本遞增：參數升級 / 突變時 minor + 1，否則 patch + 1"""
+        current_version = state.get("version", "1.0.0")
+        parts = current_version.split(".")
+        try:
+            major, minor_v, patch = int(parts[0]), int(parts[1]), int(parts[2])
+        except (ValueError, IndexError):
+            major, minor_v, patch = 1, 0, 0
+        if minor:
+            minor_v += 1
+            patch = 0
+        else:
+            patch += 1
+        state["version"] = f"{major}.{minor_v}.{patch}"
+        print(f"[ReflectionEngine] 版本更新: {current_version} → {state['version']}")
+        return state["version"]
+
     @staticmethod
     def run_daily_reflection(predicted_stocks, actual_performance):
         """
@@ -130,15 +312,17 @@ class ReflectionEngine:
                 new_weights["fScore"] = round(new_weights.get("fScore", 0) - learning_rate, 3)
                 
                 # 2. Mutate Parameters (Level 2 Evolution)
-                # Modify strategy_config.json directly
-                config = ReflectionEngine.mutate_strategy(s_id, config, mutation_config)
-                ReflectionEngine.save_config(config)
-                
+                # search 模式：參數改由離線回測搜尋（scripts/search_strategy.py）調整，這裡不隨機突變
+                searched = mutation_config.get("mode") == "search"
+                if not searched:
+                    config = ReflectionEngine.mutate_strategy(s_id, config, mutation_config)
+                    ReflectionEngine.save_config(config)
+
                 history_entry = {
                     "date": datetime.now().isoformat(),
                     "avg_return": avg_return,
                     "weights_after": new_weights,
-                    "mutations": "Triggered parameter mutation",
+                    "mutations": "Parameters left to offline search" if searched else "Triggered parameter mutation",
                     "reflection": f"Mutated {s_id} params and weights based on market response."
                 }
             else:
@@ -164,21 +348,8 @@ class ReflectionEngine:
         state["last_reflection"] = datetime.now().isoformat()
 
         # ✅ Module C: 策略版本自動遞增
-        current_version = state.get("version", "1.0.0")
-        parts = current_version.split(".")
-        try:
-            major, minor, patch = int(parts[0]), int(parts[1]), int(parts[2])
-        except (ValueError, IndexError):
-            major, minor, patch = 1, 0, 0
-
         has_mutation = any("mutations" in r for r in reflections if isinstance(r, str) and "Mutated" in r)
-        if has_mutation:
-            minor += 1
-            patch = 0
-        else:
-            patch += 1
-        state["version"] = f"{major}.{minor}.{patch}"
-        print(f"[ReflectionEngine] 版本更新: {current_version} → {state['version']}")
+        ReflectionEngine._bump_version(state, minor=has_mutation)
 
         ReflectionEngine.save_state(state)
 
@@ -0,0 +1,366 @@
+"""
+Screener — 以 stock_cache 全市場資料做本地選股
+
+職責：
+1. 一次查詢將 stock_cache 載入為欄式記憶體表（每個指標一個 NumPy 陣列），
+   定期在背景重新載入；healthLabel、雷達分數（momentumScore 等）、upside 等衍生欄位
+   於載入時由 batch_enrich 整批計算，結果與逐筆 _enrich_data 相同
+2. 解析使用者提供的篩選 / 排序運算式（只允許白名單欄位與運算子，不執行任意程式碼），
+   以向量化運算在數千檔中完成篩選
+3. 自訂選股完全不打上游來源
+
+運算式語法（Python 子集）：
+    fScore >= 7 and roe > 15 and sector == "Electronic Technology"
+    (rsi < 30 or rvol > 2) and not market == "US"
+    sector in ("Finance", "Utilities") and upside > 20
+排序：以逗號分隔，欄位前加 "-" 或後加 " desc" 為遞減，例如 "-upside, roe"。
+缺值（NaN）在任何比較中皆為 False，排序時一律排在最後。
+"""
+
+import ast
+import time
+import threading
+from functools import lru_cache
+from api.db import get_db_connection, return_db_connection
+from api.services.batch_enrich import TEXT_COLUMNS as BATCH_TEXT_COLUMNS, NUMERIC_COLUMNS as BATCH_NUMERIC_COLUMNS
+
+_RELOAD_INTERVAL = 300     # 欄式表重新載入間隔（5 分鐘）
+_RETRY_INTERVAL = 30       # DB 無法連線時的重試間隔
+MAX_LIMIT = 500
+
+# stock_cache.data 中的數值欄位
+NUMERIC_FIELDS = (
+    "price", "change", "changePercent", "volume", "avgVolume", "technicalRating", "analystRating",
+    "targetPrice", "sma20", "sma50", "sma200", "rsi", "rvol", "cmf", "atr", "atr_p", "vwap",
+    "fScore", "grossMargin", "netMargin", "operatingMargin", "zScore", "eps", "epsGrowth",
+    "peRatio", "pbRatio", "currentRatio", "quickRatio", "freeCashFlow", "roe", "roa",
+    "debtToEquity", "revGrowth", "netGrowth", "yield", "volatility", "grahamNumber", "marketCapValue",
+    "marketCap",
+)
+TEXT_FIELDS = ("symbol", "name", "market", "sector", "industry", "exchange")
+# 載入時以 batch_enrich 整批計算的衍生欄位（與 _enrich_data 的輸出一致）
+DERIVED_FIELDS = BATCH_TEXT_COLUMNS + BATCH_NUMERIC_COLUMNS
+DEFAULT_FIELDS = ("symbol", "name", "market", "price", "changePercent", "fScore", "roe", "rsi", "rvol", "upside", "sector")
+
+
+class ScreenError(ValueError):
+    """篩選 / 排序運算式不合法"""
+
+
+class _ScreenTable:
+    """不可變的欄式表"""
+
+    def __init__(self, rows):
+        import numpy as np
+        from api.services.batch_enrich import enrich_columns
+        from api.services.radar_percentiles import RadarPercentiles
+        self.size = len(rows)
+        self.text = {
+            f: np.array([r[i] or "" for r in rows], dtype=object) for i, f in enumerate(TEXT_FIELDS)
+        }
+        offset = len(TEXT_FIELDS)
+        self.numeric = {
+            f: np.array([r[offset + i] for r in rows], dtype=float) for i, f in enumerate(NUMERIC_FIELDS)
+        }
+        # 雷達百分位以同一份資料建立，衍生欄位與重建後的 _enrich_data 結果一致
+        self.percentiles = RadarPercentiles.build(self)
+        text, numeric = enrich_columns(self.numeric, self.text["market"], self.percentiles)
+        self.text.update(text)
+        self.numeric.update(numeric)
+        self.loaded_at = time.time()
+
+    def column(self, name):
+        if name in self.numeric:
+            return self.numeric[name]
+        if name in self.text:
+            return self.text[name]
+        raise ScreenError(f"Unknown field: {name}")
+
+
+_TABLE = None
+_LAST_ATTEMPT = 0.0
+_RELOAD_LOCK = threading.Lock()
+
+
+# ============================================================
+# Expression compiler
+# ============================================================
+_COMPARE_OPS = {
+    ast.Eq: "eq", ast.NotEq: "ne", ast.Lt: "lt", ast.LtE: "le", ast.Gt: "gt", ast.GtE: "ge",
+    ast.In: "in", ast.NotIn: "not_in",
+}
+_ARITH_OPS = {ast.Add: "add", ast.Sub: "sub", ast.Mult: "mul", ast.Div: "div"}
+
+
+@lru_cache(maxsize=256)
+def _compile(expression):
+    """將運算式解析並驗證為 AST；只允許白名單節點"""
+    if len(expression) > 1000:
+        raise ScreenError("Filter expression too long")
+    try:
+        tree = ast.parse(expression, mode="eval")
+    except SyntaxError as e:
+        raise ScreenError(f"Invalid filter expression: {e.msg}")
+
+    allowed_names = set(NUMERIC_FIELDS) | set(TEXT_FIELDS) | set(DERIVED_FIELDS)
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name):
+            if node.id not in allowed_names:
+                raise ScreenError(f"Unknown field: {node.id}")
+        elif isinstance(node, ast.Constant):
+            if not isinstance(node.value, (int, float, str)) or isinstance(node.value, bool):
+                raise ScreenError(f"Unsupported literal: {node.value!r}")
+        elif isinstance(node, ast.Compare):
+            if any(type(op) not in _COMPARE_OPS for op in node.ops):
+                raise ScreenError("Unsupported comparison operator")
+        elif isinstance(node, ast.BinOp):
+            if type(node.op) not in _ARITH_OPS:
+                raise ScreenError("Unsupported arithmetic operator")
+        elif isinstance(node, ast.UnaryOp):
+            if not isinstance(node.op, (ast.Not, ast.USub)):
+                raise ScreenError("Unsupported unary operator")
+        elif not isinstance(node, (ast.Expression, ast.BoolOp, ast.And, ast.Or, ast.Tuple, ast.List,
+                                   ast.Load, ast.Not, ast.USub, *_COMPARE_OPS, *_ARITH_OPS)):
+            raise ScreenError(f"Unsupported syntax: {type(node).__name__}")
+    return tree.body
+
+
+def _evaluate(node, table):
+    """在欄式表上向量化求值；比較結果為 bool 陣列，NaN 比較一律為 False"""
+    import numpy as np
+
+    if isinstance(node, ast.Name):
+        return table.column(node.id)
+    if isinstance(node, ast.Constant):
+        return node.value
+    if isinstance(node, (ast.Tuple, ast.List)):
+        values = [_evaluate(e, table) for e in node.elts]
+        if any(isinstance(v, np.ndarray) for v in values):
+            raise ScreenError("Only literals are allowed inside a list")
+        return values
+    if isinstance(node, ast.BoolOp):
+        masks = [_as_mask(_evaluate(v, table), table) for v in node.values]
+        out = masks[0]
+        for m in masks[1:]:
+            out = (out & m) if isinstance(node.op, ast.And) else (out | m)
+        return out
+    if isinstance(node, ast.UnaryOp):
+        value = _evaluate(node.operand, table)
+        if isinstance(node.op, ast.Not):
+            return ~_as_mask(value, table)
+        return -_as_number(value)
+    if isinstance(node, ast.BinOp):
+        left, right = _as_number(_evaluate(node.left, table)), _as_number(_evaluate(node.right, table))
+        op = _ARITH_OPS[type(node.op)]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            if op == "add": return left + right
+            if op == "sub": return left - right
+            if op == "mul": return left * right
+            return np.where(right != 0, left / np.where(right != 0, right, 1), np.nan)
+    if isinstance(node, ast.Compare):
+        out = None
+        left = _evaluate(node.left, table)
+        for op, comparator in zip(node.ops, node.comparators):
+            right = _evaluate(comparator, table)
+            mask = _compare(left, _COMPARE_OPS[type(op)], right, table)
+            out = mask if out is None else (out & mask)
+            left = right
+        return out
+    raise ScreenError(f"Unsupported syntax: {type(node).__name__}")
+
+
+def _as_number(value):
+    import numpy as np
+    if isinstance(value, np.ndarray):
+        if value.dtype == object:
+            raise ScreenError("Arithmetic is only supported on numeric fields")
+        return value
+    if isinstance(value, (int, float)):
+        return float(value)
+    raise ScreenError("Arithmetic is only supported on numeric fields")
+
+
+def _as_mask(value, table):
+    import numpy as np
+    if isinstance(value, np.ndarray) and value.dtype == bool:
+        return value
+    raise ScreenError("Boolean operators require comparisons")
+
+
+def _compare(left, op, right, table):
+    import numpy as np
+    if op in ("in", "not_in"):
+        if not isinstance(right, list):
+            raise ScreenError("'in' requires a list of literals, e.g. sector in (\"A\", \"B\")")
+        if not isinstance(left, np.ndarray):
+            raise ScreenError("'in' requires a field on the left side")
+        if left.dtype == object:
+            mask = np.isin(left, [str(v) for v in right])
+            return ~mask if op == "not_in" else mask
+        mask = np.isin(left, [float(v) for v in right if isinstance(v, (int, float))])
+        # NaN 不屬於任何清單，但 not in 同樣視為比較，缺值一律為 False
+        return (~mask & ~np.isnan(left)) if op == "not_in" else mask
+
+    is_text = any(isinstance(v, np.ndarray) and v.dtype == object for v in (left, right)) or \
+        any(isinstance(v, str) for v in (left, right))
+    if is_text:
+        if op not in ("eq", "ne"):
+            raise ScreenError("Text fields only support ==, != and in")
+        mask = np.asarray(left == right, dtype=bool)
+        if mask.ndim == 0:
+            mask = np.full(table.size, bool(mask))
+        return ~mask if op == "ne" else mask
+
+    left, right = _as_number(left), _as_number(right)
+    with np.errstate(invalid="ignore"):
+        if op == "eq": mask = left == right
+        elif op == "ne": mask = (left != right) & ~np.isnan(left) & ~np.isnan(right)
+        elif op == "lt": mask = left < right
+        elif op == "le": mask = left <= right
+        elif op == "gt": mask = left > right
+        else: mask = left >= right
+    mask = np.asarray(mask, dtype=bool)
+    return mask if mask.ndim else np.full(table.size, bool(mask))
+
+
+def _parse_sort(sort):
+    """"-upside, roe desc" -> [("upside", True), ("roe", True)]"""
+    keys = []
+    for part in (sort or "").split(","):
+        part = part.strip()
+        if not part:
+            continue
+        descending = part.startswith("-")
+        part = part.lstrip("-+").strip()
+        tokens = part.split()
+        if len(tokens) == 2 and tokens[1].lower() in ("asc", "desc"):
+            descending = tokens[1].lower() == "desc"
+            part = tokens[0]
+        elif len(tokens) != 1:
+            raise ScreenError(f"Invalid sort key: {part}")
+        if part not in NUMERIC_FIELDS and part not in DERIVED_FIELDS and part not in TEXT_FIELDS:
+            raise ScreenError(f"Unknown sort field: {part}")
+        keys.append((part, descending))
+    return keys
+
+
+def _json_value(value):
+    if isinstance(value, float):
+        return None if value != value else round(value, 4)
+    return value
+
+
+class Screener:
+    """全市場欄式篩選"""
+
+    @staticmethod
+    def ensure_loaded():
+        """首次呼叫同步載入；之後過期時於背景重新載入"""
+        now = time.time()
+        if _TABLE is None:
+            if now - _LAST_ATTEMPT >= _RETRY_INTERVAL:
+                Screener.reload()
+            return _TABLE
+        if now - _TABLE.loaded_at >= _RELOAD_INTERVAL and not _RELOAD_LOCK.locked():
+            threading.Thread(target=Screener.reload, daemon=True).start()
+        return _TABLE
+
+    @staticmethod
+    def reload():
+        global _TABLE, _LAST_ATTEMPT
+        if not _RELOAD_LOCK.acquire(blocking=_TABLE is None):
+            return
+        try:
+            _LAST_ATTEMPT = time.time()
+            conn = get_db_connection()
+            if not conn:
+                return
+            columns = ", ".join(
+                f"CASE WHEN jsonb_typeof(data->'{f}') = 'number' THEN (data->>'{f}')::float END"
+                for f in NUMERIC_FIELDS
+            )
+            try:
+                cur = conn.cursor()
+                cur.execute(f"""
+                    SELECT symbol, data->>'name', market, data->>'sector', data->>'industry', data->>'exchange',
+                           {columns}
+                    FROM stock_cache
+                    WHERE price IS NOT NULL
+                """)
+                rows = cur.fetchall()
+                cur.close()
+            except Exception as e:
+                print(f"[Screener] Reload error: {e}")
+                return
+            finally:
+                return_db_connection(conn)
+            _TABLE = Screener.build_table(rows)
+            print(f"[Screener] Loaded {_TABLE.size} symbols")
+            # 全市場資料更新時一併更新雷達百分位表（build_table 已以同一份資料建立）
+            from api.services.radar_percentiles import RadarPercentiles
+            RadarPercentiles.rebuild(_TABLE, _TABLE.percentiles)
+        finally:
+            _RELOAD_LOCK.release()
+
+    @staticmethod
+    def build_table(rows):
+        """rows: (symbol, name, market, sector, industry, exchange, *NUMERIC_FIELDS)"""
+        return _ScreenTable(rows)
+
+    @staticmethod
+    def screen(filter=None, sort=None, market=None, limit=50, offset=0, fields=None, table=None):
+        import numpy as np
+        table = table or Screener.ensure_loaded()
+        if table is None:
+            return None
+
+        try:
+            limit = max(1, min(MAX_LIMIT, int(limit)))
+            offset = max(0, int(offset))
+        except (TypeError, ValueError):
+            raise ScreenError("limit and offset must be integers")
+
+        fields = [f.strip() for f in fields.split(",") if f.strip()] if isinstance(fields, str) else list(fields or DEFAULT_FIELDS)
+        for f in fields:
+            table.column(f)
+
+        mask = np.ones(table.size, dtype=bool)
+        if market:
+            mask &= table.text["market"] == market.upper()
+        if filter and filter.strip():
+            result = _evaluate(_compile(filter.strip()), table)
+            if not isinstance(result, np.ndarray) or result.dtype != bool:
+                raise ScreenError("Filter must be a boolean expression")
+            mask &= result
+        idx = np.flatnonzero(mask)
+
+        sort_keys = _parse_sort(sort)
+        if sort_keys and len(idx):
+            # np.lexsort 以最後一個 key 為主排序鍵；NaN 以額外 key 排到最後
+            lex = []
+            for name, descending in reversed(sort_keys):
+                col = table.column(name)[idx]
+                if col.dtype == object:
+                    _, codes = np.unique(col.astype(str), return_inverse=True)
+                    lex.append(-codes if descending else codes)
+                else:
+                    missing = np.isnan(col)
+                    values = np.where(missing, 0.0, col)
+                    lex.append(-values if descending else values)
+                    lex.append(missing)
+            idx = idx[np.lexsort(lex)]
+
+        page = idx[offset:offset + limit]
+        columns = {f: table.column(f)[page] for f in fields}
+        results = [
+            {f: _json_value(columns[f][i].item() if hasattr(columns[f][i], "item") else columns[f][i]) for f in fields}
+            for i in range(len(page))
+        ]
+        return {
+            "count": int(len(idx)),
+            "offset": offset,
+            "limit": limit,
+            "results": results,
+            "universe": table.size,
+            "as_of": table.loaded_at,
+        }
@@ -0,0 +1,149 @@
+"""
+StateStore — 策略設定與進化狀態（JSON 檔）的單一存取點
+
+職責：
+1. 讀取：依檔案 mtime / 大小判斷是否變更，未變更時直接回傳記憶體快取（不重新解析）；
+   其他行程（如 scripts/search_strategy.py）寫入後，下一次讀取即自動生效
+2. 寫入：先寫同目錄暫存檔、fsync 後以 os.replace 原子替換，讀取端不會看到半份檔案
+3. 版本歷史：每次寫入前把舊版本備份到歷史目錄（保留最近 STATE_HISTORY_KEEP 份），可 rollback；
+   內容與檔案相同的寫入直接略過（不備份、不寫檔）
+
+所有讀取者都應透過 STRATEGY_CONFIG / EVOLUTION_STATE，不要直接開檔。
+
+設定（環境變數）：
+- STATE_HISTORY_DIR：歷史版本目錄（預設為檔案所在目錄下的 .state_history）
+- STATE_HISTORY_KEEP：每個檔案保留的歷史版本數（預設 20）
+"""
+
+import os
+import copy
+import json
+import threading
+from datetime import datetime
+from pathlib import Path
+
+_API_DIR = Path(__file__).parent.parent
+_HISTORY_KEEP = int(os.environ.get("STATE_HISTORY_KEEP", "20"))
+
+
+class StateStore:
+    """單一 JSON 檔的原子讀寫與版本歷史"""
+
+    def __init__(self, path, indent=2, keep=None):
+        self.path = Path(path)
+        self.indent = indent
+        self.keep = _HISTORY_KEEP if keep is None else keep
+        self._lock = threading.Lock()
+        self._cached = None      # ((mtime_ns, size), data)
+
+    @property
+    def history_dir(self):
+        return Path(os.environ.get("STATE_HISTORY_DIR", str(self.path.parent / ".state_history")))
+
+    def _signature(self):
+        st = os.stat(self.path)
+        return st.st_mtime_ns, st.st_size
+
+    def read(self):
+        """
+        回傳檔案內容的副本（呼叫端可自由修改）；檔案不存在或解析失敗時回傳 {}。
+        檔案未變更時不重新解析。
+        """
+        try:
+            signature = self._signature()
+        except FileNotFoundError:
+            return {}
+        except OSError as e:
+            print(f"[StateStore] Failed to stat {self.path.name}: {e}")
+            return {}
+
+        cached = self._cached
+        if cached is None or cached[0] != signature:
+            with self._lock:
+                cached = self._cached
+                if cached is None or cached[0] != signature:
+                    try:
+                        with open(self.path, "r", encoding="utf-8") as f:
+                            cached = (signature, json.load(f))
+                    except (json.JSONDecodeError, OSError) as e:
+                        print(f"[StateStore] Failed to load {self.path.name}: {e}")
+                        return {}
+                    self._cached = cached
+        return copy.deepcopy(cached[1])
+
+    def write(self, data):
+        """原子寫入；舊版本先備份到歷史目錄。內容未變更時不寫檔。成功回傳 True。"""
+        text = json.dumps(data, indent=self.indent, ensure_ascii=False)
+        with self._lock:
+            tmp = self.path.with_name(f".{self.path.name}.{os.getpid()}.tmp")
+            try:
+                if self.path.read_text(encoding="utf-8") == text:
+                    return True
+            except (OSError, UnicodeDecodeError):
+                pass
+            try:
+                self._backup()
+                with open(tmp, "w", encoding="utf-8") as f:
+                    f.write(text)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp, self.path)
+                self._cached = (self._signature(), copy.deepcopy(data))
+                return True
+            except OSError as e:
+                print(f"[StateStore] Failed to save {self.path.name}: {e}")
+                try: tmp.unlink()
+                except OSError: pass
+                return False
+
+    def _backup(self):
+        """將目前檔案複製到歷史目錄並刪除超過保留數的舊版本（失敗不影響寫入）"""
+        if self.keep <= 0 or not self.path.exists():
+            return
+        try:
+            history = self.history_dir
+            history.mkdir(parents=True, exist_ok=True)
+            stamp = datetime.now().strftime("%Y%m%dT%H%M%S%f")
+            (history / f"{self.path.stem}.{stamp}.json").write_bytes(self.path.read_bytes())
+            for old in self.versions()[self.keep:]:
+                old["path"].unlink(missing_ok=True)
+        except OSError as e:
+            print(f"[StateStore] Failed to back up {self.path.name}: {e}")
+
+    def versions(self):
+        """歷史版本（新到舊）：[{"id", "path", "saved_at"}]"""
+        history = self.history_dir
+        if not history.is_dir():
+            return []
+        out = []
+        for p in history.glob(f"{self.path.stem}.*.json"):
+            stamp = p.name[len(self.path.stem) + 1:-len(".json")]
+            try:
+                saved_at = datetime.strptime(stamp, "%Y%m%dT%H%M%S%f")
+            except ValueError:
+                continue
+            out.append({"id": stamp, "path": p, "saved_at": saved_at.isoformat()})
+        out.sort(key=lambda v: v["id"], reverse=True)
+        return out
+
+    def rollback(self, version_id=None):
+        """
+        還原到指定歷史版本（預設為最近一次寫入前的版本）。
+        還原本身也是一次寫入，目前內容會先備份，可再次 rollback。回傳還原的版本 id 或 None。
+        """
+        versions = self.versions()
+        target = versions[0] if version_id is None and versions else \
+            next((v for v in versions if v["id"] == version_id), None)
+        if target is None:
+            return None
+        try:
+            with open(target["path"], "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (json.JSONDecodeError, OSError) as e:
+            print(f"[StateStore] Failed to read version {target['id']}: {e}")
+            return None
+        return target["id"] if self.write(data) else None
+
+
+STRATEGY_CONFIG = StateStore(_API_DIR / "strategy_config.json", indent=4)
+EVOLUTION_STATE = StateStore(_API_DIR / "evolution_state.json", indent=2)
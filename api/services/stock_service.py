@@ -1,17 +1,18 @@
 import re
-import json
 import math
 import time
 import threading
-from api.db import get_db_connection, return_db_connection
+from api.db import get_db_connection, return_db_connection, has_schema
+from api.services.cache_writer import CacheWriter
+from api.services.state_store import STRATEGY_CONFIG
+from api.services.radar_percentiles import RadarPercentiles, market_of, size_metric
 from api.constants import TW_STOCK_NAMES
-from api.scrapers import fetch_from_yfinance, fetch_history_from_yfinance, sanitize_json, get_field, process_tvs_row, trunc2, calculate_rsi
+from api.scrapers import fetch_from_yfinance, fetch_history_from_yfinance, sanitize_json, get_field, process_tvs_row, trunc2, calculate_rsi, get_stock_names
+from api.replay import replayable
+from api import metrics
 from concurrent.futures import ThreadPoolExecutor
-from pathlib import Path
-import tvscreener as tvs
-from tvscreener import StockScreener, StockField
 
-# [Optimization] Heavy imports are now at top-level to support unit test mocking.
+# [Optimization] tvscreener（連帶 pandas）於查詢時才載入，冷啟動不必付出匯入成本。
 # MarketRegimeDetector is lazy-initialized on first use.
 _MARKET_REGIME = None
 _MARKET_REGIME_LOCK = threading.Lock()
@@ -26,6 +27,48 @@ def _get_market_regime():
                 _MARKET_REGIME = MarketRegimeDetector()
     return _MARKET_REGIME
 
+def _market_label(market):
+    """metrics label 只允許固定值；market 來自 query string，不可直接當 label"""
+    return market if market in ("TW", "US") else "other"
+
+
+@replayable("tvscreener")
+def _run_screener(market, fields=None, search=None):
+    """
+    執行 tvscreener 查詢（外部來源，支援 record/replay）。
+    market: tvs.Market 名稱（"TAIWAN" / "AMERICA"）；fields: StockField 名稱 tuple
+    """
+    import tvscreener as tvs
+    from tvscreener import StockScreener, StockField
+    ss = StockScreener()
+    ss.set_markets(tvs.Market[market])
+    if search:
+        ss.search(search)
+    if fields:
+        ss.select(*[StockField[f] for f in fields])
+    return ss.get()
+
+_TRENDING_FIELDS = (
+    "NAME", "DESCRIPTION", "PRICE", "CHANGE", "CHANGE_PERCENT", "VOLUME",
+    "TECHNICAL_RATING", "PIOTROSKI_F_SCORE_TTM", "MARKET_CAPITALIZATION", "SECTOR", "EXCHANGE",
+)
+
+_DETAIL_FIELDS = (
+    "NAME", "DESCRIPTION", "PRICE", "CHANGE", "CHANGE_PERCENT",
+    "VOLUME", "MARKET_CAPITALIZATION", "SECTOR", "INDUSTRY", "EXCHANGE",
+    "RELATIVE_VOLUME", "CHAIKIN_MONEY_FLOW_20", "VOLUME_WEIGHTED_AVERAGE_PRICE",
+    "TECHNICAL_RATING", "AVERAGE_TRUE_RANGE_14", "RELATIVE_STRENGTH_INDEX_14",
+    "SIMPLE_MOVING_AVERAGE_50", "SIMPLE_MOVING_AVERAGE_200",
+    "PIOTROSKI_F_SCORE_TTM", "BASIC_EPS_TTM", "RECOMMENDATION_MARK",
+    "GROSS_MARGIN_TTM", "OPERATING_MARGIN_TTM", "NET_MARGIN_TTM",
+    "ALTMAN_Z_SCORE_TTM", "GRAHAM_NUMBERS_TTM", "PRICE_TARGET_AVERAGE",
+    "RETURN_ON_EQUITY_TTM", "RETURN_ON_ASSETS_TTM", "DEBT_TO_EQUITY_RATIO_MRQ",
+    "REVENUE_TTM_YOY_GROWTH", "NET_INCOME_TTM_YOY_GROWTH", "YIELD_RECENT",
+    "PRICE_TO_EARNINGS_RATIO_TTM", "PRICE_TO_BOOK_MRQ", "DIVIDEND_YIELD_FORWARD",
+    "EPS_DILUTED_TTM_YOY_GROWTH", "CURRENT_RATIO_MRQ", "QUICK_RATIO_MRQ",
+    "FREE_CASH_FLOW_TTM",
+)
+
 
 # ============================================================
 # 記憶體快取層（In-Memory Cache）
@@ -44,10 +87,15 @@ def _cache_get(key: str):
         return entry['data']
     return None
 
-def _cache_set(key: str, data):
-    """寫入快取"""
+def _cache_set(key: str, data, ts=None):
+    """寫入快取（ts 可指定寫入時間，warm start 以此將資料標記為即將過期）"""
+    with _CACHE_LOCK:
+        _MEMORY_CACHE[key] = {'data': data, 'ts': time.time() if ts is None else ts}
+
+def _cache_invalidate_prefix(prefix: str):
     with _CACHE_LOCK:
-        _MEMORY_CACHE[key] = {'data': data, 'ts': time.time()}
+        for key in [k for k in _MEMORY_CACHE if k.startswith(prefix)]:
+            del _MEMORY_CACHE[key]
 
 def _cache_is_stale(key: str) -> bool:
     """快取是否即將過期（剩餘時間 < _CACHE_STALE）"""
@@ -63,7 +111,11 @@ class StockService:
         # Normalize symbol
         symbol = re.sub(r'\.TW[O]?$', '', symbol.strip(), flags=re.IGNORECASE).upper()
         
-        # Check cache only
+        # Check cache only (including writes not yet flushed)
+        pending = CacheWriter.get_pending(symbol)
+        if pending and pending.get('price'):
+            return float(pending['price'])
+
         conn = get_db_connection()
         if conn:
             try:
@@ -79,56 +131,24 @@ class StockService:
         return 0
 
     @staticmethod
-    def get_market_regime():
-        return _get_market_regime().detect_regime()
+    def get_market_regime(market="TW"):
+        return _get_market_regime().detect_regime(market)
 
     @staticmethod
-    def get_leaderboard():
-        conn = get_db_connection()
-        if not conn: return []
-        try:
-            from psycopg2.extras import RealDictCursor
-            cur = conn.cursor(cursor_factory=RealDictCursor)
-            cur.execute("""
-                SELECT 
-                    u.nickname, 
-                    p.id as portfolio_id, 
-                    p.user_id, 
-                    p.symbol, 
-                    p.entry_price, 
-                    p.entry_date, 
-                    s.data->>'price' as current_price 
-                FROM portfolio_items p 
-                JOIN users u ON p.user_id = u.id 
-                LEFT JOIN stock_cache s ON p.symbol = s.symbol 
-                ORDER BY p.entry_date DESC 
-                LIMIT 50
-            """)
-            rows, results = cur.fetchall(), []
-            for row in rows:
-                try:
-                    curr = float(row['current_price']) if row['current_price'] else 0
-                    entry = float(row['entry_price']) if row['entry_price'] else 0
-                    
-                    if entry <= 0:
-                        ret = 0
-                    else:
-                        ret = ((curr - entry) / entry) * 100 if curr > 0 else 0
-                    
-                    results.append({
-                        "id": row['portfolio_id'], 
-                        "user_id": str(row['user_id']), 
-                        "nickname": row['nickname'], 
-                        "symbol": row['symbol'], 
-                        "entry_price": entry, 
-                        "current_price": curr,
-                        "return": round(ret, 2), 
-                        "date": row['entry_date']
-                    })
-                except:
-                    continue
-            return results
-        finally: return_db_connection(conn)
+    def get_market_regimes(compute=True):
+        """所有追蹤指數的市場狀態；compute=False 時不觸發背景重新計算"""
+        return _get_market_regime().get_all(compute=compute)
+
+    @staticmethod
+    def refresh_market_regimes():
+        """同步重新計算並儲存所有指數的市場狀態（排程 / 腳本使用）"""
+        return _get_market_regime().refresh()
+
+    @staticmethod
+    def get_leaderboard(page=1, page_size=50, view="positions", sort="date"):
+        # [Optimization] 讀取物化表，報酬率已在價格/持倉變動時預先計算
+        from api.services.leaderboard_service import LeaderboardService
+        return LeaderboardService.get_leaderboard(page, page_size, view, sort)
 
     @staticmethod
     def get_market_trending(market_param):
@@ -142,7 +162,8 @@ class StockService:
             if _cache_is_stale(cache_key):
                 def _bg_refresh():
                     try:
-                        fresh = StockService._fetch_trending_from_source(market_param)
+                        with metrics.span("trending.source_fetch", market=_market_label(market_param), mode="background"):
+                            fresh = StockService._fetch_trending_from_source(market_param)
                         if fresh:
                             _cache_set(cache_key, fresh)
                             print(f"[Cache] Background refresh done for {cache_key}")
@@ -164,26 +185,34 @@ class StockService:
             return cached
 
         # 快取未命中：嘗試從 DB 獲取 (DB Cache First Strategy)
-        t0 = time.time()
         db_results = []
         conn = get_db_connection()
         if conn:
             try:
                 cur = conn.cursor()
                 # 簡單的 "熱門股" 定義：依成交量排序的最近資料
-                # 區分台美股
-                market_filter = "symbol ~ '^[0-9]+$'" if market_param == 'TW' else "symbol !~ '^[0-9]+$'"
-                cur.execute(f"""
-                    SELECT data FROM stock_cache 
-                    WHERE {market_filter} 
-                    AND updated_at > NOW() - INTERVAL '3 days'
-                    ORDER BY (data->>'volume')::numeric DESC
-                    LIMIT 15
-                """)
+                # 區分台美股（market / volume 為 generated column，走 idx_stock_cache_market_volume）
+                if has_schema(2):
+                    cur.execute("""
+                        SELECT data FROM stock_cache 
+                        WHERE market = %s 
+                        AND updated_at > NOW() - INTERVAL '3 days'
+                        ORDER BY volume DESC NULLS LAST
+                        LIMIT 15
+                    """, ('TW' if market_param == 'TW' else 'US',))
+                else:
+                    # migration 2 尚未套用：沒有 typed columns，直接比對 JSON
+                    market_filter = "symbol ~ '^[0-9]+$'" if market_param == 'TW' else "symbol !~ '^[0-9]+$'"
+                    cur.execute(f"""
+                        SELECT data FROM stock_cache 
+                        WHERE {market_filter} 
+                        AND updated_at > NOW() - INTERVAL '3 days'
+                        ORDER BY (data->>'volume')::numeric DESC NULLS LAST
+                        LIMIT 15
+                    """)
                 rows = cur.fetchall()
                 if rows:
                     db_results = [r[0] for r in rows]
-                    print(f"[Timing] DB Cache hit for {market_param}: {len(db_results)} items in {time.time()-t0:.3f}s")
             except Exception as e:
                 print(f"[API] DB Cache errors: {e}")
             finally:
@@ -199,23 +228,21 @@ class StockService:
             # 為了確保資料新鮮，每次 Cold Start 都觸發背景刷新是安全的
             def _bg_refresh_cold():
                 try:
-                    t1 = time.time()
-                    fresh = StockService._fetch_trending_from_source(market_param)
+                    with metrics.span("trending.source_fetch", market=_market_label(market_param), mode="cold_start"):
+                        fresh = StockService._fetch_trending_from_source(market_param)
                     if fresh:
                         _cache_set(cache_key, fresh)
-                        print(f"[Cache] Cold-Start Background refresh done for {cache_key} in {time.time()-t1:.3f}s")
+                        print(f"[Cache] Cold-Start Background refresh done for {cache_key}")
                 except Exception as e:
                     print(f"[Cache] Cold-Start Background refresh error: {e}")
             threading.Thread(target=_bg_refresh_cold, daemon=True).start()
 
-            print(f"[Timing] Returning DB data for {market_param}. Total time: {time.time()-t0:.3f}s")
             return db_results
 
         # DB 也沒有資料 (系統初次初始化)：同步取得資料
-        print(f"[Timing] Cache & DB Miss. Fetching from Source synchronously...")
-        t_src = time.time()
-        results = StockService._fetch_trending_from_source(market_param)
-        print(f"[Timing] Source fetch done in {time.time()-t_src:.3f}s")
+        print(f"[Cache] Cache & DB miss for {cache_key}. Fetching from source synchronously...")
+        with metrics.span("trending.source_fetch", market=_market_label(market_param), mode="sync"):
+            results = StockService._fetch_trending_from_source(market_param)
         
         if results:
             _cache_set(cache_key, results)
@@ -236,23 +263,10 @@ class StockService:
     @staticmethod
     def _fetch_trending_from_source(market_param):
         """從 tvscreener 取得 trending 資料（原有邏輯，抽出為獨立方法）"""
-        t_start = time.time()
         market_param = market_param.upper()
         is_tw = (market_param == 'TW')
-        import tvscreener as tvs
-        from tvscreener import StockScreener, StockField
         results = []
         try:
-            ss = StockScreener()
-            # 設定市場
-            ss.set_markets(tvs.Market.TAIWAN if is_tw else tvs.Market.AMERICA)
-            
-            # 增加關鍵欄位選擇
-            ss.select(StockField.NAME, StockField.DESCRIPTION, StockField.PRICE, 
-                      StockField.CHANGE, StockField.CHANGE_PERCENT, StockField.VOLUME,
-                      StockField.TECHNICAL_RATING, StockField.PIOTROSKI_F_SCORE_TTM,
-                      StockField.MARKET_CAPITALIZATION, StockField.SECTOR, StockField.EXCHANGE)
-            
             # 篩選邏輯：
             # 1. 技術評級 > 0.3 (中性偏買)
             # 2. F-Score > 4 (財務品質良好)
@@ -260,7 +274,7 @@ class StockService:
             min_vol = 1000000 if is_tw else 2000000
             
             # 使用 tvscreener 的過濾法 (如果 API 支援), 否則在本地過濾 DataFrame
-            df = ss.get()
+            df = _run_screener("TAIWAN" if is_tw else "AMERICA", _TRENDING_FIELDS)
             
             if df is not None and not df.empty:
                 # 本地過濾以確保數據質量
@@ -269,6 +283,7 @@ class StockService:
                 # 安全轉換數值
                 def to_num(ser): return ser.apply(lambda x: float(x) if x is not None and not isinstance(x, str) else 0)
                 
+                from tvscreener import StockField
                 v_col = 'Volume' if 'Volume' in df.columns else StockField.VOLUME.label
                 t_col = 'Technical Rating' if 'Technical Rating' in df.columns else StockField.TECHNICAL_RATING.label
                 f_col = 'Piotroski F-Score (TTM)' if 'Piotroski F-Score (TTM)' in df.columns else StockField.PIOTROSKI_F_SCORE_TTM.label
@@ -292,25 +307,21 @@ class StockService:
 
                 # [Optimization] Pre-compute shared values ONCE, outside per-stock loop
                 try:
-                    regime = _get_market_regime().detect_regime()
+                    regime = _get_market_regime().detect_regime(market_param)
                 except Exception:
                     regime = "sideways"
 
-                strategy_params = {}
-                try:
-                    config_path = Path(__file__).parent.parent / "strategy_config.json"
-                    if config_path.exists():
-                        with open(config_path, "r", encoding="utf-8") as f:
-                            full_config = json.load(f)
-                            strategy_params = full_config.get("strategies", {}).get("growth_value", {})
-                except Exception:
-                    pass
+                # StateStore 以 mtime 判斷，檔案未變更時不重新讀取
+                strategy_params = STRATEGY_CONFIG.read().get("strategies", {}).get("growth_value", {})
 
                 # [Optimization] 列表頁移除 yfinance fallback，只用 TVScreener 資料
                 # 避免 Vercel Timeout (10s limit)
+                # [Optimization] 一次查好所有名稱，避免每列各查一次 DB
+                names = get_stock_names([s for s, _ in stock_list])
+
                 def enrich_fast(symbol, row_dict):
                     try:
-                        data = process_tvs_row(row_dict, symbol)
+                        data = process_tvs_row(row_dict, symbol, names)
                         StockService._enrich_data(data)
                         StockService._save_to_cache(symbol, data)
                         return data
@@ -326,7 +337,10 @@ class StockService:
                 
                 # 再次排序並僅保留前 10
                 results.sort(key=lambda x: x.get('volume', 0), reverse=True)
-                return results[:10]
+                top = results[:10]
+                # ✅ AI 進化閉環：推薦清單一次批次記錄預測（同一 symbol 每日一筆）
+                StockService._record_trending_predictions(top, market_param, regime, strategy_params)
+                return top
             
             # 備選方案：當 API 抓取失敗時，從 DB 快取載入舊資料，確保啟動不報錯
             if not results:
@@ -334,14 +348,26 @@ class StockService:
                 if conn:
                     try:
                         cur = conn.cursor()
-                        market_filter = "symbol ~ '^[0-9]+$'" if is_tw else "symbol ~ '^[A-Z]+$'"
-                        cur.execute(f"""
-                            SELECT data FROM stock_cache 
-                            WHERE {market_filter} 
-                            AND updated_at > NOW() - INTERVAL '24 hours'
-                            ORDER BY (data->>'fScore')::numeric DESC, (data->>'technicalRating')::numeric DESC
-                            LIMIT 15
-                        """)
+                        # 美股只取純字母代號（排除指數與含 "." 的代號），與 market 欄位的 US 不同
+                        if has_schema(2):
+                            cur.execute("""
+                                SELECT data FROM stock_cache 
+                                WHERE market = %s 
+                                AND (market = 'TW' OR symbol ~ '^[A-Z]+$')
+                                AND updated_at > NOW() - INTERVAL '24 hours'
+                                ORDER BY f_score DESC NULLS LAST, technical_rating DESC NULLS LAST
+                                LIMIT 15
+                            """, ('TW' if is_tw else 'US',))
+                        else:
+                            market_filter = "symbol ~ '^[0-9]+$'" if is_tw else "symbol ~ '^[A-Z]+$'"
+                            cur.execute(f"""
+                                SELECT data FROM stock_cache 
+                                WHERE {market_filter} 
+                                AND updated_at > NOW() - INTERVAL '24 hours'
+                                ORDER BY (data->>'fScore')::numeric DESC NULLS LAST,
+                                         (data->>'technicalRating')::numeric DESC NULLS LAST
+                                LIMIT 15
+                            """)
                         results = [r[0] for r in cur.fetchall()]
                         cur.close()
                     finally:
@@ -353,39 +379,111 @@ class StockService:
             
         return sanitize_json(results)
 
+    @staticmethod
+    def _record_trending_predictions(stocks, market, regime, strategy_params):
+        """
+        以 growth_value 策略記錄推薦清單的預測快照（評分為 F-Score）。
+        只記錄通過策略門檻（F-Score、RSI）的個股，未通過者不算該策略的預測。
+        """
+        try:
+            from api.services.performance_tracker import PerformanceTracker
+            rsi_max = strategy_params.get("rsi_threshold", 60)
+            f_min = strategy_params.get("f_score_min", 5)
+            predictions = []
+            for s in stocks:
+                price, f_score, rsi = s.get('price') or 0, s.get('fScore') or 0, s.get('rsi')
+                if f_score < f_min or rsi is None or rsi >= rsi_max:
+                    continue
+                predictions.append({
+                    "symbol": s.get('symbol'),
+                    "strategy_id": "growth_value",
+                    "predicted_score": f_score,
+                    "initial_price": price if price > 0 else None,
+                    "details": {
+                        "market": market,
+                        "regime": regime,
+                        "rsi": rsi,
+                        "technicalRating": s.get('technicalRating'),
+                    },
+                })
+            added = PerformanceTracker.record_predictions(predictions)
+            if added:
+                print(f"[PerformanceTracker] Recorded {added} trending predictions for {market}")
+        except Exception as e:
+            print(f"[PerformanceTracker] record_predictions error: {e}")
+
     @staticmethod
     def get_stock_details(symbol, period='1y', interval='1d', flush=False):
         symbol = re.sub(r'\.TW[O]?$', '', symbol.strip(), flags=re.IGNORECASE).upper()
         
-        # Try to resolve name from DB
+        # Resolve canonical symbol (symbol or exact name) via in-memory stock_names index
+        from api.services.name_resolver import NameResolver
+        symbol = NameResolver.resolve(symbol) or symbol
+
+        if flush:
+            # Flush -> Force update (Called by Updater Service usually)
+            return StockService._fetch_and_cache(symbol, period, interval)
+
+        # [Optimization] 記憶體快取（含 warm-start 快照）優先；即將過期時於背景由 DB 重新載入
+        detail_key = f"detail_{symbol}_{period}_{interval}"
+        if CacheWriter.get_pending(symbol) is None:
+            cached = _cache_get(detail_key)
+            if cached is not None:
+                if _cache_is_stale(detail_key) and detail_key not in _DETAIL_REFRESHING:
+                    _DETAIL_REFRESHING.add(detail_key)
+
+                    def _bg_refresh():
+                        try:
+                            StockService._load_details(symbol, period, interval)
+                        except Exception as e:
+                            print(f"[Cache] Detail refresh error for {symbol}: {e}")
+                        finally:
+                            _DETAIL_REFRESHING.discard(detail_key)
+                    threading.Thread(target=_bg_refresh, daemon=True).start()
+                return cached
+
+        return StockService._load_details(symbol, period, interval)
+
+    @staticmethod
+    def _load_details(symbol, period, interval):
+        """由 DB 快取（與 write-behind 緩衝）組出個股詳情，並寫入記憶體快取"""
         conn = get_db_connection()
         if not conn: return None
         
         try:
-            # Name Lookup via DB
-            cur = conn.cursor()
-            # Check if symbol exists in stock_names (could use like search for name?)
-            # For now, precise match on symbol or name
-            # Optimization: Just use memory TW_STOCK_NAMES if available, but we want DB source of truth
-            cur.execute("SELECT symbol, name FROM stock_names WHERE symbol = %s OR name = %s LIMIT 1", (symbol, symbol))
-            name_row = cur.fetchone()
-            if name_row:
-                symbol = name_row[0] # Canonical symbol
-            cur.close()
-
-            # Flush -> Force update (Called by Updater Service usually)
-            if flush:
-                return StockService._fetch_and_cache(symbol, period, interval)
-
             # Normal Read -> DB Cache Only
             cur = conn.cursor()
-            cur.execute("SELECT data, updated_at FROM stock_cache WHERE symbol = %s", (symbol,))
-            row = cur.fetchone()
+            checked_at = None
+            if has_schema(8):
+                # 內容未變動的重新抓取只記錄在 stock_cache_checks，新鮮度取兩者較新的時間
+                cur.execute("""
+                    SELECT c.data, c.updated_at, k.checked_at
+                    FROM stock_cache c
+                    LEFT JOIN stock_cache_checks k ON k.symbol = c.symbol
+                    WHERE c.symbol = %s
+                """, (symbol,))
+                row = cur.fetchone()
+                if row:
+                    row, checked_at = row[:2], row[2]
+            else:
+                cur.execute("SELECT data, updated_at FROM stock_cache WHERE symbol = %s", (symbol,))
+                row = cur.fetchone()
             cur.close()
+
+            # Write-behind 緩衝中有較新的文件時優先使用
+            pending = CacheWriter.get_pending(symbol)
+            if pending is not None:
+                from datetime import datetime, timezone
+                row = (pending, datetime.now(timezone.utc))
             
             if row:
                 cached_data = dict(row[0]) if isinstance(row[0], dict) else {}
+                if pending is None:
+                    # 作為 diff 基準，之後補上 history 時只需寫入新增的 key
+                    CacheWriter.remember(symbol, cached_data, row[1] if len(row) > 1 else None)
                 cache_updated_at = row[1] if len(row) > 1 else None
+                if checked_at and pending is None and (cache_updated_at is None or checked_at > cache_updated_at):
+                    cache_updated_at = checked_at
                 
                 # [Optimization] Inject cached_at for clients to determine freshness
                 if cache_updated_at:
@@ -405,9 +503,12 @@ class StockService:
 
                 history_key = f"history_{period}_{interval}"
 
+                detail_key = f"detail_{symbol}_{period}_{interval}"
                 if cached_data.get(history_key) and not history_stale:
                     cached_data["history"] = cached_data[history_key]
-                    return sanitize_json(cached_data)
+                    result = sanitize_json(cached_data)
+                    _cache_set(detail_key, result)
+                    return result
 
                 # Fetch history if missing or stale
                 try:
@@ -422,7 +523,10 @@ class StockService:
                     print(f"Non-critical: History fetch failed for {symbol}: {e}")
                     cached_data["history"] = []
                 
-                return sanitize_json(cached_data)
+                result = sanitize_json(cached_data)
+                if result.get("history"):
+                    _cache_set(detail_key, result)
+                return result
             
             return None # 404 if not in cache
 
@@ -436,6 +540,16 @@ class StockService:
         Used by Updater Service via flush=True.
         """
         has_chinese = bool(re.search(r'[\u4e00-\u9fff]', symbol))
+        if has_chinese:
+            # 中文名稱先查本地名稱索引，避免下載整份台股 screener 做 str.contains
+            from api.services.name_resolver import NameResolver
+            resolved = NameResolver.resolve(symbol)
+            if not resolved:
+                matches = NameResolver.search(symbol, limit=1)
+                resolved = matches[0]['symbol'] if matches else None
+            if resolved:
+                symbol = resolved
+                has_chinese = False
         is_digit = symbol.isdigit()
         is_tw = has_chinese or is_digit
         is_us = not is_tw
@@ -445,32 +559,14 @@ class StockService:
             is_us = True
 
         try:
-            ss = StockScreener()
-            ss.set_markets(tvs.Market.AMERICA if is_us else tvs.Market.TAIWAN)
-            ss.search(symbol)
-            ss.select(StockField.NAME, StockField.DESCRIPTION, StockField.PRICE, StockField.CHANGE, StockField.CHANGE_PERCENT, 
-                      StockField.VOLUME, StockField.MARKET_CAPITALIZATION, StockField.SECTOR, StockField.INDUSTRY, StockField.EXCHANGE,
-                      StockField.RELATIVE_VOLUME, StockField.CHAIKIN_MONEY_FLOW_20, StockField.VOLUME_WEIGHTED_AVERAGE_PRICE, 
-                       StockField.TECHNICAL_RATING, StockField.AVERAGE_TRUE_RANGE_14, StockField.RELATIVE_STRENGTH_INDEX_14,
-                       StockField.SIMPLE_MOVING_AVERAGE_50, StockField.SIMPLE_MOVING_AVERAGE_200,
-                       StockField.PIOTROSKI_F_SCORE_TTM, StockField.BASIC_EPS_TTM, StockField.RECOMMENDATION_MARK,
-                       StockField.GROSS_MARGIN_TTM, StockField.OPERATING_MARGIN_TTM, StockField.NET_MARGIN_TTM,
-                       StockField.ALTMAN_Z_SCORE_TTM, StockField.GRAHAM_NUMBERS_TTM, StockField.PRICE_TARGET_AVERAGE,
-                       StockField.RETURN_ON_EQUITY_TTM, StockField.RETURN_ON_ASSETS_TTM, StockField.DEBT_TO_EQUITY_RATIO_MRQ,
-                       StockField.REVENUE_TTM_YOY_GROWTH, StockField.NET_INCOME_TTM_YOY_GROWTH, StockField.YIELD_RECENT,
-                       StockField.PRICE_TO_EARNINGS_RATIO_TTM, StockField.PRICE_TO_BOOK_MRQ, StockField.DIVIDEND_YIELD_FORWARD,
-                       StockField.EPS_DILUTED_TTM_YOY_GROWTH, StockField.CURRENT_RATIO_MRQ, StockField.QUICK_RATIO_MRQ,
-                       StockField.FREE_CASH_FLOW_TTM)
-            df = ss.get()
+            df = _run_screener("AMERICA" if is_us else "TAIWAN", _DETAIL_FIELDS, search=symbol)
         except:
             df = None
 
         if (df is None or df.empty) and is_tw:
-            ss_fuzzy = StockScreener()
-            ss_fuzzy.set_markets(tvs.Market.TAIWAN)
             try:
-                df_all = ss_fuzzy.get()
-                if not df_all.empty:
+                df_all = _run_screener("TAIWAN")
+                if df_all is not None and not df_all.empty:
                     mask = (df_all['Description'].str.contains(symbol, na=False, case=False)) | \
                            (df_all['Name'].str.contains(symbol, na=False, case=False))
                     df = df_all[mask]
@@ -563,6 +659,7 @@ class StockService:
 
     @staticmethod
     def _enrich_data(data):
+        # 全市場欄式表的批次版本見 batch_enrich.enrich_columns，公式變更時需同步修改
         roe = data.get('roe', 0)
         z_score = data.get('zScore', 0)
         debt = data.get('debtToEquity', 100)
@@ -595,6 +692,15 @@ class StockService:
             {"subject": "安全", "A": max(15, min(100, safe_val)), "desc": "財務結構與債信評估"},
             {"subject": "價值", "A": max(15, min(100, value_val)), "desc": "合理價折價與利潤空間"}
         ]
+
+        # 有市場百分位表時，雷達各維度改為個股在所屬市場的百分位（任一維度無法取得則整張圖沿用公式）
+        ranked = RadarPercentiles.values(market_of(data.get('symbol')), {
+            "momentum": momentum_val, "trend": trend_val, "size": size_metric(data),
+            "safety": safe_val, "value": value_val if price > 0 else None,
+        })
+        if ranked:
+            for item, value in zip(data['radarData'], ranked):
+                item["A"] = value
         
         t_price = data.get('targetPrice', 0)
         if t_price > 0:
@@ -611,11 +717,51 @@ class StockService:
 
     @staticmethod
     def _save_to_cache(symbol, data):
-        conn = get_db_connection()
-        if not conn: return
-        try:
-            cur = conn.cursor()
-            cur.execute("INSERT INTO stock_cache (symbol, data, updated_at) VALUES (%s, %s, NOW()) ON CONFLICT (symbol) DO UPDATE SET data = EXCLUDED.data, updated_at = NOW()", (symbol, json.dumps(data)))
-            conn.commit()
-            cur.close()
-        finally: return_db_connection(conn)
+        # [Optimization] Write-behind：入列後由 CacheWriter 合併並批次寫入 DB
+        CacheWriter.enqueue(symbol, data)
+        _cache_invalidate_prefix(f"detail_{symbol}_")
+
+    @staticmethod
+    def export_warm_state(hot_symbols=()):
+        """
+        匯出 warm-start 快照內容：熱門排行、個股詳情快取、市場狀態、名稱索引、雷達百分位表。
+        hot_symbols 中尚未在記憶體快取的個股會先載入一次。
+        """
+        from api.services.name_resolver import NameResolver
+        for symbol in hot_symbols:
+            StockService.get_stock_details(symbol)
+        with _CACHE_LOCK:
+            cache = {k: v['data'] for k, v in _MEMORY_CACHE.items() if k.startswith(('trending_', 'detail_'))}
+        return {
+            "cache": cache,
+            "regimes": _get_market_regime().export_state(),
+            "names": NameResolver.snapshot() if NameResolver.is_loaded() else {},
+            "percentiles": RadarPercentiles.export(),
+        }
+
+
+def _load_warm_start():
+    """
+    冷啟動時載入 warm-start 快照中的記憶體快取與市場狀態（名稱索引、雷達百分位表由各模組自行取用）。
+    快取資料以「即將過期」的時間戳寫入：立即可用，且首次讀取就觸發背景刷新。
+    """
+    from api.services.warm_start import section
+    t0 = time.perf_counter()
+    cache, created_at = section("cache")
+    regimes, _ = section("regimes")
+    if not cache and not regimes:
+        return
+
+    stale_ts = time.time() - (_CACHE_TTL - _CACHE_STALE) - 1
+    for key, data in (cache or {}).items():
+        if key not in _MEMORY_CACHE:
+            _cache_set(key, data, ts=stale_ts)
+
+    if regimes:
+        _get_market_regime().load_state(regimes, checked_at=created_at)
+
+    print(f"[WarmStart] Loaded {len(cache or {})} cache entries in {(time.perf_counter() - t0) * 1000:.1f}ms")
+
+
+_DETAIL_REFRESHING = set()
+_load_warm_start()
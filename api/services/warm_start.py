@@ -0,0 +1,94 @@
+"""
+Warm-start snapshot
+
+將記憶體快取（熱門排行、熱門個股詳情）、市場狀態、名稱索引與雷達百分位表序列化為單一 pickle 檔，
+容器冷啟動時以毫秒級載入，首個請求不必等待 DB 或 tvscreener。
+
+快照是部署產物（已列入 .gitignore）：package.json 的 build 在 `next build` 前執行
+`npm run warmup -- --optional`（scripts/warmup_cache.py），每次部署重新產生；
+產生失敗或檔案不存在時各模組照常由 DB 載入。
+
+快照只作為冷啟動的種子：記憶體快取以「即將過期」寫入、名稱索引 / 百分位表 / 市場狀態以快照時間
+作為載入時間，首次使用即在背景刷新（stale-while-revalidate）。因此快照不需每日更新，
+WARM_START_MAX_AGE 只用來排除久未部署、內容已無參考價值的檔案。
+
+每個程序只讀取一次檔案（section()），各使用者在第一次需要時各自取用對應區塊：
+stock_service（記憶體快取、市場狀態）、NameResolver（名稱索引）、RadarPercentiles（百分位表），
+因此不論請求先經過哪個路由都能使用快照。
+
+快照只包含純 Python 型別（dict / list / str / float），載入時不需要 pandas 等重量級模組。
+
+設定（環境變數）：
+- WARM_START_PATH：快照路徑（預設 api/warm_start.pkl）
+- WARM_START_MAX_AGE：快照最長有效秒數，超過則忽略（預設 604800，7 天）
+"""
+
+import os
+import time
+import pickle
+import threading
+from pathlib import Path
+
+SNAPSHOT_VERSION = 1
+_DEFAULT_PATH = Path(__file__).parent.parent / "warm_start.pkl"
+_MAX_AGE = float(os.environ.get("WARM_START_MAX_AGE", "604800"))
+
+_SNAPSHOT = None
+_SNAPSHOT_READ = False
+_SNAPSHOT_LOCK = threading.Lock()
+
+
+def snapshot_path():
+    return Path(os.environ.get("WARM_START_PATH", str(_DEFAULT_PATH)))
+
+
+def write_snapshot(state: dict, path=None) -> Path:
+    """原子寫入快照（先寫暫存檔再 rename，讀取端不會看到半份檔案）"""
+    target = Path(path) if path else snapshot_path()
+    target.parent.mkdir(parents=True, exist_ok=True)
+    payload = dict(state, version=SNAPSHOT_VERSION, created_at=time.time())
+    tmp = target.with_suffix(target.suffix + ".tmp")
+    with open(tmp, "wb") as f:
+        pickle.dump(payload, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp, target)
+    return target
+
+
+def read_snapshot(path=None, max_age=None):
+    """讀取快照；不存在、版本不符或過舊時回傳 None"""
+    target = Path(path) if path else snapshot_path()
+    max_age = _MAX_AGE if max_age is None else max_age
+    try:
+        with open(target, "rb") as f:
+            payload = pickle.load(f)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        print(f"[WarmStart] Failed to read snapshot {target}: {e}")
+        return None
+
+    if not isinstance(payload, dict) or payload.get("version") != SNAPSHOT_VERSION:
+        print(f"[WarmStart] Ignoring snapshot {target}: unsupported version")
+        return None
+    age = time.time() - payload.get("created_at", 0)
+    if age > max_age:
+        print(f"[WarmStart] Ignoring snapshot {target}: {age / 3600:.1f}h old")
+        return None
+    return payload
+
+
+def section(name):
+    """
+    本程序快照中的指定區塊（例如 "names"、"percentiles"）與快照建立時間：(data, created_at)。
+    檔案只在第一次呼叫時讀取；沒有快照或無此區塊時回傳 (None, None)。
+    """
+    global _SNAPSHOT, _SNAPSHOT_READ
+    if not _SNAPSHOT_READ:
+        with _SNAPSHOT_LOCK:
+            if not _SNAPSHOT_READ:
+                _SNAPSHOT = read_snapshot()
+                _SNAPSHOT_READ = True
+    snapshot = _SNAPSHOT
+    if not snapshot or not snapshot.get(name):
+        return None, None
+    return snapshot[name], snapshot.get("created_at")
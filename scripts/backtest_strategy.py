@@ -0,0 +1,51 @@
+"""
+以 daily_prices 與 stock_cache 回測目前的策略參數。
+
+Usage:
+    python scripts/backtest_strategy.py                      # TW，目前參數
+    python scripts/backtest_strategy.py --market US --days 730
+    python scripts/backtest_strategy.py --set rsi_threshold=55 --set top_n=20
+    python scripts/backtest_strategy.py --backfill           # 先補齊全市場日線，避免選樣偏差
+"""
+import sys
+import os
+import json
+import time
+import argparse
+
+# Add project root to path
+sys.path.append(os.getcwd())
+
+from api.services.backtester import Backtester
+
+
+def parse_overrides(items):
+    out = {}
+    for item in items:
+        key, _, value = item.partition("=")
+        out[key.strip()] = json.loads(value)
+    return out
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Backtest the growth_value strategy on stored daily history.")
+    parser.add_argument("--market", default="TW", choices=["TW", "US"])
+    parser.add_argument("--days", type=int, default=400, help="history window in calendar days")
+    parser.add_argument("--strategy", default="growth_value")
+    parser.add_argument("--set", dest="overrides", action="append", default=[], help="override a parameter, e.g. top_n=20")
+    parser.add_argument("--backfill", action="store_true", help="fetch missing daily history for the whole market first")
+    args = parser.parse_args()
+
+    data = Backtester.load_data(args.market, days=args.days, backfill=args.backfill)
+    if data is None:
+        print("No backtest data available (screener table or daily_prices is empty).")
+        sys.exit(1)
+
+    params = dict(Backtester.current_params(args.strategy), **parse_overrides(args.overrides))
+    t0 = time.perf_counter()
+    result = Backtester.evaluate(data, params)
+    elapsed = (time.perf_counter() - t0) * 1000
+    print(json.dumps({
+        "params": params, "result": result, "coverage": round(data.coverage, 4),
+        "elapsed_ms": round(elapsed, 1)
+    }, indent=2, ensure_ascii=False))
@@ -1,22 +1,61 @@
 import time
 import sys
 import os
+import json
+import argparse
+import subprocess
+import statistics
 
-def benchmark_import():
-    sys.path.append(os.getcwd())
-    start = time.time()
+# import api.index 時不應被載入的重量級模組（應只在對應路由內延遲載入）
+HEAVY_MODULES = ["pandas", "numpy", "yfinance", "tvscreener", "psycopg2", "requests"]
+
+_CHILD = """
+import json, sys, time
+start = time.perf_counter()
+import api.index
+duration = time.perf_counter() - start
+print(json.dumps({"duration": duration, "loaded": [m for m in %r if m in sys.modules]}))
+"""
+
+
+def measure_once(root):
+    """在全新的直譯器中量測，避免已載入模組影響結果"""
+    out = subprocess.run(
+        [sys.executable, "-c", _CHILD % (HEAVY_MODULES,)],
+        cwd=root, capture_output=True, text=True, check=True
+    )
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def benchmark_import(threshold=0.5, runs=3):
+    root = os.getcwd()
     print("Starting import benchmark for api.index...")
     try:
-        import api.index
-        end = time.time()
-        duration = end - start
-        print(f"Import api.index took: {duration:.4f} seconds")
-        if duration < 1.0:
-            print("SUCCESS: Startup latency is within acceptable limits (< 1s).")
-        else:
-            print("WARNING: Startup latency exceeds 1s. Further optimization may be needed.")
-    except Exception as e:
-        print(f"Import failed: {e}")
+        results = [measure_once(root) for _ in range(runs)]
+    except subprocess.CalledProcessError as e:
+        print(f"Import failed: {e.stderr.strip()}")
+        return 1
+
+    duration = statistics.median(r["duration"] for r in results)
+    loaded = sorted({m for r in results for m in r["loaded"]})
+    print(f"Import api.index took: {duration:.4f} seconds (median of {runs})")
+
+    failed = False
+    if duration >= threshold:
+        print(f"FAIL: Startup latency exceeds budget ({duration:.3f}s >= {threshold:.3f}s).")
+        failed = True
+    if loaded:
+        print(f"FAIL: Heavy modules imported eagerly: {', '.join(loaded)}")
+        failed = True
+    if not failed:
+        print(f"SUCCESS: Startup latency is within budget (< {threshold}s) and no heavy modules were loaded.")
+    return 1 if failed else 0
+
 
 if __name__ == "__main__":
-    benchmark_import()
+    parser = argparse.ArgumentParser(description="Import-time budget check for api.index.")
+    parser.add_argument("--threshold", type=float, default=float(os.environ.get("STARTUP_BUDGET_S", "0.5")),
+                        help="maximum allowed import time in seconds")
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+    sys.exit(benchmark_import(args.threshold, args.runs))
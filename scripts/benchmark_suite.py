@@ -0,0 +1,333 @@
+"""
+API hot-path benchmark suite
+
+離線執行：上游來源走 replay 模式（api.replay），資料庫以記憶體 stand-in 取代，
+因此量到的是本程式碼本身的 CPU / 序列化成本，結果可在不同機器與版本間比較。
+
+Usage:
+    python scripts/benchmark_suite.py                     # 全部
+    python scripts/benchmark_suite.py -k trending -n 500  # 篩選 + 次數
+    python scripts/benchmark_suite.py --json bench.json   # 輸出 JSON 供回歸追蹤
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import statistics
+import tempfile
+from datetime import datetime, timedelta, timezone
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+# 上游一律 replay，不連網；DB 不設定 DATABASE_URL，由 stand-in 提供
+os.environ.setdefault("UPSTREAM_MODE", "replay")
+os.environ.setdefault("UPSTREAM_FIXTURE_DIR", os.path.join(tempfile.gettempdir(), "twsv_bench_fixtures"))
+
+
+# ============================================================
+# Synthetic fixtures (deterministic)
+# ============================================================
+def make_history(rng, points=365, start_price=100.0):
+    out, price = [], start_price
+    day = datetime(2025, 1, 1)
+    for _ in range(points):
+        price = max(1.0, price * (1 + rng.gauss(0.0005, 0.02)))
+        out.append({
+            "Date": day.strftime("%Y-%m-%d"),
+            "Open": round(price * 0.99, 2), "High": round(price * 1.01, 2),
+            "Low": round(price * 0.98, 2), "Close": round(price, 2),
+            "Volume": float(rng.randint(100_000, 50_000_000))
+        })
+        day += timedelta(days=1)
+    return out
+
+
+def make_tvs_row(rng, symbol):
+    price = round(rng.uniform(10, 1000), 2)
+    return {
+        "Name": symbol, "Description": f"Company {symbol}", "Price": price,
+        "Change": round(rng.uniform(-5, 5), 2), "Change %": round(rng.uniform(-5, 5), 2),
+        "Volume": float(rng.randint(1_000_000, 80_000_000)),
+        "Market Capitalization": rng.uniform(1e9, 5e12),
+        "Technical Rating": rng.uniform(-1, 1), "Relative Strength Index (14)": rng.uniform(20, 80),
+        "Simple Moving Average (50)": price * rng.uniform(0.9, 1.1),
+        "Simple Moving Average (200)": price * rng.uniform(0.8, 1.2),
+        "Average True Range (14)": price * 0.02, "Relative Volume": rng.uniform(0.5, 3),
+        "Piotroski F-Score (TTM)": float(rng.randint(0, 9)),
+        "Gross Margin (TTM)": rng.uniform(0, 60), "Net Margin (TTM)": rng.uniform(-10, 40),
+        "Operating Margin (TTM)": rng.uniform(-10, 45), "Altman Z-Score (TTM)": rng.uniform(0, 8),
+        "Basic EPS (TTM)": rng.uniform(-2, 40), "Return on Equity (TTM)": rng.uniform(-10, 40),
+        "Return on Assets (TTM)": rng.uniform(-5, 20), "Debt to Equity Ratio (MRQ)": rng.uniform(0, 200),
+        "Revenue (TTM YoY Growth)": rng.uniform(-30, 60), "Target Price (Average)": price * rng.uniform(0.8, 1.4),
+        "Sector": "Electronic Technology", "Industry": "Semiconductors", "Exchange": "TWSE",
+    }
+
+
+def make_backtest_data(fx, days=300):
+    """每檔個股一條隨機漫步收盤價，搭配 fixtures 的基本面"""
+    import numpy as np
+    from api.services.backtester import Backtester
+    from api.services.screener import Screener, TEXT_FIELDS, NUMERIC_FIELDS
+    from api.services.batch_enrich import enrich_columns
+    rng = np.random.default_rng(42)
+    dates = np.datetime64("2025-01-01") + np.arange(days)
+    series = {s: {"dates": dates, "close": 100 * np.cumprod(1 + rng.normal(0.0005, 0.02, days))} for s in fx.symbols}
+    fundamentals = {
+        "fScore": {s: fx.docs[s].get("fScore", 0) for s in fx.symbols},
+        "epsGrowth": {s: rng.normal(10, 20) for s in fx.symbols},
+        "operatingMargin": {s: fx.docs[s].get("operatingMargin", 0) for s in fx.symbols},
+        "grossMargin": {s: fx.docs[s].get("grossMargin", 0) for s in fx.symbols},
+    }
+    return Backtester.build_data(series, fundamentals)
+
+
+class Fixtures:
+    def __init__(self, universe=300, seed=42):
+        from api.scrapers import process_tvs_row
+        from api.services.stock_service import StockService
+        rng = random.Random(seed)
+        self.rng = rng
+        self.symbols = [str(1101 + i * 7) for i in range(universe)]
+        self.names = {s: f"公司{s}" for s in self.symbols}
+        self.tvs_rows = {s: make_tvs_row(rng, s) for s in self.symbols}
+        self.docs = {}
+        for s in self.symbols:
+            doc = process_tvs_row(self.tvs_rows[s], s, self.names)
+            StockService._enrich_data(doc)
+            self.docs[s] = doc
+        self.history = make_history(rng)
+        self.hot_symbol = self.symbols[0]
+        self.docs[self.hot_symbol]["history_1y_1d"] = self.history
+
+
+# ============================================================
+# Postgres stand-in (只實作熱路徑會用到的查詢)
+# ============================================================
+class StandInCursor:
+    def __init__(self, db):
+        self.db = db
+        self._rows = []
+
+    def execute(self, sql, params=None):
+        if isinstance(sql, bytes):
+            sql = sql.decode("utf-8", "replace")
+        self._rows = self.db.query(" ".join(sql.split()), params)
+
+    def mogrify(self, template, args):
+        return b"()"
+
+    def fetchone(self):
+        return self._rows[0] if self._rows else None
+
+    def fetchall(self):
+        return list(self._rows)
+
+    def close(self):
+        pass
+
+
+class StandInConnection:
+    def __init__(self, db):
+        self.db = db
+
+    def cursor(self, cursor_factory=None):
+        return StandInCursor(self.db)
+
+    def commit(self): pass
+    def rollback(self): pass
+    def close(self): pass
+
+
+class StandInDB:
+    def __init__(self, fixtures):
+        self.fx = fixtures
+        self.by_volume = sorted(fixtures.docs.values(), key=lambda d: d.get("volume", 0), reverse=True)
+        self.writes = 0
+
+    def query(self, sql, params):
+        fx = self.fx
+        if sql.startswith("SELECT to_regclass('schema_migrations')"):
+            return [(True,)]
+        if sql.startswith("SELECT COALESCE(MAX(version), 0) FROM schema_migrations"):
+            from api.db import MIGRATIONS
+            return [(MIGRATIONS[-1][0],)]
+        if sql.startswith("SELECT data FROM stock_cache WHERE market"):
+            return [(d,) for d in self.by_volume[:15]]
+        if sql.startswith("SELECT c.data, c.updated_at, k.checked_at FROM stock_cache c"):
+            doc = fx.docs.get(params[0])
+            return [(json.loads(json.dumps(doc)), datetime.now(timezone.utc), None)] if doc else []
+        if sql.startswith("SELECT symbol, name, updated_at FROM stock_names"):
+            return [(s, n, datetime(2026, 1, 1)) for s, n in fx.names.items()]
+        if sql.startswith("SELECT symbol, data->>'price' FROM stock_cache"):
+            return [(s, str(fx.docs[s]["price"])) for s in params if s in fx.docs]
+        if sql.startswith("SELECT symbol, array_agg(date ORDER BY date), array_agg(close ORDER BY date) FROM daily_prices"):
+            since = params[1].isoformat()
+            rows = [h for h in fx.history if h["Date"] >= since]
+            dates = [datetime.strptime(h["Date"], "%Y-%m-%d").date() for h in rows]
+            closes = [h["Close"] for h in rows]
+            return [(s, dates, closes) for s in params[0] if s in fx.docs]
+        if sql.startswith("INSERT") or sql.startswith("UPDATE") or sql.startswith("DELETE"):
+            self.writes += 1
+        return []
+
+
+def install_stand_in(db):
+    """將所有已載入的 api.* 模組的 get_db_connection 換成 stand-in"""
+    import api.db
+    get_conn = lambda: StandInConnection(db)
+    put_conn = lambda conn: None
+    for name, module in list(sys.modules.items()):
+        if name == "api" or name.startswith("api."):
+            if hasattr(module, "get_db_connection"):
+                module.get_db_connection = get_conn
+            if hasattr(module, "return_db_connection"):
+                module.return_db_connection = put_conn
+
+
+# ============================================================
+# Runner
+# ============================================================
+def run_case(name, fn, setup=None, iterations=200, warmup=20):
+    for _ in range(warmup):
+        arg = setup() if setup else None
+        fn(arg)
+    samples = []
+    for _ in range(iterations):
+        arg = setup() if setup else None
+        t0 = time.perf_counter_ns()
+        fn(arg)
+        samples.append((time.perf_counter_ns() - t0) / 1e3)  # µs
+    samples.sort()
+    mean = statistics.fmean(samples)
+    return {
+        "name": name,
+        "iterations": iterations,
+        "mean_us": round(mean, 3),
+        "median_us": round(statistics.median(samples), 3),
+        "p95_us": round(samples[min(len(samples) - 1, int(len(samples) * 0.95))], 3),
+        "min_us": round(samples[0], 3),
+        "max_us": round(samples[-1], 3),
+        "ops_per_sec": round(1e6 / mean, 1) if mean > 0 else None,
+    }
+
+
+def build_cases(fx, db):
+    import pandas as pd
+    from api.scrapers import process_tvs_row, sanitize_json, calculate_rsi, history_to_records
+    from api.services import stock_service
+    from api.services.radar_percentiles import market_of
+    from api.services.stock_service import StockService
+    from api.services import performance_tracker
+    from api.services.performance_tracker import PerformanceTracker
+    from api.services.backtester import Backtester
+    from api.services.screener import Screener, TEXT_FIELDS, NUMERIC_FIELDS
+    from api.services.batch_enrich import enrich_columns
+
+    trending = db.by_volume[:10]
+    backtest_data = make_backtest_data(fx)
+    backtest_params = {"rsi_threshold": 60, "f_score_min": 5, "min_ma_window": 20,
+                       "weights": {"fScore": 0.4, "eps_growth": 0.3, "operating_margin": 0.2, "gross_margin": 0.1}}
+    hot_detail = dict(fx.docs[fx.hot_symbol], history=fx.history)
+    hist_df = pd.DataFrame(fx.history).set_index(pd.to_datetime([h["Date"] for h in fx.history]))
+    hist_df.index.name = "Date"
+    hist_df = hist_df.drop(columns=["Date"])
+
+    screen_rows = [
+        tuple(d.get(f) for f in TEXT_FIELDS[:2]) + (market_of(d["symbol"]), "", "", "") +
+        tuple(d.get(f) if isinstance(d.get(f), (int, float)) else None for f in NUMERIC_FIELDS)
+        for d in fx.docs.values()
+    ]
+    screen_table = Screener.build_table(screen_rows)
+
+    def trending_hit_setup():
+        stock_service._cache_set("trending_TW", trending)
+
+    def trending_miss_setup():
+        stock_service._MEMORY_CACHE.pop("trending_TW", None)
+
+    # 預測日落在 fixture 日線區間內，讓 1 / 5 / 14 日結算都能對上收盤價
+    stamps = [f"{h['Date']}T13:30:00" for h in fx.history[-120:-20]]
+
+    def tracker_setup():
+        preds = [{
+            "symbol": fx.symbols[i % len(fx.symbols)], "strategy_id": "growth_value",
+            "predicted_score": 6.0, "initial_price": 100.0, "details": {},
+            "timestamp": stamps[i % len(stamps)], "resolved": False,
+        } for i in range(500)]
+        performance_tracker._MEMORY_BUFFER = {"predictions": preds, "actuals": []}
+        performance_tracker._LOADED_AT = time.time()
+        performance_tracker._LAST_COMPACT_TIME = time.time()
+        performance_tracker._LAST_SETTLE_TIME = 0
+
+    return [
+        ("trending_cache_hit", lambda _: StockService.get_market_trending("TW"), trending_hit_setup),
+        ("trending_cache_miss_db", lambda _: StockService.get_market_trending("TW"), trending_miss_setup),
+        ("stock_details_cache_hit", lambda _: StockService.get_stock_details(fx.hot_symbol), None),
+        ("history_to_records_365", lambda _: history_to_records(hist_df, "1d", 365), None),
+        ("process_tvs_row", lambda _: process_tvs_row(fx.tvs_rows[fx.hot_symbol], fx.hot_symbol, fx.names), None),
+        ("enrich_data", lambda _: StockService._enrich_data(dict(fx.docs[fx.hot_symbol])), None),
+        ("enrich_data_universe", lambda _: [StockService._enrich_data(dict(d)) for d in fx.docs.values()], None),
+        ("enrich_columns_universe", lambda _: enrich_columns(screen_table.numeric, screen_table.text["market"], screen_table.percentiles), None),
+        ("sanitize_json_detail", lambda _: sanitize_json(hot_detail), None),
+        ("calculate_rsi_365", lambda _: calculate_rsi(fx.history), None),
+        ("tracker_settle_500", lambda _: PerformanceTracker.resolve_all_pending(), tracker_setup),
+        ("backtest_evaluate", lambda _: Backtester.evaluate(backtest_data, backtest_params), None),
+        ("serialize_trending", lambda _: json.dumps(trending).encode("utf-8"), None),
+        ("serialize_detail", lambda _: json.dumps(hot_detail).encode("utf-8"), None),
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark API hot paths offline.")
+    parser.add_argument("-k", "--filter", default="", help="only run cases whose name contains this text")
+    parser.add_argument("-n", "--iterations", type=int, default=200)
+    parser.add_argument("--warmup", type=int, default=20)
+    parser.add_argument("--universe", type=int, default=300, help="synthetic stock_cache size")
+    parser.add_argument("--json", dest="json_path", help="write results as JSON")
+    parser.add_argument("-v", "--verbose", action="store_true", help="keep application log output")
+    args = parser.parse_args()
+
+    out = sys.stdout
+    if not args.verbose:
+        # 應用程式的 print 日誌（含背景執行緒）會干擾量測與輸出
+        sys.stdout = open(os.devnull, "w")
+
+    import api.services.stock_service  # noqa: F401  (載入後再替換 DB)
+    import api.services.performance_tracker  # noqa: F401
+    import api.services.name_resolver  # noqa: F401
+    fx = Fixtures(universe=args.universe)
+    db = StandInDB(fx)
+    install_stand_in(db)
+
+    # 避免背景結算觸發反思寫入 evolution_state.json
+    from api.services.performance_tracker import PerformanceTracker
+    PerformanceTracker._check_and_trigger_evolution = staticmethod(lambda data: None)
+
+    results = []
+    for name, fn, setup in build_cases(fx, db):
+        if args.filter and args.filter not in name:
+            continue
+        res = run_case(name, fn, setup, args.iterations, args.warmup)
+        results.append(res)
+        print(f"{name:<28} median {res['median_us']:>11.1f} µs   p95 {res['p95_us']:>11.1f} µs   {res['ops_per_sec']:>10} ops/s", file=out, flush=True)
+
+    if args.json_path:
+        report = {
+            "timestamp": datetime.now().isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "iterations": args.iterations,
+            "universe": args.universe,
+            "results": results,
+        }
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {args.json_path}", file=out)
+
+
+if __name__ == "__main__":
+    main()
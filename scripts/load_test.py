@@ -0,0 +1,162 @@
+"""
+HTTP load generator for the API handler
+
+以接近真實儀表板的請求組合對 run_api.py（或任何部署網址）施壓：
+熱門排行、個股詳情、報價輪詢、投資組合 POST。
+回報整體與各端點的 throughput、p50/p95/p99 延遲與錯誤率。
+
+Usage:
+    python run_api.py &                                   # 先啟動本地 API（可搭配 UPSTREAM_MODE=replay）
+    python scripts/load_test.py -c 8 -d 30
+    python scripts/load_test.py --mix trending=50,quote=50 --json load.json
+"""
+
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+import urllib.request
+import urllib.error
+from datetime import datetime
+
+DEFAULT_MIX = "trending=35,detail=25,quote=30,portfolio=10"
+DEFAULT_SYMBOLS = "2330,2317,2454,2603,2881,2308,2382,0050,AAPL,NVDA"
+
+
+def build_request(kind, base_url, rng, symbols, user_id):
+    """回傳 (endpoint label, urllib Request)"""
+    if kind == "trending":
+        market = "TW" if rng.random() < 0.8 else "US"
+        return kind, urllib.request.Request(f"{base_url}/api/stock?trending=true&market={market}")
+    if kind == "detail":
+        symbol = rng.choice(symbols)
+        return kind, urllib.request.Request(f"{base_url}/api/stock?symbol={symbol}&period=1y&interval=1d")
+    if kind == "quote":
+        symbol = rng.choice(symbols)
+        return kind, urllib.request.Request(f"{base_url}/api/stock?action=get_quote&symbol={symbol}")
+    if kind == "portfolio":
+        action = "get_portfolio" if rng.random() < 0.7 else "get_portfolio_valuation"
+        body = json.dumps({"action": action, "user_id": user_id}).encode("utf-8")
+        return kind, urllib.request.Request(
+            f"{base_url}/api/index", data=body, method="POST",
+            headers={"Content-Type": "application/json"}
+        )
+    raise ValueError(f"Unknown request kind: {kind}")
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    idx = min(len(sorted_values) - 1, max(0, int(round(pct / 100 * len(sorted_values))) - 1))
+    return sorted_values[idx]
+
+
+def summarize(samples, elapsed):
+    latencies = sorted(s["ms"] for s in samples)
+    errors = sum(1 for s in samples if not s["ok"])
+    return {
+        "requests": len(samples),
+        "errors": errors,
+        "error_rate": round(errors / len(samples), 4) if samples else 0,
+        "throughput_rps": round(len(samples) / elapsed, 2) if elapsed > 0 else 0,
+        "p50_ms": round(percentile(latencies, 50), 2) if latencies else None,
+        "p95_ms": round(percentile(latencies, 95), 2) if latencies else None,
+        "p99_ms": round(percentile(latencies, 99), 2) if latencies else None,
+        "max_ms": round(latencies[-1], 2) if latencies else None,
+    }
+
+
+def worker(worker_id, args, kinds, weights, symbols, deadline, samples, lock):
+    rng = random.Random(args.seed + worker_id)
+    local = []
+    while time.time() < deadline:
+        kind = rng.choices(kinds, weights)[0]
+        label, req = build_request(kind, args.url.rstrip("/"), rng, symbols, args.user_id)
+        t0 = time.perf_counter()
+        ok, status = True, None
+        try:
+            with urllib.request.urlopen(req, timeout=args.timeout) as res:
+                status = res.status
+                body = res.read()
+            # handler 以 200 回傳 {"error": ...}，需檢查內容
+            try:
+                payload = json.loads(body)
+                if isinstance(payload, dict) and payload.get("error"):
+                    ok = False
+            except ValueError:
+                ok = False
+        except urllib.error.HTTPError as e:
+            ok, status = False, e.code
+        except Exception:
+            ok, status = False, None
+        local.append({"kind": label, "ms": (time.perf_counter() - t0) * 1000, "ok": ok, "status": status})
+        if args.think_ms:
+            time.sleep(rng.uniform(0, args.think_ms) / 1000)
+    with lock:
+        samples.extend(local)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test the stock API handler.")
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("-c", "--concurrency", type=int, default=4)
+    parser.add_argument("-d", "--duration", type=float, default=20, help="seconds")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="kind=weight,... (trending, detail, quote, portfolio)")
+    parser.add_argument("--symbols", default=DEFAULT_SYMBOLS)
+    parser.add_argument("--user-id", default="00000000-0000-0000-0000-000000000000")
+    parser.add_argument("--think-ms", type=float, default=0, help="random pause up to N ms between requests")
+    parser.add_argument("--timeout", type=float, default=15)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", dest="json_path", help="write report as JSON")
+    args = parser.parse_args()
+
+    mix = {}
+    for part in args.mix.split(","):
+        kind, _, weight = part.partition("=")
+        mix[kind.strip()] = float(weight or 1)
+    kinds, weights = list(mix), list(mix.values())
+    symbols = [s.strip() for s in args.symbols.split(",") if s.strip()]
+
+    print(f"Load test: {args.url} | concurrency={args.concurrency} duration={args.duration}s mix={mix}")
+    samples, lock = [], threading.Lock()
+    start = time.time()
+    deadline = start + args.duration
+    threads = [
+        threading.Thread(target=worker, args=(i, args, kinds, weights, symbols, deadline, samples, lock), daemon=True)
+        for i in range(args.concurrency)
+    ]
+    for t in threads: t.start()
+    for t in threads: t.join()
+    elapsed = time.time() - start
+
+    report = {
+        "timestamp": datetime.now().isoformat(),
+        "url": args.url,
+        "concurrency": args.concurrency,
+        "duration_s": round(elapsed, 2),
+        "mix": mix,
+        "overall": summarize(samples, elapsed),
+        "by_kind": {k: summarize([s for s in samples if s["kind"] == k], elapsed) for k in kinds},
+    }
+
+    def row(label, r):
+        return (f"{label:<10} {r['requests']:>7} req  {r['throughput_rps']:>8} rps  "
+                f"p50 {r['p50_ms']} ms  p95 {r['p95_ms']} ms  p99 {r['p99_ms']} ms  err {r['error_rate']:.2%}")
+
+    print(row("overall", report["overall"]))
+    for k, r in report["by_kind"].items():
+        if r["requests"]:
+            print(row(k, r))
+
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Report written to {args.json_path}")
+
+    return 1 if report["overall"]["requests"] == 0 else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,29 @@
+"""
+套用資料庫 schema migration（部署步驟）。
+
+API 請求路徑不會執行 migration；每次部署新版本前（或 schema 變更後）執行一次：
+    python scripts/migrate_db.py
+
+package.json 的 build（npm run build）會先執行此腳本，migration 失敗時建置失敗、不會部署。
+未設定 DATABASE_URL（如本機或無 DB 的 preview 建置）時略過並正常結束。
+"""
+import sys
+import os
+from datetime import datetime
+
+# Add project root to path
+sys.path.append(os.getcwd())
+
+from api.db import init_db, load_env_if_needed, MIGRATIONS
+
+if __name__ == "__main__":
+    load_env_if_needed()
+    if not os.environ.get("DATABASE_URL"):
+        print(f"[{datetime.now()}] DATABASE_URL not set, skipping migrations.")
+        sys.exit(0)
+    print(f"[{datetime.now()}] Applying migrations (latest version {MIGRATIONS[-1][0]})...")
+    applied = init_db()
+    if applied is None:
+        print(f"[{datetime.now()}] Migration failed.")
+        sys.exit(1)
+    print(f"[{datetime.now()}] Applied {len(applied)} migrations: {applied or 'already up to date'}")
@@ -0,0 +1,64 @@
+"""
+策略參數搜尋：以回測平行評估一批候選參數，最佳者在訓練區間與樣本外區間都勝過目前參數時升級
+（寫入 strategy_config.json 與 evolution_state.json 並遞增策略版本）。
+搜尋會 fork process pool，只由此 CLI 執行，不在 API 的反思流程中觸發。
+
+Usage:
+    python scripts/search_strategy.py                        # 依 mutation_config.search 設定
+    python scripts/search_strategy.py --population 256 --workers 8
+    python scripts/search_strategy.py --dry-run              # 只顯示結果，不寫檔
+    python scripts/search_strategy.py --backfill             # 先補齊全市場日線，避免選樣偏差
+"""
+import sys
+import os
+import json
+import argparse
+
+# Add project root to path
+sys.path.append(os.getcwd())
+
+from api.services.reflection_engine import ReflectionEngine, SEARCH_DEFAULTS
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Search strategy parameters against the backtester.")
+    parser.add_argument("--strategy", default="growth_value")
+    parser.add_argument("--population", type=int, help="number of candidates (including the current parameters)")
+    parser.add_argument("--workers", type=int, help="process pool size (0 = all cores, 1 = serial)")
+    parser.add_argument("--market", choices=["TW", "US"])
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--holdout", type=float, help="fraction of the most recent days kept for the out-of-sample check")
+    parser.add_argument("--dry-run", action="store_true", help="do not write config or state")
+    parser.add_argument("--backfill", action="store_true", help="fetch missing daily history for the whole market first")
+    args = parser.parse_args()
+
+    config = ReflectionEngine.load_config()
+    search = config.setdefault("mutation_config", {}).setdefault("search", {})
+    for key in ("population", "workers", "market", "holdout"):
+        if getattr(args, key) is not None:
+            search[key] = getattr(args, key)
+
+    data = None
+    if args.backfill:
+        from api.services.backtester import Backtester
+        search = dict(SEARCH_DEFAULTS, **search)
+        data = Backtester.load_data(search["market"], days=search["history_days"], backfill=True)
+
+    state = ReflectionEngine.load_state()
+    record = ReflectionEngine.search_parameters(
+        args.strategy, state=state, config=config, save=False, seed=args.seed, data=data
+    )
+    if record is None:
+        print("Parameter search skipped (unknown strategy or no backtest data).")
+        sys.exit(1)
+
+    if not args.dry_run:
+        # CLI 覆寫的搜尋設定不寫回設定檔
+        saved = ReflectionEngine.load_config()
+        if record["promoted"]:
+            saved["strategies"][args.strategy] = config["strategies"][args.strategy]
+            ReflectionEngine._bump_version(state, minor=True)
+            record["version"] = state["version"]
+            ReflectionEngine.save_config(saved)
+            ReflectionEngine.log_promotion(args.strategy, record)
+        ReflectionEngine.save_state(state)
+    print(json.dumps(record, indent=2, ensure_ascii=False))
@@ -0,0 +1,42 @@
+"""
+預測結算批次作業：先補齊待結算個股的日線（daily_prices），再以收盤價一次結算
+所有到期預測的 1 / 5 / 14 個交易日報酬。部署環境由 vercel.json 的 cron 呼叫 /api/cron/settle 執行同一流程，
+但補抓受單次請求的時間預算限制（CRON_FETCH_BUDGET）；積壓較多時以此腳本完整補抓。
+
+Usage:
+    python scripts/settle_predictions.py              # 補齊日線 + 結算
+    python scripts/settle_predictions.py --no-fetch   # 只用 DB 既有日線結算
+"""
+import sys
+import os
+import argparse
+from datetime import datetime
+
+# Add project root to path
+sys.path.append(os.getcwd())
+
+from api.services.performance_tracker import PerformanceTracker
+
+
+def settle(fetch=True):
+    symbols = PerformanceTracker.pending_symbols()
+    print(f"[{datetime.now()}] {len(symbols)} symbols with pending predictions")
+    if not symbols:
+        return 0
+
+    settled = PerformanceTracker.settle_from_history(symbols, fetch=fetch)
+    if not PerformanceTracker.flush():
+        print(f"[{datetime.now()}] Warning: results were not persisted (DB unavailable or migration 9 missing)")
+    summary = PerformanceTracker.get_summary()
+    print(f"[{datetime.now()}] Settled {settled} predictions "
+          f"({summary['resolved']} resolved / {summary['pending']} pending)")
+    for h, stats in summary["horizon_stats"].items():
+        print(f"  {h:>2}d: accuracy={stats['accuracy']} avg_return={stats['avg_return']} n={stats['sample_size']}")
+    return settled
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Settle pending predictions against stored daily closes.")
+    parser.add_argument("--no-fetch", action="store_true", help="do not refresh daily history before settling")
+    args = parser.parse_args()
+    settle(fetch=not args.no_fetch)
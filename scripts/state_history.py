@@ -0,0 +1,39 @@
+"""
+策略設定 / 進化狀態的版本歷史與還原。
+
+Usage:
+    python scripts/state_history.py                          # 列出兩個檔案的歷史版本
+    python scripts/state_history.py --rollback config        # strategy_config.json 還原到上一版
+    python scripts/state_history.py --rollback state --version 20260301T020000000000
+"""
+import sys
+import os
+import argparse
+
+# Add project root to path
+sys.path.append(os.getcwd())
+
+from api.services.state_store import STRATEGY_CONFIG, EVOLUTION_STATE
+
+STORES = {"config": STRATEGY_CONFIG, "state": EVOLUTION_STATE}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="List or roll back versions of the strategy config and evolution state.")
+    parser.add_argument("--rollback", choices=sorted(STORES), help="restore a previous version of this file")
+    parser.add_argument("--version", help="version id to restore (default: the version before the last write)")
+    args = parser.parse_args()
+
+    if args.rollback:
+        store = STORES[args.rollback]
+        restored = store.rollback(args.version)
+        if restored is None:
+            print(f"No matching version to restore for {store.path.name}.")
+            sys.exit(1)
+        print(f"Restored {store.path.name} to version {restored}")
+        sys.exit(0)
+
+    for name, store in STORES.items():
+        versions = store.versions()
+        print(f"{store.path.name} ({len(versions)} versions in {store.history_dir})")
+        for v in versions:
+            print(f"  {v['id']}  saved {v['saved_at']}")
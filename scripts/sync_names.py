@@ -1,10 +1,13 @@
 
 import os
 import sys
+import json
+import hashlib
 import twstock
 import requests
 import pandas as pd
 from io import StringIO
+from psycopg2.extras import execute_values
 
 # Add parent directory to path
 current_dir = os.path.dirname(os.path.abspath(__file__))
@@ -23,9 +26,12 @@ except Exception as e:
 
 from api.db import get_db_connection, return_db_connection
 
-def fetch_isin_stocks(mode=5):
+# 來源套用順序：後面的來源覆蓋前面的同代號名稱
+SOURCES = ["twstock", "isin_5", "isin_2", "isin_4"]
+
+def fetch_isin_page(mode=5):
     """
-    Fetch stocks from TWSE ISIN website.
+    Fetch raw HTML from TWSE ISIN website.
     Mode 2: Listed (上市)
     Mode 4: OTC (上櫃)
     Mode 5: Emerging (興櫃)
@@ -33,87 +39,118 @@ def fetch_isin_stocks(mode=5):
     url = f"https://isin.twse.com.tw/isin/C_public.jsp?strMode={mode}"
     try:
         res = requests.get(url)
+        res.raise_for_status()
         res.encoding = 'ms950' 
-        
-        dfs = pd.read_html(StringIO(res.text))
-        if not dfs: return {}
-        
-        df = dfs[0]
-        df.columns = df.iloc[0]
-        df = df[1:]
-        
-        stock_dict = {}
-        for index, row in df.iterrows():
-            try:
-                code_name = str(row.iloc[0])
-                parts = code_name.split()
-                if len(parts) >= 2:
-                    code = parts[0]
-                    name = parts[1]
-                    stock_dict[code] = name
-                    
-                    if len(code) == 5 and code.startswith('0'):
-                        alias = code[1:]
-                        if alias not in stock_dict:
-                            stock_dict[alias] = name
-            except:
-                continue
-        return stock_dict
+        return res.text
     except Exception as e:
         print(f"Error fetching ISIN mode {mode}: {e}")
+        return None
+
+def parse_isin_page(html):
+    """Parse an ISIN page into {code: name}（向量化處理，不逐列 iterrows）"""
+    dfs = pd.read_html(StringIO(html))
+    if not dfs: return {}
+    
+    # 第一欄為「代號　名稱」（全形空白分隔），分類標題列只有一段文字會被略過
+    parts = dfs[0].iloc[1:, 0].astype(str).str.split(n=1)
+    stock_dict = {}
+    for p in parts:
+        if len(p) >= 2:
+            stock_dict[p[0]] = p[1].strip()
+    
+    # 5 碼且以 0 開頭的代號（如 00878）另建 4 碼別名
+    for code in [c for c in stock_dict if len(c) == 5 and c.startswith('0')]:
+        stock_dict.setdefault(code[1:], stock_dict[code])
+    return stock_dict
+
+def fetch_isin_stocks(mode=5):
+    """Fetch and parse stocks from TWSE ISIN website."""
+    html = fetch_isin_page(mode)
+    if html is None:
+        return {}
+    try:
+        return parse_isin_page(html)
+    except Exception as e:
+        print(f"Error parsing ISIN mode {mode}: {e}")
         return {}
 
-def sync_stock_names():
+def load_source(source):
+    """
+    回傳 (content, parser)；content 為 None 代表來源抓取失敗。
+    twstock 為本地套件資料，內容即已解析好的 dict。
+    """
+    if source == "twstock":
+        try:
+            names = {code: stock.name for code, stock in twstock.codes.items() if stock.type in ['股票', 'ETF']}
+            return json.dumps(names, sort_keys=True, ensure_ascii=False), json.loads
+        except Exception as e:
+            print(f"Error loading from twstock: {e}")
+            return None, None
+    mode = int(source.split("_")[1])
+    return fetch_isin_page(mode), parse_isin_page
+
+def sync_stock_names(force=False):
     conn = get_db_connection()
     if not conn:
         print("Database connection failed.")
         return
 
     print("Starting stock names sync...")
-    names = {}
-    
-    # 1. Base: twstock (Listed + OTC)
-    print("Loading from twstock...", flush=True)
     try:
-        for code, stock in twstock.codes.items():
-            if stock.type in ['股票', 'ETF']:
-                names[code] = stock.name
-    except Exception as e:
-        print(f"Error loading from twstock: {e}")
+        cur = conn.cursor()
+        cur.execute("SELECT source, content_hash, entries FROM name_sync_state")
+        state = {r[0]: (r[1], r[2]) for r in cur.fetchall()}
 
-    # 2. Extension: Emerging Stocks (興櫃) from ISIN Mode 5
-    print("Fetching Emerging stocks from ISIN...", flush=True)
-    emerging = fetch_isin_stocks(5)
-    print(f"Fetched {len(emerging)} emerging stocks.", flush=True)
-    names.update(emerging)
-    
-    # 3. Listed/OTC from ISIN (Refresher)
-    print("Fetching Listed/OTC updates from ISIN...", flush=True)
-    listed = fetch_isin_stocks(2)
-    otc = fetch_isin_stocks(4)
-    names.update(listed)
-    names.update(otc)
+        # 1. 逐一來源比對內容雜湊，只有變動的來源才重新解析
+        merged, changed_states, complete = {}, [], True
+        for source in SOURCES:
+            print(f"Loading {source}...", flush=True)
+            content, parser = load_source(source)
+            if content is None:
+                complete = False
+                entries = state.get(source, (None, {}))[1]
+                print(f"  -> fetch failed, reusing last synced entries ({len(entries)})")
+            else:
+                content_hash = hashlib.sha256(content.encode('utf-8')).hexdigest()
+                if not force and source in state and state[source][0] == content_hash:
+                    entries = state[source][1]
+                    print(f"  -> unchanged ({len(entries)} entries)")
+                else:
+                    entries = parser(content)
+                    changed_states.append((source, content_hash, json.dumps(entries, ensure_ascii=False)))
+                    print(f"  -> changed, parsed {len(entries)} entries")
+            merged.update(entries)
 
-    print(f"Total unique stocks found: {len(names)}")
+        if not changed_states:
+            print("No source changed. Sync skipped.")
+            cur.close()
+            return
 
-    # Batch Insert/Upsert
-    try:
-        cur = conn.cursor()
-        # Prepare list of tuples
-        data_tuples = [(code, name, 'STOCK') for code, name in names.items()]
-        
-        # Use execute_values for speed if available, or just loop for simplicity in this scale
-        # Upsert: ON CONFLICT DO UPDATE
-        upsert_query = """
-            INSERT INTO stock_names (symbol, name, type, updated_at)
-            VALUES (%s, %s, %s, NOW())
-            ON CONFLICT (symbol) DO UPDATE 
-            SET name = EXCLUDED.name, updated_at = NOW();
-        """
-        
-        print("Upserting to database...", flush=True)
-        # Using executemany for batch performance
-        cur.executemany(upsert_query, data_tuples)
+        print(f"Total unique stocks found: {len(merged)}")
+
+        # 2. 與目前資料表比對，只寫入新增/變更的代號
+        cur.execute("SELECT symbol, name FROM stock_names")
+        current = dict(cur.fetchall())
+        upserts = [(code, name, 'STOCK') for code, name in merged.items() if current.get(code) != name]
+        # 任何來源抓取失敗時不刪除，避免暫時性錯誤清空資料表
+        deletes = [code for code in current if code not in merged] if complete else []
+
+        print(f"Applying diff: {len(upserts)} upserts, {len(deletes)} deletes", flush=True)
+        if upserts:
+            execute_values(cur, """
+                INSERT INTO stock_names (symbol, name, type, updated_at)
+                VALUES %s
+                ON CONFLICT (symbol) DO UPDATE 
+                SET name = EXCLUDED.name, updated_at = NOW();
+            """, upserts, template="(%s, %s, %s, NOW())", page_size=1000)
+        if deletes:
+            cur.execute("DELETE FROM stock_names WHERE symbol = ANY(%s)", (deletes,))
+        execute_values(cur, """
+            INSERT INTO name_sync_state (source, content_hash, entries, synced_at)
+            VALUES %s
+            ON CONFLICT (source) DO UPDATE
+            SET content_hash = EXCLUDED.content_hash, entries = EXCLUDED.entries, synced_at = NOW();
+        """, changed_states, template="(%s, %s, %s::jsonb, NOW())")
         conn.commit()
         print("Sync complete.")
         cur.close()
@@ -124,4 +161,4 @@ def sync_stock_names():
         return_db_connection(conn)
 
 if __name__ == "__main__":
-    sync_stock_names()
+    sync_stock_names(force='--force' in sys.argv)
@@ -1,27 +1,75 @@
+"""
+預熱快取並產生 warm-start 快照（api/warm_start.pkl）。
+
+package.json 的 build 以 --optional 執行：每次部署都會重新產生快照；
+無法產生（無 DB、上游失敗、建置環境缺少相依套件）時只記錄警告，不讓建置失敗。
+
+Usage:
+    python scripts/warmup_cache.py                    # 預熱 + 寫入快照
+    python scripts/warmup_cache.py --symbols 2330,2317
+    python scripts/warmup_cache.py --optional         # 失敗時仍以 0 結束（建置步驟）
+"""
 import sys
 import os
+import argparse
 from datetime import datetime
 
 # Add project root to path
 sys.path.append(os.getcwd())
 
-from api.services.stock_service import StockService
-from api.db import get_db_connection, return_db_connection
+from api.services.warm_start import write_snapshot, snapshot_path
 
-def warmup():
+def warmup(hot_symbols=(), snapshot=True, path=None):
+    from api.services.stock_service import StockService
     print(f"[{datetime.now()}] Starting Market Data Warmup...")
-    
+
     # 1. Warmup TW market
     print(f"[{datetime.now()}] Warming up TW Trending stocks...")
     tw_stocks = StockService.get_market_trending("TW")
     print(f"[{datetime.now()}] TW Warmup complete. Found {len(tw_stocks)} stocks.")
-    
+
     # 2. Warmup US market
     print(f"[{datetime.now()}] Warming up US Trending stocks...")
     us_stocks = StockService.get_market_trending("US")
     print(f"[{datetime.now()}] US Warmup complete. Found {len(us_stocks)} stocks.")
-    
+
+    if snapshot:
+        # 3. Warm-start snapshot：市場狀態、名稱索引與熱門個股詳情
+        print(f"[{datetime.now()}] Building warm-start snapshot...")
+        StockService.refresh_market_regimes()
+        # 全市場欄式表重新載入時會一併重建雷達百分位表
+        from api.services.screener import Screener
+        Screener.reload()
+        from api.services.name_resolver import NameResolver
+        NameResolver.ensure_loaded()
+
+        symbols = list(dict.fromkeys(
+            list(hot_symbols) + [s.get('symbol') for s in (tw_stocks or []) + (us_stocks or []) if s.get('symbol')]
+        ))
+        state = StockService.export_warm_state(symbols)
+        target = write_snapshot(state, path)
+        size_kb = os.path.getsize(target) / 1024
+        print(f"[{datetime.now()}] Snapshot written to {target} "
+              f"({len(state['cache'])} cache entries, {len(state['names'])} names, "
+              f"{len(state['percentiles'])} percentile markets, {size_kb:.0f} KB)")
+
     print(f"[{datetime.now()}] Warmup sequence finished.")
 
 if __name__ == "__main__":
-    warmup()
+    parser = argparse.ArgumentParser(description="Warm caches and write the warm-start snapshot.")
+    parser.add_argument("--symbols", default="", help="extra hot symbols, comma separated (e.g. 2330,2317)")
+    parser.add_argument("--snapshot", default=None, help=f"snapshot path (default {snapshot_path()})")
+    parser.add_argument("--no-snapshot", action="store_true", help="only warm the caches")
+    parser.add_argument("--optional", action="store_true", help="exit 0 on failure (build step)")
+    args = parser.parse_args()
+    try:
+        warmup(
+            hot_symbols=[s.strip().upper() for s in args.symbols.split(",") if s.strip()],
+            snapshot=not args.no_snapshot,
+            path=args.snapshot
+        )
+    except Exception as e:
+        print(f"[{datetime.now()}] Warmup failed: {e}")
+        if not args.optional:
+            raise
+        print(f"[{datetime.now()}] Continuing without a warm-start snapshot.")
@@ -8,15 +8,66 @@ export interface SearchProps extends React.InputHTMLAttributes<HTMLInputElement>
     onSearch: (value: string) => void
 }
 
+interface Suggestion {
+    symbol: string
+    name: string
+}
+
 const StockSearch = React.forwardRef<HTMLInputElement, SearchProps>(
     ({ className, onSearch, ...props }, ref) => {
         const [value, setValue] = React.useState("")
+        const [suggestions, setSuggestions] = React.useState<Suggestion[]>([])
+        // Set on select: the value change it causes must not reopen the dropdown
+        const skipNextFetch = React.useRef(false)
+        // Bumped on select/submit so responses already in flight are dropped
+        const generation = React.useRef(0)
+
+        // Debounced autocomplete against the in-memory name index (/api/search)
+        React.useEffect(() => {
+            if (skipNextFetch.current) {
+                skipNextFetch.current = false
+                return
+            }
+            const q = value.trim()
+            if (!q) {
+                setSuggestions([])
+                return
+            }
+            const requested = generation.current
+            const controller = new AbortController()
+            const timer = setTimeout(async () => {
+                try {
+                    const res = await fetch(`/api/search?q=${encodeURIComponent(q)}&limit=8`, { signal: controller.signal })
+                    const data = await res.json()
+                    if (generation.current !== requested) return
+                    setSuggestions(Array.isArray(data.results) ? data.results : [])
+                } catch (e) {
+                    // Aborted or offline: keep plain search working
+                }
+            }, 150)
+            return () => {
+                clearTimeout(timer)
+                controller.abort()
+            }
+        }, [value])
 
         const handleSubmit = (e: React.FormEvent) => {
             e.preventDefault()
+            generation.current += 1
+            setSuggestions([])
             onSearch(value)
         }
 
+        const handleSelect = (s: Suggestion) => {
+            generation.current += 1
+            if (s.symbol !== value) {
+                skipNextFetch.current = true
+                setValue(s.symbol)
+            }
+            setSuggestions([])
+            onSearch(s.symbol)
+        }
+
         return (
             <form onSubmit={handleSubmit} className={cn("relative w-full max-w-lg group", className)}>
                 <div className="absolute inset-0 -z-10 rounded-xl bg-gradient-to-r from-primary/20 via-accent/20 to-primary/20 opacity-0 blur-xl transition-opacity duration-500 group-focus-within:opacity-100" />
@@ -32,6 +83,23 @@ const StockSearch = React.forwardRef<HTMLInputElement, SearchProps>(
                     onChange={(e) => setValue(e.target.value)}
                     {...props}
                 />
+                {suggestions.length > 0 && (
+                    <ul className="absolute left-0 right-0 top-full z-20 mt-2 overflow-hidden rounded-xl border border-input/50 bg-background/95 shadow-lg backdrop-blur-md">
+                        {suggestions.map((s) => (
+                            <li key={s.symbol}>
+                                <button
+                                    type="button"
+                                    className="flex w-full items-center justify-between px-4 py-2 text-left text-sm hover:bg-primary/10"
+                                    onMouseDown={(e) => e.preventDefault()}
+                                    onClick={() => handleSelect(s)}
+                                >
+                                    <span className="font-mono">{s.symbol}</span>
+                                    <span className="text-muted-foreground">{s.name}</span>
+                                </button>
+                            </li>
+                        ))}
+                    </ul>
+                )}
             </form>
         )
     }
@@ -0,0 +1,76 @@
+import copy
+from datetime import date, timedelta
+
+import numpy as np
+import pytest
+
+from api.services.backtester import Backtester, BacktestData
+from api.services.reflection_engine import ReflectionEngine
+
+T, N = 300, 60
+PARAMS = {"rsi_threshold": 60, "f_score_min": 4, "min_ma_window": 20, "holding_days": 5, "top_n": 10,
+          "weights": {"fScore": 0.5, "roe": 0.5}}
+
+
+def make_series(seed=1):
+    rng = np.random.default_rng(seed)
+    days = np.array([date(2024, 1, 1) + timedelta(days=i) for i in range(T)], dtype="datetime64[D]")
+    return {
+        f"S{i}": {"dates": days, "close": 100 * np.exp(np.cumsum(rng.normal(0, 0.02, T)))}
+        for i in range(N)
+    }
+
+
+def make_data(series, seed=1):
+    rng = np.random.default_rng(seed + 100)
+    fundamentals = {
+        "fScore": {s: float(v) for s, v in zip(series, rng.integers(0, 10, N))},
+        "roe": {s: float(v) for s, v in zip(series, rng.normal(10, 5, N))},
+    }
+    return Backtester.build_data(series, fundamentals, list(series))
+
+
+def with_future_changed(data, split, seed=9):
+    """split 之後的收盤價整段換掉（之前不變）"""
+    rng = np.random.default_rng(seed)
+    close = data.close.copy()
+    close[split:] *= np.exp(rng.normal(0, 0.3, close[split:].shape))
+    return BacktestData(data.symbols, data.dates, close, data.fundamentals, universe=data.universe)
+
+
+@pytest.mark.parametrize("split", (120, 210, 250))
+def test_training_window_ignores_prices_from_the_holdout(split):
+    data = make_data(make_series())
+    changed = with_future_changed(data, split)
+    train = Backtester.evaluate(data, PARAMS, stop=split)
+    assert train["trades"] > 0
+    assert Backtester.evaluate(changed, PARAMS, stop=split) == train
+    # 同一份資料的樣本外結果確實會隨後段價格改變
+    assert Backtester.evaluate(changed, PARAMS, start=split) != Backtester.evaluate(data, PARAMS, start=split)
+
+
+def test_training_and_holdout_periods_do_not_overlap():
+    data = make_data(make_series())
+    split, horizon = 210, PARAMS["holding_days"]
+    train = Backtester.evaluate(data, PARAMS, stop=split)
+    holdout = Backtester.evaluate(data, PARAMS, start=split)
+    # 訓練區間最後一期的持有期必須在 split 之前結束
+    assert train["periods"] == len(range(19, split - horizon, horizon))
+    assert holdout["periods"] == len(range(split, T - horizon, horizon))
+
+
+def test_search_ranks_candidates_only_on_the_training_window():
+    state, config = ReflectionEngine.load_state(), ReflectionEngine.load_config()
+    config.setdefault("mutation_config", {})["search"] = {"workers": 1, "population": 16, "min_trades": 5}
+    data = make_data(make_series())
+    split = int(T * (1 - 0.3))
+    records = [
+        ReflectionEngine.search_parameters("growth_value", state=copy.deepcopy(state), config=copy.deepcopy(config),
+                                           save=False, seed=3, data=d)
+        for d in (data, with_future_changed(data, split))
+    ]
+    assert records[0]["split_date"] == str(data.dates[split])
+    # 樣本內的選擇（最佳候選與其訓練區間結果）與後段價格無關
+    for key in ("params", "result", "fitness"):
+        assert records[0]["best"][key] == records[1]["best"][key]
+        assert records[0]["baseline"][key] == records[1]["baseline"][key]
@@ -0,0 +1,114 @@
+import copy
+import math
+import random
+
+import numpy as np
+import pytest
+
+from api.services import radar_percentiles
+from api.services.batch_enrich import RADAR_COLUMNS, enrich_columns
+from api.services.radar_percentiles import RadarPercentiles, market_of
+from api.services.screener import NUMERIC_FIELDS, Screener
+from api.services.stock_service import StockService
+
+ENRICH_KEYS = ("roe", "zScore", "debtToEquity", "revGrowth", "fScore", "price", "technicalRating",
+               "grahamNumber", "grossMargin", "sma50", "targetPrice", "atr", "marketCapValue")
+EDGE_VALUES = (0, 0.0, 1, -1, 15, 100, 150, 2.5, 0.5, 1.2, 8, 20, -10, 5, 6, 4, 1e-9)
+
+
+def random_doc(rng):
+    """stock_cache 文件：欄位可能缺少，存在時為有限數值（sanitize_json 之後不含 NaN）"""
+    symbol = str(rng.randint(1000, 9999)) if rng.random() < 0.5 else rng.choice("ABCDEFGH") + str(rng.randint(0, 999))
+    doc = {"symbol": symbol, "name": symbol}
+    for key in ENRICH_KEYS:
+        roll = rng.random()
+        if roll < 0.1:
+            continue
+        if roll < 0.3:
+            doc[key] = rng.choice(EDGE_VALUES)
+        elif roll < 0.45:
+            doc[key] = rng.randint(-50, 300)
+        else:
+            doc[key] = rng.uniform(-50, 300)
+    if rng.random() < 0.3:
+        doc["marketCap"] = rng.choice([rng.uniform(1e6, 1e13), rng.randint(0, 10 ** 12)])
+    else:
+        doc["marketCap"] = rng.choice(["1.2兆", "350億", "N/A"])
+    # _enrich_data 在 price == 0 且有目標價時會拋出 ZeroDivisionError，不屬於比較範圍
+    if doc.get("price") == 0 and doc.get("targetPrice", 0) > 0:
+        doc["targetPrice"] = 0
+    return doc
+
+
+def screen_row(doc):
+    """與 Screener.reload 的查詢相同：非數值欄位為 NULL"""
+    numeric = [doc.get(f) if isinstance(doc.get(f), (int, float)) else None for f in NUMERIC_FIELDS]
+    return (doc["symbol"], doc["name"], market_of(doc["symbol"]), "", "", "", *numeric)
+
+
+def assert_same(doc, text, numeric, i):
+    assert text["healthLabel"][i] == doc["healthLabel"]
+    assert text["growthProjection"][i] == doc["growthProjection"]
+    assert text["predictionConfidence"][i] == doc["prediction"]["confidence"]
+    for name, item in zip(RADAR_COLUMNS, doc["radarData"]):
+        assert numeric[name][i] == pytest.approx(item["A"], rel=1e-12, abs=1e-12), name
+    assert numeric["predictionUpper"][i] == pytest.approx(doc["prediction"]["upper"], rel=1e-12, abs=1e-12)
+    assert numeric["predictionLower"][i] == pytest.approx(doc["prediction"]["lower"], rel=1e-12, abs=1e-12)
+    if "upside" in doc:
+        # _enrich_data 取兩位小數，欄式表保留完整精度
+        assert abs(numeric["upside"][i] - doc["upside"]) <= 0.005 + 1e-9
+    else:
+        assert math.isnan(numeric["upside"][i])
+
+
+@pytest.fixture
+def docs():
+    rng = random.Random(0)
+    return [random_doc(rng) for _ in range(2000)]
+
+
+@pytest.fixture(autouse=True)
+def percentile_state(monkeypatch):
+    # 不讀取 warm-start 快照，並在測試後還原
+    monkeypatch.setattr(radar_percentiles, "_SNAPSHOT_CHECKED", True)
+    monkeypatch.setattr(radar_percentiles, "_STATE", None)
+
+
+def test_matches_enrich_data_without_percentiles(docs):
+    table = Screener.build_table([screen_row(d) for d in docs])
+    text, numeric = enrich_columns(table.numeric, table.text["market"], None)
+    for i, doc in enumerate(docs):
+        expected = copy.deepcopy(doc)
+        StockService._enrich_data(expected)
+        assert_same(expected, text, numeric, i)
+
+
+def test_matches_enrich_data_with_market_percentiles(docs):
+    table = Screener.build_table([screen_row(d) for d in docs])
+    assert set(table.percentiles) == {"TW", "US"}
+    RadarPercentiles.load(table.percentiles)
+    ranked = 0
+    for i, doc in enumerate(docs):
+        expected = copy.deepcopy(doc)
+        StockService._enrich_data(expected)
+        assert_same(expected, table.text, table.numeric, i)
+        ranked += doc.get("marketCapValue", 0) > 0 and doc.get("price", 1) > 0
+    # 兩種雷達來源（百分位與固定公式）都有涵蓋
+    assert 0 < ranked < len(docs)
+
+
+def test_screen_filters_and_sorts_on_derived_columns(docs):
+    table = Screener.build_table([screen_row(d) for d in docs])
+    result = Screener.screen(filter='healthLabel == "優" and safetyScore > 50', sort="-safetyScore",
+                             fields="symbol,healthLabel,safetyScore", limit=500, table=table)
+    expected = []
+    RadarPercentiles.load(table.percentiles)
+    for doc in docs:
+        d = copy.deepcopy(doc)
+        StockService._enrich_data(d)
+        if d["healthLabel"] == "優" and d["radarData"][3]["A"] > 50:
+            expected.append(d["radarData"][3]["A"])
+    assert result["count"] == len(expected)
+    scores = [r["safetyScore"] for r in result["results"]]
+    assert scores == sorted(scores, reverse=True)
+    assert np.allclose(scores, [round(v, 4) for v in sorted(expected, reverse=True)[:500]])
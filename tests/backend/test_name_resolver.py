@@ -0,0 +1,78 @@
+import pytest
+
+from api.services import name_resolver
+from api.services.name_resolver import NameResolver
+
+NAMES = {
+    "2330": "台積電",
+    "2303": "聯電",
+    "2317": "鴻海",
+    "2454": "聯發科",
+    "3034": "聯詠",
+    "2412": "中華電",
+    "2002": "中鋼",
+    "AAPL": "Apple Inc.",
+    "AMD": "Advanced Micro Devices",
+    "TSM": "台積電",
+}
+
+
+@pytest.fixture(autouse=True)
+def loaded_index(monkeypatch):
+    # 以固定清單建立索引，並避免背景重載連線 DB
+    monkeypatch.setattr(name_resolver, "_LOADED", False)
+    NameResolver.load_names(NAMES)
+    monkeypatch.setattr(NameResolver, "ensure_loaded", staticmethod(lambda: None))
+
+
+def symbols(results):
+    return [r["symbol"] for r in results]
+
+
+@pytest.mark.parametrize("query, expected", (
+    ("2330", "2330"),
+    (" aapl ", "AAPL"),
+    ("鴻海", "2317"),
+    ("台積電", "TSM"),    # 同名時取較短的代號
+    ("台積", None),
+    ("9999", None),
+    ("", None),
+))
+def test_resolve_exact(query, expected):
+    assert NameResolver.resolve(query) == expected
+
+
+def test_symbol_prefix():
+    assert symbols(NameResolver.search("23")) == ["2303", "2317", "2330"]
+    assert symbols(NameResolver.search("a")) == ["AAPL", "AMD"]
+    assert symbols(NameResolver.search("23", limit=2)) == ["2303", "2317"]
+
+
+def test_name_prefix_is_case_insensitive():
+    assert symbols(NameResolver.search("advanced")) == ["AMD"]
+    assert symbols(NameResolver.search("Apple")) == ["AAPL"]
+    # 名稱前綴依名稱排序
+    assert symbols(NameResolver.search("聯")) == ["2454", "3034", "2303"]
+
+
+def test_exact_match_ranks_before_prefix_matches():
+    assert symbols(NameResolver.search("AMD")) == ["AMD"]
+    assert symbols(NameResolver.search("2330"))[0] == "2330"
+    assert NameResolver.search("台積電")[0] == {"symbol": "TSM", "name": "台積電"}
+
+
+@pytest.mark.parametrize("query, expected", (
+    ("電", ["2303", "2330", "2412", "TSM"]),  # 單字（unigram）
+    ("華電", ["2412"]),                    # 雙字（bigram）
+    ("發科", ["2454"]),                    # 名稱中段
+    ("積電", ["2330", "TSM"]),             # 多檔同名
+    ("中華電", ["2412"]),                  # 多個 bigram 取交集
+    ("華中", []),                          # 字都出現過但不相鄰
+    ("鋼鐵", []),
+))
+def test_chinese_substring_uses_gram_index(query, expected):
+    assert symbols(NameResolver.search(query)) == expected
+
+
+def test_get_names_returns_only_known_symbols():
+    assert NameResolver.get_names(["2330", "0000", "AMD"]) == {"2330": "台積電", "AMD": "Advanced Micro Devices"}
@@ -0,0 +1,129 @@
+import math
+import random
+
+import pytest
+
+from api.services import radar_percentiles
+from api.services.screener import NUMERIC_FIELDS, TEXT_FIELDS, DERIVED_FIELDS, Screener, ScreenError
+
+SECTORS = ("Finance", "Utilities", "Electronic Technology", "Retail Trade")
+
+FILTERS = (
+    "fScore >= 7 and roe > 15",
+    '(rsi < 30 or rvol > 2) and not market == "US"',
+    'sector in ("Finance", "Utilities") and upside > 20',
+    'sector not in ("Finance",) and price * 2 > sma50 + 10',
+    "roe - roa >= 5 or -eps > 1",
+    "grossMargin / netMargin > 3",
+    'sector != "Retail Trade" and 20 < rsi <= 70',
+    'healthLabel == "優" or safetyScore >= 60',
+)
+SORTS = ("-upside, roe", "roe desc", "sector, -price", "market asc, -fScore, symbol")
+
+
+def random_rows(rng, n=500):
+    """每個數值欄位都有值（比較時與逐列 Python 運算語意相同）"""
+    rows = []
+    for i in range(n):
+        symbol = str(1000 + i) if i % 2 else f"S{i}"
+        text = (symbol, symbol, "TW" if symbol.isdigit() else "US", rng.choice(SECTORS), "", "")
+        numeric = tuple(
+            float(rng.randint(0, 9)) if f == "fScore" else rng.choice((0.0, 1.0, round(rng.uniform(1, 100), 2)))
+            if f in ("grossMargin", "netMargin") else round(rng.uniform(1, 200), 2)
+            for f in NUMERIC_FIELDS
+        )
+        rows.append(text + numeric)
+    return rows
+
+
+def row_dicts(table):
+    """逐列的舊做法：每列一個 dict"""
+    names = TEXT_FIELDS + NUMERIC_FIELDS + DERIVED_FIELDS
+    columns = {f: table.column(f).tolist() for f in names}
+    return [{f: columns[f][i] for f in names} for i in range(table.size)]
+
+
+def per_row_filter(rows, expression):
+    # 參考實作，只處理測試內建的運算式；除以零的列視為不符合
+    def match(row):
+        try:
+            return bool(eval(expression, {"__builtins__": {}}, row))
+        except ZeroDivisionError:
+            return False
+    return [i for i, row in enumerate(rows) if match(row)]
+
+
+def per_row_sort(rows, idx, sort):
+    for part in reversed([p.strip() for p in sort.split(",")]):
+        tokens = part.lstrip("-").split()
+        field, descending = tokens[0], part.startswith("-") or tokens[-1] == "desc"
+        idx = sorted(idx, key=lambda i: rows[i][field], reverse=descending)
+    return idx
+
+
+@pytest.fixture(autouse=True)
+def no_snapshot(monkeypatch):
+    monkeypatch.setattr(radar_percentiles, "_SNAPSHOT_CHECKED", True)
+    monkeypatch.setattr(radar_percentiles, "_STATE", None)
+
+
+@pytest.fixture(scope="module")
+def table():
+    return Screener.build_table(random_rows(random.Random(7)))
+
+
+@pytest.mark.parametrize("expression", FILTERS)
+def test_filter_matches_per_row_evaluation(table, expression):
+    rows = row_dicts(table)
+    expected = per_row_filter(rows, expression)
+    result = Screener.screen(filter=expression, fields="symbol", limit=500, table=table)
+    assert result["count"] == len(expected)
+    assert [r["symbol"] for r in result["results"]] == [rows[i]["symbol"] for i in expected]
+
+
+@pytest.mark.parametrize("sort", SORTS)
+def test_sort_matches_per_row_sort(table, sort):
+    rows = row_dicts(table)
+    expected = per_row_sort(rows, per_row_filter(rows, FILTERS[0]), sort)
+    result = Screener.screen(filter=FILTERS[0], sort=sort, fields="symbol", limit=500, table=table)
+    assert [r["symbol"] for r in result["results"]] == [rows[i]["symbol"] for i in expected]
+
+
+def test_missing_values_never_match_and_sort_last():
+    rng = random.Random(1)
+    rows = random_rows(rng, 40)
+    roe = NUMERIC_FIELDS.index("roe") + len(TEXT_FIELDS)
+    rows[3] = rows[3][:roe] + (None,) + rows[3][roe + 1:]
+    table = Screener.build_table(rows)
+    for expression in ("roe > 0", "roe != 1", "roe not in (1, 2)", "roe == roe"):
+        symbols = [r["symbol"] for r in Screener.screen(filter=expression, fields="symbol", limit=500, table=table)["results"]]
+        assert rows[3][0] not in symbols, expression
+    for sort in ("roe", "-roe"):
+        result = Screener.screen(sort=sort, fields="symbol,roe", limit=500, table=table)["results"]
+        assert result[-1] == {"symbol": rows[3][0], "roe": None}
+
+
+@pytest.mark.parametrize("expression", (
+    '__import__("os").system("true")',
+    "price.__class__",
+    "open('/etc/passwd')",
+    "[x for x in (1, 2)]",
+    "(lambda: 1)()",
+    "roe ** 2 > 1",
+    "price if roe else 1",
+    "password > 1",
+    "roe > True",
+    "roe > None",
+    "sector > \"A\"",
+    "roe and price",
+    "x" * 1001,
+))
+def test_rejects_non_whitelisted_expressions(table, expression):
+    with pytest.raises(ScreenError):
+        Screener.screen(filter=expression, table=table)
+
+
+@pytest.mark.parametrize("sort", ("price; DROP TABLE stock_cache", "__class__", "roe sideways"))
+def test_rejects_invalid_sort_keys(table, sort):
+    with pytest.raises(ScreenError):
+        Screener.screen(sort=sort, table=table)